@@ -1,14 +1,86 @@
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
+from collections import OrderedDict
 from openai import AsyncOpenAI
 from supabase import Client
+import threading
+import time
 import sys
 import os
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils.utils import get_env_var
+from utils.doc_sources import get_source_names
 
 embedding_model = get_env_var('EMBEDDING_MODEL') or 'text-embedding-3-small'
 
+# Seconds the active versions of the documentation sources are trusted before checking them again
+DOCS_VERSION_CHECK_SECONDS = 30
+
+# Assembled pages kept in memory
+MAX_CACHED_PAGES = 256
+
+class DocumentationCache:
+    """In-process cache of documentation page lists and assembled pages.
+    
+    Entries are keyed by the active versions of their sources (see site_page_versions),
+    so they go stale as soon as the docs crawler activates a new version or a source's
+    records are cleared (which deletes its version). The versions are read at most once
+    every DOCS_VERSION_CHECK_SECONDS.
+    """
+    
+    def __init__(self):
+        self.versions: Dict[str, int] = {}
+        self.checked_at = 0.0
+        self.page_lists: Dict[Tuple, List[str]] = {}
+        self.pages: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def get_versions_key(self, supabase: Client, sources: List[str]) -> Tuple:
+        """Get the active versions of the sources as a cache key, refreshing them when they are old."""
+        if time.monotonic() - self.checked_at >= DOCS_VERSION_CHECK_SECONDS:
+            result = supabase.from_('site_page_versions').select('source, active_version').execute()
+            versions = {row['source']: row['active_version'] for row in result.data or []}
+            with self.lock:
+                if versions != self.versions:
+                    # A new version was activated or a source was cleared; entries of the old ones can't be hit anymore
+                    self.page_lists.clear()
+                    self.pages.clear()
+                    self.versions = versions
+                self.checked_at = time.monotonic()
+        return tuple((source, self.versions.get(source)) for source in sorted(sources))
+    
+    def get_page_list(self, key: Tuple) -> Optional[List[str]]:
+        with self.lock:
+            return self.page_lists.get(key)
+    
+    def set_page_list(self, key: Tuple, urls: List[str]):
+        with self.lock:
+            self.page_lists[key] = urls
+    
+    def get_page(self, key: Tuple) -> Optional[str]:
+        with self.lock:
+            content = self.pages.get(key)
+            if content is not None:
+                self.pages.move_to_end(key)
+            return content
+    
+    def set_page(self, key: Tuple, content: str):
+        with self.lock:
+            self.pages[key] = content
+            self.pages.move_to_end(key)
+            while len(self.pages) > MAX_CACHED_PAGES:
+                self.pages.popitem(last=False)
+    
+    def clear(self):
+        """Drop every entry and check the versions again on the next lookup."""
+        with self.lock:
+            self.page_lists.clear()
+            self.pages.clear()
+            self.versions = {}
+            self.checked_at = 0.0
+
+documentation_cache = DocumentationCache()
+
 async def get_embedding(text: str, embedding_client: AsyncOpenAI) -> List[float]:
     """Get embedding vector from OpenAI."""
     try:
@@ -21,7 +93,24 @@ async def get_embedding(text: str, embedding_client: AsyncOpenAI) -> List[float]
         print(f"Error getting embedding: {e}")
         return [0] * 1536  # Return zero vector on error
 
-async def retrieve_relevant_documentation_tool(supabase: Client, embedding_client: AsyncOpenAI, user_query: str) -> str:
+async def retrieve_relevant_documentation_tool(
+    supabase: Client,
+    embedding_client: AsyncOpenAI,
+    user_query: str,
+    sources: Optional[List[str]] = None
+) -> str:
+    """
+    Retrieve the documentation chunks most relevant to a query with RAG.
+    
+    Args:
+        supabase: The Supabase client
+        embedding_client: The client used to embed the query
+        user_query: The question or query
+        sources: Documentation sources to search (defaults to every enabled source)
+        
+    Returns:
+        str: The most relevant chunks, formatted
+    """
     try:
         # Get the embedding for the query
         query_embedding = await get_embedding(user_query, embedding_client)
@@ -32,7 +121,7 @@ async def retrieve_relevant_documentation_tool(supabase: Client, embedding_clien
             {
                 'query_embedding': query_embedding,
                 'match_count': 4,
-                'filter': {'source': 'pydantic_ai_docs'}
+                'sources': get_source_names(sources)
             }
         ).execute()
         
@@ -56,50 +145,61 @@ async def retrieve_relevant_documentation_tool(supabase: Client, embedding_clien
         print(f"Error retrieving documentation: {e}")
         return f"Error retrieving documentation: {str(e)}" 
 
-async def list_documentation_pages_tool(supabase: Client) -> List[str]:
+async def list_documentation_pages_tool(supabase: Client, sources: Optional[List[str]] = None) -> List[str]:
     """
-    Function to retrieve a list of all available Pydantic AI documentation pages.
+    Function to retrieve a list of all available documentation pages.
     This is called by the list_documentation_pages tool and also externally
     to fetch documentation pages for the reasoner LLM.
     
+    Args:
+        supabase: The Supabase client
+        sources: Documentation sources to list (defaults to every enabled source)
+        
     Returns:
         List[str]: List of unique URLs for all documentation pages
     """
     try:
-        # Query Supabase for unique URLs where source is pydantic_ai_docs
-        result = supabase.from_('site_pages') \
-            .select('url') \
-            .eq('metadata->>source', 'pydantic_ai_docs') \
-            .execute()
+        source_names = get_source_names(sources)
+        key = documentation_cache.get_versions_key(supabase, source_names)
+        urls = documentation_cache.get_page_list(key)
+        if urls is not None:
+            return list(urls)
         
-        if not result.data:
-            return []
-            
-        # Extract unique URLs
-        urls = sorted(set(doc['url'] for doc in result.data))
-        return urls
+        # Query Supabase for the unique URLs of the sources, deduplicated in the database
+        result = supabase.rpc('list_site_pages_urls', {'sources': source_names}).execute()
+        
+        urls = [doc['url'] for doc in result.data or []]
+        documentation_cache.set_page_list(key, urls)
+        return list(urls)
         
     except Exception as e:
         print(f"Error retrieving documentation pages: {e}")
         return []
 
-async def get_page_content_tool(supabase: Client, url: str) -> str:
+async def get_page_content_tool(supabase: Client, url: str, sources: Optional[List[str]] = None) -> str:
     """
     Retrieve the full content of a specific documentation page by combining all its chunks.
     
     Args:
         ctx: The context including the Supabase client
         url: The URL of the page to retrieve
+        sources: Documentation sources the page may belong to (defaults to every enabled source)
         
     Returns:
         str: The complete page content with all chunks combined in order
     """
     try:
+        source_names = get_source_names(sources)
+        key = (url,) + documentation_cache.get_versions_key(supabase, source_names)
+        content = documentation_cache.get_page(key)
+        if content is not None:
+            return content
+        
         # Query Supabase for all chunks of this URL, ordered by chunk_number
-        result = supabase.from_('site_pages') \
+        result = supabase.from_('active_site_pages') \
             .select('title, content, chunk_number') \
             .eq('url', url) \
-            .eq('metadata->>source', 'pydantic_ai_docs') \
+            .in_('metadata->>source', source_names) \
             .order('chunk_number') \
             .execute()
         
@@ -116,7 +216,9 @@ async def get_page_content_tool(supabase: Client, url: str) -> str:
             
         # Join everything together but limit the characters in case the page is massive (there are a coule big ones)
         # This will be improved later so if the page is too big RAG will be performed on the page itself
-        return "\n\n".join(formatted_content)[:20000]
+        content = "\n\n".join(formatted_content)[:20000]
+        documentation_cache.set_page(key, content)
+        return content
         
     except Exception as e:
         print(f"Error retrieving page content: {e}")
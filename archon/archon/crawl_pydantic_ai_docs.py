@@ -3,27 +3,39 @@ import sys
 import asyncio
 import threading
 import subprocess
-import requests
+import argparse
 import json
 import time
+import uuid
 from typing import List, Dict, Any, Optional, Callable
+from collections import deque
 from xml.etree import ElementTree
 from dataclasses import dataclass
 from datetime import datetime, timezone
-from urllib.parse import urlparse
+from urllib.parse import urlparse, urljoin
 from dotenv import load_dotenv
 from openai import AsyncOpenAI
 import re
+import httpx
 import html2text
 
 # Add the parent directory to sys.path to allow importing from the parent directory
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils.utils import get_env_var, get_clients
+from utils.markdown_chunker import chunk_markdown
+from utils.doc_sources import DocSource, get_doc_source, get_doc_sources
+from utils.crawl_state import get_crawl_state_store, COMPLETED, FAILED, ABANDONED, DONE, URL_FAILED
 
 from crawl4ai import AsyncWebCrawler, BrowserConfig, CrawlerRunConfig, CacheMode
 
 load_dotenv()
 
+# Log lines kept by a progress tracker; older ones are dropped
+MAX_LOG_LINES = 500
+
+# Minimum seconds between progress callbacks, so the UI isn't re-rendered for every page
+PROGRESS_CALLBACK_INTERVAL = 1.0
+
 # Initialize embedding and Supabase clients
 embedding_client, supabase = get_clients()
 
@@ -44,12 +56,10 @@ if provider == "Ollama":
 else:
     llm_client = AsyncOpenAI(base_url=base_url, api_key=api_key)
 
-# Initialize HTML to Markdown converter
-html_converter = html2text.HTML2Text()
-html_converter.ignore_links = False
-html_converter.ignore_images = False
-html_converter.ignore_tables = False
-html_converter.body_width = 0  # No wrapping
+# Headers sent with every request to the docs site
+HTTP_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
 
 @dataclass
 class ProcessedChunk:
@@ -77,10 +87,11 @@ class CrawlProgressTracker:
         self.urls_succeeded = 0
         self.urls_failed = 0
         self.chunks_stored = 0
-        self.logs = []
+        self.logs = deque(maxlen=MAX_LOG_LINES)
         self.is_running = False
         self.start_time = None
         self.end_time = None
+        self.last_callback_time = 0.0
     
     def log(self, message: str):
         """Add a log message and update progress."""
@@ -89,8 +100,15 @@ class CrawlProgressTracker:
         self.logs.append(log_entry)
         print(message)  # Also print to console
         
-        # Call the progress callback if provided
-        if self.progress_callback:
+        self.update()
+    
+    def update(self, force: bool = False):
+        """Call the progress callback, at most once per PROGRESS_CALLBACK_INTERVAL unless forced."""
+        if not self.progress_callback:
+            return
+        now = time.monotonic()
+        if force or now - self.last_callback_time >= PROGRESS_CALLBACK_INTERVAL:
+            self.last_callback_time = now
             self.progress_callback(self.get_status())
     
     def start(self):
@@ -98,10 +116,7 @@ class CrawlProgressTracker:
         self.is_running = True
         self.start_time = datetime.now()
         self.log("Crawling process started")
-        
-        # Call the progress callback if provided
-        if self.progress_callback:
-            self.progress_callback(self.get_status())
+        self.update(force=True)
     
     def complete(self):
         """Mark the crawling process as completed."""
@@ -110,10 +125,7 @@ class CrawlProgressTracker:
         duration = self.end_time - self.start_time if self.start_time else None
         duration_str = str(duration).split('.')[0] if duration else "unknown"
         self.log(f"Crawling process completed in {duration_str}")
-        
-        # Call the progress callback if provided
-        if self.progress_callback:
-            self.progress_callback(self.get_status())
+        self.update(force=True)
     
     def get_status(self) -> Dict[str, Any]:
         """Get the current status of the crawling process."""
@@ -125,7 +137,7 @@ class CrawlProgressTracker:
             "urls_failed": self.urls_failed,
             "chunks_stored": self.chunks_stored,
             "progress_percentage": (self.urls_processed / self.urls_found * 100) if self.urls_found > 0 else 0,
-            "logs": self.logs,
+            "logs": list(self.logs),
             "start_time": self.start_time,
             "end_time": self.end_time
         }
@@ -140,60 +152,57 @@ class CrawlProgressTracker:
         """Return True if the crawling process completed successfully."""
         return self.is_completed and self.urls_failed == 0 and self.urls_succeeded > 0
 
-def chunk_text(text: str, chunk_size: int = 5000) -> List[str]:
-    """Split text into chunks, respecting code blocks and paragraphs."""
-    chunks = []
-    start = 0
-    text_length = len(text)
-
-    while start < text_length:
-        # Calculate end position
-        end = start + chunk_size
-
-        # If we're at the end of the text, just take what's left
-        if end >= text_length:
-            chunks.append(text[start:].strip())
-            break
-
-        # Try to find a code block boundary first (```)
-        chunk = text[start:end]
-        code_block = chunk.rfind('```')
-        if code_block != -1 and code_block > chunk_size * 0.3:
-            end = start + code_block
-
-        # If no code block, try to break at a paragraph
-        elif '\n\n' in chunk:
-            # Find the last paragraph break
-            last_break = chunk.rfind('\n\n')
-            if last_break > chunk_size * 0.3:  # Only break if we're past 30% of chunk_size
-                end = start + last_break
-
-        # If no paragraph break, try to break at a sentence
-        elif '. ' in chunk:
-            # Find the last sentence break
-            last_period = chunk.rfind('. ')
-            if last_period > chunk_size * 0.3:  # Only break if we're past 30% of chunk_size
-                end = start + last_period + 1
-
-        # Extract chunk and clean it up
-        chunk = text[start:end].strip()
-        if chunk:
-            chunks.append(chunk)
-
-        # Move start position for next chunk
-        start = max(start + 1, end)
-
-    return chunks
-
-async def get_title_and_summary(chunk: str, url: str) -> Dict[str, str]:
+class TokenBucket:
+    """Async token-bucket rate limiter shared by the tasks of one crawl."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """Initialize the limiter.
+
+        Args:
+            rate: Tokens added per second
+            capacity: Largest burst allowed (defaults to one second worth of tokens)
+        """
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, tokens: float = 1.0):
+        """Wait until the given number of tokens is available and take them."""
+        # Waiters queue on the lock, so tokens are handed out in arrival order
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+def get_crawl_settings() -> Dict[str, Any]:
+    """Get the crawler's concurrency, rate limit and batch size settings."""
+    return {
+        "max_concurrent": int(get_env_var("CRAWL_MAX_CONCURRENCY") or 10),
+        "llm_requests_per_minute": float(get_env_var("LLM_REQUESTS_PER_MINUTE") or 500),
+        "embedding_batch_size": int(get_env_var("EMBEDDING_BATCH_SIZE") or 100),
+        "insert_batch_size": int(get_env_var("INSERT_BATCH_SIZE") or 500),
+        "reindex_min_ratio": float(get_env_var("REINDEX_MIN_RATIO") or 0.5),
+        "reindex_lease_seconds": int(get_env_var("REINDEX_LEASE_SECONDS") or 600)
+    }
+
+async def get_title_and_summary(chunk: str, url: str, limiter: Optional[TokenBucket] = None) -> Dict[str, str]:
     """Extract title and summary using GPT-4."""
     system_prompt = """You are an AI that extracts titles and summaries from documentation chunks.
     Return a JSON object with 'title' and 'summary' keys.
     For the title: If this seems like the start of a document, extract its title. If it's a middle chunk, derive a descriptive title.
     For the summary: Create a concise summary of the main points in this chunk.
     Keep both title and summary concise but informative."""
-    
+
     try:
+        if limiter:
+            await limiter.acquire()
         response = await llm_client.chat.completions.create(
             model=get_env_var("PRIMARY_MODEL") or "gpt-4o-mini",
             messages=[
@@ -209,229 +218,554 @@ async def get_title_and_summary(chunk: str, url: str) -> Dict[str, str]:
 
 async def get_embedding(text: str) -> List[float]:
     """Get embedding vector from OpenAI."""
-    try:
-        response = await embedding_client.embeddings.create(
-            model=embedding_model,
-            input=text
-        )
-        return response.data[0].embedding
-    except Exception as e:
-        print(f"Error getting embedding: {e}")
-        return [0] * 1536  # Return zero vector on error
+    return (await get_embeddings_batch([text]))[0]
 
-async def process_chunk(chunk: str, chunk_number: int, url: str) -> ProcessedChunk:
-    """Process a single chunk of text."""
-    # Get title and summary
-    extracted = await get_title_and_summary(chunk, url)
-    
-    # Get embedding
-    embedding = await get_embedding(chunk)
-    
-    # Create metadata
-    metadata = {
-        "source": "pydantic_ai_docs",
-        "chunk_size": len(chunk),
-        "crawled_at": datetime.now(timezone.utc).isoformat(),
-        "url_path": urlparse(url).path
-    }
-    
-    return ProcessedChunk(
-        url=url,
-        chunk_number=chunk_number,
-        title=extracted['title'],
-        summary=extracted['summary'],
-        content=chunk,  # Store the original chunk content
-        metadata=metadata,
-        embedding=embedding
+async def get_embeddings_batch(texts: List[str], batch_size: int = 100) -> List[List[float]]:
+    """Get embedding vectors for many texts, sending up to batch_size texts per request.
+
+    Raises if a batch can't be embedded, so the page fails instead of being stored
+    with vectors that match nothing.
+    """
+    embeddings = []
+    for i in range(0, len(texts), batch_size):
+        batch = texts[i:i + batch_size]
+        try:
+            response = await embedding_client.embeddings.create(
+                model=embedding_model,
+                input=batch
+            )
+        except Exception as e:
+            raise Exception(f"Error getting embeddings: {str(e)}")
+        embeddings.extend(item.embedding for item in sorted(response.data, key=lambda item: item.index))
+    return embeddings
+
+async def process_chunks(
+    chunks: List[str],
+    url: str,
+    limiter: Optional[TokenBucket] = None,
+    embedding_batch_size: int = 100,
+    source_name: str = "pydantic_ai_docs"
+) -> List[ProcessedChunk]:
+    """Process the chunks of a document: titles and summaries concurrently, embeddings in batches."""
+    extracted, embeddings = await asyncio.gather(
+        asyncio.gather(*[get_title_and_summary(chunk, url, limiter) for chunk in chunks]),
+        get_embeddings_batch(chunks, embedding_batch_size)
     )
 
-async def insert_chunk(chunk: ProcessedChunk):
-    """Insert a processed chunk into Supabase."""
-    try:
-        data = {
+    crawled_at = datetime.now(timezone.utc).isoformat()
+    url_path = urlparse(url).path
+    return [
+        ProcessedChunk(
+            url=url,
+            chunk_number=i,
+            title=extracted[i]['title'],
+            summary=extracted[i]['summary'],
+            content=chunk,  # Store the original chunk content
+            metadata={
+                "source": source_name,
+                "chunk_size": len(chunk),
+                "crawled_at": crawled_at,
+                "url_path": url_path
+            },
+            embedding=embeddings[i]
+        )
+        for i, chunk in enumerate(chunks)
+    ]
+
+async def insert_chunks(chunks: List[ProcessedChunk], batch_size: int = 500, version: int = 0) -> int:
+    """Insert processed chunks of a source version into Supabase in bulk and return the number stored."""
+    rows = [
+        {
             "url": chunk.url,
             "chunk_number": chunk.chunk_number,
             "title": chunk.title,
             "summary": chunk.summary,
             "content": chunk.content,
             "metadata": chunk.metadata,
-            "embedding": chunk.embedding
+            "embedding": chunk.embedding,
+            "version": version
         }
-        
-        result = supabase.table("site_pages").insert(data).execute()
-        print(f"Inserted chunk {chunk.chunk_number} for {chunk.url}")
-        return result
-    except Exception as e:
-        print(f"Error inserting chunk: {e}")
-        return None
+        for chunk in chunks
+    ]
+
+    stored = 0
+    for i in range(0, len(rows), batch_size):
+        batch = rows[i:i + batch_size]
+        try:
+            # The Supabase client is synchronous, so keep the request off the event loop
+            await asyncio.to_thread(
+                lambda: supabase.table("site_pages").upsert(batch, on_conflict="url,chunk_number,version").execute()
+            )
+            stored += len(batch)
+        except Exception as e:
+            print(f"Error inserting chunks: {e}")
+    return stored
+
+async def process_and_store_document(
+    url: str,
+    markdown: str,
+    tracker: Optional[CrawlProgressTracker] = None,
+    limiter: Optional[TokenBucket] = None,
+    settings: Optional[Dict[str, Any]] = None,
+    version: int = 0,
+    source: Optional[DocSource] = None
+) -> int:
+    """Process a document, store its chunks in bulk and return the number stored."""
+    settings = settings or get_crawl_settings()
+    source = source or get_default_source()
 
-async def process_and_store_document(url: str, markdown: str, tracker: Optional[CrawlProgressTracker] = None):
-    """Process a document and store its chunks in parallel."""
     # Split into chunks
-    chunks = chunk_text(markdown)
-    
+    chunks = chunk_markdown(markdown, max_size=source.chunk_size, overlap=source.chunk_overlap)
+    if not chunks:
+        return 0
+
     if tracker:
         tracker.log(f"Split document into {len(chunks)} chunks for {url}")
-        # Ensure UI gets updated
-        if tracker.progress_callback:
-            tracker.progress_callback(tracker.get_status())
     else:
         print(f"Split document into {len(chunks)} chunks for {url}")
-    
-    # Process chunks in parallel
-    tasks = [
-        process_chunk(chunk, i, url) 
-        for i, chunk in enumerate(chunks)
-    ]
-    processed_chunks = await asyncio.gather(*tasks)
-    
-    if tracker:
-        tracker.log(f"Processed {len(processed_chunks)} chunks for {url}")
-        # Ensure UI gets updated
-        if tracker.progress_callback:
-            tracker.progress_callback(tracker.get_status())
-    else:
-        print(f"Processed {len(processed_chunks)} chunks for {url}")
-    
-    # Store chunks in parallel
-    insert_tasks = [
-        insert_chunk(chunk) 
-        for chunk in processed_chunks
-    ]
-    await asyncio.gather(*insert_tasks)
-    
+
+    processed_chunks = await process_chunks(chunks, url, limiter, settings["embedding_batch_size"], source.name)
+    stored = await insert_chunks(processed_chunks, settings["insert_batch_size"], version)
+    if stored < len(processed_chunks):
+        raise Exception(f"Only {stored} of {len(processed_chunks)} chunks were stored")
+
     if tracker:
-        tracker.chunks_stored += len(processed_chunks)
-        tracker.log(f"Stored {len(processed_chunks)} chunks for {url}")
-        # Ensure UI gets updated
-        if tracker.progress_callback:
-            tracker.progress_callback(tracker.get_status())
+        tracker.chunks_stored += stored
+        tracker.log(f"Stored {stored} chunks for {url}")
     else:
-        print(f"Stored {len(processed_chunks)} chunks for {url}")
+        print(f"Stored {stored} chunks for {url}")
+    return stored
+
+def html_to_markdown(html: str) -> str:
+    """Convert HTML to markdown."""
+    # HTML2Text keeps state while converting, so use a new converter for every page
+    converter = html2text.HTML2Text()
+    converter.ignore_links = False
+    converter.ignore_images = False
+    converter.ignore_tables = False
+    converter.body_width = 0  # No wrapping
+    markdown = converter.handle(html)
+
+    # Clean up the markdown
+    return re.sub(r'\n{3,}', '\n\n', markdown)  # Remove excessive newlines
+
+def create_http_client(max_concurrent: int = 10) -> httpx.AsyncClient:
+    """Create an async HTTP client that keeps connections to the docs site open between requests."""
+    return httpx.AsyncClient(
+        headers=HTTP_HEADERS,
+        timeout=httpx.Timeout(30.0),
+        follow_redirects=True,
+        limits=httpx.Limits(max_connections=max_concurrent, max_keepalive_connections=max_concurrent)
+    )
 
-def fetch_url_content(url: str) -> str:
-    """Fetch content from a URL using requests and convert to markdown."""
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-    
+async def fetch_url_content(http_client: httpx.AsyncClient, url: str) -> str:
+    """Fetch content from a URL and convert it to markdown."""
     try:
-        response = requests.get(url, headers=headers, timeout=30)
+        response = await http_client.get(url)
         response.raise_for_status()
-        
-        # Convert HTML to Markdown
-        markdown = html_converter.handle(response.text)
-        
-        # Clean up the markdown
-        markdown = re.sub(r'\n{3,}', '\n\n', markdown)  # Remove excessive newlines
-        
-        return markdown
     except Exception as e:
         raise Exception(f"Error fetching {url}: {str(e)}")
 
-async def crawl_parallel_with_requests(urls: List[str], tracker: Optional[CrawlProgressTracker] = None, max_concurrent: int = 5):
-    """Crawl multiple URLs in parallel with a concurrency limit using direct HTTP requests."""
+    # Converting large pages takes a while, so keep it off the event loop
+    return await asyncio.to_thread(html_to_markdown, response.text)
+
+async def crawl_parallel_with_requests(
+    urls: List[str],
+    tracker: Optional[CrawlProgressTracker] = None,
+    max_concurrent: Optional[int] = None,
+    http_client: Optional[httpx.AsyncClient] = None,
+    version: int = 0,
+    source: Optional[DocSource] = None,
+    limiter: Optional[TokenBucket] = None,
+    crawl_id: Optional[int] = None
+) -> Dict[str, int]:
+    """Crawl multiple URLs of a documentation source in parallel with a concurrency limit using direct HTTP requests.
+    
+    With a crawl_id, the outcome of every URL is recorded in the crawl state store.
+    
+    Returns:
+        The number of URLs that succeeded and failed and of chunks stored
+    """
+    settings = get_crawl_settings()
+    source = source or get_default_source()
+    max_concurrent = max_concurrent or source.max_concurrent
+
     # Create a semaphore to limit concurrency
     semaphore = asyncio.Semaphore(max_concurrent)
-    
-    async def process_url(url: str):
+    # Title and summary requests of every page share one rate limit, across sources when given one
+    limiter = limiter or TokenBucket(settings["llm_requests_per_minute"] / 60)
+    stats = {"urls_succeeded": 0, "urls_failed": 0, "chunks_stored": 0}
+    state = get_crawl_state_store() if crawl_id is not None else None
+
+    async def process_url(client: httpx.AsyncClient, url: str):
         async with semaphore:
             if tracker:
                 tracker.log(f"Crawling: {url}")
-                # Ensure UI gets updated
-                if tracker.progress_callback:
-                    tracker.progress_callback(tracker.get_status())
             else:
                 print(f"Crawling: {url}")
-            
+
             try:
-                # Use a thread pool to run the blocking HTTP request
-                loop = asyncio.get_running_loop()
-                if tracker:
-                    tracker.log(f"Fetching content from: {url}")
-                else:
-                    print(f"Fetching content from: {url}")
-                markdown = await loop.run_in_executor(None, fetch_url_content, url)
-                
+                markdown = await fetch_url_content(client, url)
+
                 if markdown:
                     if tracker:
-                        tracker.urls_succeeded += 1
                         tracker.log(f"Successfully crawled: {url}")
-                        # Ensure UI gets updated
-                        if tracker.progress_callback:
-                            tracker.progress_callback(tracker.get_status())
                     else:
                         print(f"Successfully crawled: {url}")
-                    
-                    await process_and_store_document(url, markdown, tracker)
+
+                    stored = await process_and_store_document(url, markdown, tracker, limiter, settings, version, source)
+                    stats["chunks_stored"] += stored
+                    stats["urls_succeeded"] += 1
+                    if tracker:
+                        tracker.urls_succeeded += 1
+                    if crawl_id is not None:
+                        state.mark_url(crawl_id, url, DONE, stored)
                 else:
+                    stats["urls_failed"] += 1
+                    if crawl_id is not None:
+                        state.mark_url(crawl_id, url, URL_FAILED, error="No content retrieved")
                     if tracker:
                         tracker.urls_failed += 1
                         tracker.log(f"Failed: {url} - No content retrieved")
-                        # Ensure UI gets updated
-                        if tracker.progress_callback:
-                            tracker.progress_callback(tracker.get_status())
                     else:
                         print(f"Failed: {url} - No content retrieved")
             except Exception as e:
+                stats["urls_failed"] += 1
+                if crawl_id is not None:
+                    state.mark_url(crawl_id, url, URL_FAILED, error=str(e))
                 if tracker:
                     tracker.urls_failed += 1
                     tracker.log(f"Error processing {url}: {str(e)}")
-                    # Ensure UI gets updated
-                    if tracker.progress_callback:
-                        tracker.progress_callback(tracker.get_status())
                 else:
                     print(f"Error processing {url}: {str(e)}")
             finally:
                 if tracker:
                     tracker.urls_processed += 1
-                    # Ensure UI gets updated
-                    if tracker.progress_callback:
-                        tracker.progress_callback(tracker.get_status())
+                    tracker.update()
 
-        time.sleep(2)
-    
     # Process all URLs in parallel with limited concurrency
     if tracker:
-        tracker.log(f"Processing {len(urls)} URLs with concurrency {max_concurrent}")
-        # Ensure UI gets updated
-        if tracker.progress_callback:
-            tracker.progress_callback(tracker.get_status())
+        tracker.log(f"Processing {len(urls)} {source.name} URLs with concurrency {max_concurrent}")
     else:
-        print(f"Processing {len(urls)} URLs with concurrency {max_concurrent}")
-    await asyncio.gather(*[process_url(url) for url in urls])
+        print(f"Processing {len(urls)} {source.name} URLs with concurrency {max_concurrent}")
 
-def get_pydantic_ai_docs_urls() -> List[str]:
-    """Get URLs from Pydantic AI docs sitemap."""
-    sitemap_url = "https://ai.pydantic.dev/sitemap.xml"
+    if http_client:
+        await asyncio.gather(*[process_url(http_client, url) for url in urls])
+    else:
+        async with create_http_client(max_concurrent) as client:
+            await asyncio.gather(*[process_url(client, url) for url in urls])
+    return stats
+
+def get_default_source() -> DocSource:
+    """Get the Pydantic AI docs source, which the crawler used exclusively before sources were configurable."""
+    return get_doc_source("pydantic_ai_docs") or DocSource(
+        name="pydantic_ai_docs",
+        title="Pydantic AI",
+        sitemaps=["https://ai.pydantic.dev/sitemap.xml"]
+    )
+
+async def get_sitemap_urls(http_client: httpx.AsyncClient, sitemap_url: str) -> List[str]:
+    """Get the page URLs of a sitemap, following the sitemaps of a sitemap index."""
+    response = await http_client.get(sitemap_url)
+    response.raise_for_status()
+
+    # Parse the XML
+    root = ElementTree.fromstring(response.content)
+    namespace = {'ns': 'http://www.sitemaps.org/schemas/sitemap/0.9'}
+    locations = [loc.text.strip() for loc in root.findall('.//ns:loc', namespace) if loc.text]
+
+    if root.tag.endswith('sitemapindex'):
+        nested = await asyncio.gather(*[get_sitemap_urls(http_client, url) for url in locations])
+        return [url for urls in nested for url in urls]
+    return locations
+
+async def get_llms_txt_urls(http_client: httpx.AsyncClient, llms_txt_url: str) -> List[str]:
+    """Get the page URLs linked from an llms.txt file."""
+    response = await http_client.get(llms_txt_url)
+    response.raise_for_status()
+
+    links = re.findall(r'\[[^\]]*\]\(([^)\s]+)\)', response.text)
+    urls = [urljoin(llms_txt_url, link) for link in links]
+    return [url for url in urls if urlparse(url).scheme in ("http", "https")]
+
+async def get_source_urls(source: DocSource, http_client: Optional[httpx.AsyncClient] = None) -> List[str]:
+    """Get the URLs of a documentation source from its sitemaps and llms.txt files."""
+    if not http_client:
+        async with create_http_client() as client:
+            return await get_source_urls(source, client)
+
+    urls = []
+    for url in source.sitemaps:
+        try:
+            urls.extend(await get_sitemap_urls(http_client, url))
+        except Exception as e:
+            print(f"Error fetching sitemap {url}: {e}")
+    for url in source.llms_txt:
+        try:
+            urls.extend(await get_llms_txt_urls(http_client, url))
+        except Exception as e:
+            print(f"Error fetching llms.txt {url}: {e}")
+    # Entry points often list the same page more than once
+    return list(dict.fromkeys(urls))
+
+def clear_existing_records(source: str = "pydantic_ai_docs"):
+    """Clear all existing records of a documentation source from the site_pages table.
+    
+    The source's site_page_versions row is deleted too, so caches keyed by its active
+    version (see agent_tools.DocumentationCache) drop the cleared pages.
+    """
     try:
-        response = requests.get(sitemap_url)
-        response.raise_for_status()
+        result = supabase.table("site_pages").delete().eq("metadata->>source", source).execute()
+        supabase.table("site_page_versions").delete().eq("source", source).execute()
+        print(f"Cleared existing {source} records from site_pages")
+        return result
+    except Exception as e:
+        print(f"Error clearing existing records: {e}")
+        return None
+
+def delete_inactive_versions(source: str, batch_size: int = 1000) -> int:
+    """Delete the chunks of a source outside its active version in batches and return how many were deleted."""
+    total = 0
+    while True:
+        result = supabase.rpc(
+            'delete_inactive_site_pages',
+            {'source_name': source, 'batch_size': batch_size}
+        ).execute()
+        deleted = result.data or 0
+        total += deleted
+        if deleted < batch_size:
+            return total
+
+def begin_reindex(source: str, holder: str, resume_version: Optional[int] = None, lease_seconds: int = 600) -> int:
+    """Take the lease on re-indexing a source and get the version to crawl it into.
+    
+    Only the holder of the lease writes to the version after the active one, so a crawl
+    started elsewhere (e.g. the UI and the refresh schedule) can't delete or overwrite it.
+    If resume_version is still the version after the active one, the interrupted crawl
+    into it continues. Otherwise chunks left behind by earlier re-indexes that never
+    finished are deleted first.
+    
+    Args:
+        source: The documentation source
+        holder: ID of this crawl, used to renew and release the lease
+        resume_version: Version of an interrupted crawl of the source
+        lease_seconds: How long the lease lasts without being renewed
         
-        # Parse the XML
-        root = ElementTree.fromstring(response.content)
+    Returns:
+        The version to crawl into
         
-        # Extract all URLs from the sitemap
-        namespace = {'ns': 'http://www.sitemaps.org/schemas/sitemap/0.9'}
-        urls = [loc.text for loc in root.findall('.//ns:loc', namespace)]
+    Raises:
+        Exception: If another crawl holds the lease
+    """
+    version = renew_reindex_lease(source, holder, lease_seconds)
+    if resume_version != version:
+        delete_inactive_versions(source)
+    return version
+
+def renew_reindex_lease(source: str, holder: str, lease_seconds: int = 600) -> int:
+    """Take or renew the lease on re-indexing a source and return the version to crawl into."""
+    result = supabase.rpc(
+        'begin_site_pages_reindex',
+        {'source_name': source, 'holder': holder, 'lease_seconds': lease_seconds}
+    ).execute()
+    return result.data
+
+def end_reindex(source: str, holder: str) -> None:
+    """Release the lease on re-indexing a source."""
+    supabase.rpc('end_site_pages_reindex', {'source_name': source, 'holder': holder}).execute()
+
+async def keep_reindex_lease(source: str, holder: str, lease_seconds: int, log: Callable[[str], None]):
+    """Renew the lease on re-indexing a source well before it expires, until cancelled."""
+    while True:
+        await asyncio.sleep(lease_seconds / 3)
+        try:
+            await asyncio.to_thread(renew_reindex_lease, source, holder, lease_seconds)
+        except Exception as e:
+            log(f"Error renewing the re-index lease of {source}: {str(e)}")
+
+def count_version_chunks(source: str, version: int) -> int:
+    """Count the chunks stored for a version of a source."""
+    result = supabase.table("site_pages") \
+        .select("id", count="exact") \
+        .eq("metadata->>source", source) \
+        .eq("version", version) \
+        .limit(1) \
+        .execute()
+    return result.count or 0
+
+def activate_version(source: str, version: int, min_chunks: int) -> int:
+    """Atomically make a version of a source the one retrieval reads, and return its number of chunks.
+    
+    Raises if the version has fewer than min_chunks chunks.
+    """
+    result = supabase.rpc(
+        'activate_site_pages_version',
+        {'source_name': source, 'new_version': version, 'min_chunks': min_chunks}
+    ).execute()
+    return result.data
+
+def finish_reindex(source: str, version: int, stats: Dict[str, int], min_ratio: float, log: Callable[[str], None]) -> bool:
+    """Verify a newly crawled version of a source, switch to it and delete the previous one.
+    
+    The new version is only activated if every chunk the crawl stored is in the database
+    and it has at least min_ratio times the chunks of the active version. Otherwise it is
+    deleted and the active version stays in place.
+    
+    Args:
+        source: The documentation source
+        version: The version that was crawled
+        stats: Crawl statistics returned by crawl_parallel_with_requests
+        min_ratio: Smallest acceptable ratio of new to previous chunk counts
+        log: Function to report progress with
         
-        return urls
-    except Exception as e:
-        print(f"Error fetching sitemap: {e}")
+    Returns:
+        True if the new version was activated
+    """
+    stored = count_version_chunks(source, version)
+    previous = count_version_chunks(source, version - 1)
+
+    problem = None
+    if stats["urls_succeeded"] == 0 or stored == 0:
+        problem = "no pages were stored"
+    elif stored < stats["chunks_stored"]:
+        problem = f"only {stored} of {stats['chunks_stored']} stored chunks were found"
+    elif stored < previous * min_ratio:
+        problem = f"it has {stored} chunks against {previous} in the active version"
+
+    if problem:
+        log(f"Not activating version {version} of {source}: {problem}. Keeping the active version.")
+        delete_inactive_versions(source)
+        return False
+
+    activate_version(source, version, stored)
+    log(f"Activated version {version} of {source} with {stored} chunks")
+    deleted = delete_inactive_versions(source)
+    log(f"Deleted {deleted} chunks of the previous version")
+    return True
+
+def resolve_sources(sources: Optional[List[str]] = None) -> List[DocSource]:
+    """Get the configured sources with the given names, or every enabled source."""
+    if not sources:
+        return get_doc_sources()
+    resolved = []
+    for name in sources:
+        source = get_doc_source(name)
+        if source:
+            resolved.append(source)
+        else:
+            print(f"Unknown documentation source: {name}")
+    return resolved
+
+def get_due_sources(sources: Optional[List[str]] = None) -> List[DocSource]:
+    """Get the sources whose refresh schedule says they should be re-crawled now.
+    
+    A source is due if it was never crawled or its active version is older than its
+    refresh_hours. Sources without refresh_hours are only crawled on demand.
+    """
+    candidates = [source for source in resolve_sources(sources) if source.refresh_hours]
+    if not candidates:
         return []
 
-def clear_existing_records():
-    """Clear all existing records with source='pydantic_ai_docs' from the site_pages table."""
+    result = supabase.table("site_page_versions") \
+        .select("source, active_version, updated_at") \
+        .in_("source", [source.name for source in candidates]) \
+        .execute()
+    versions = {row["source"]: row for row in result.data or []}
+
+    now = datetime.now(timezone.utc)
+    due = []
+    for source in candidates:
+        row = versions.get(source.name)
+        if not row or row["active_version"] == 0:
+            due.append(source)
+            continue
+        updated_at = datetime.fromisoformat(row["updated_at"].replace("Z", "+00:00"))
+        if (now - updated_at).total_seconds() >= source.refresh_hours * 3600:
+            due.append(source)
+    return due
+
+async def crawl_source(
+    source: DocSource,
+    http_client: httpx.AsyncClient,
+    limiter: TokenBucket,
+    settings: Dict[str, Any],
+    tracker: Optional[CrawlProgressTracker] = None
+) -> bool:
+    """Re-index one documentation source into a new version and switch to it once verified.
+    
+    Errors are logged and fail this source's crawl without affecting other sources.
+    
+    Returns:
+        True if the new version was activated
+    """
+    log = tracker.log if tracker else print
+    state = get_crawl_state_store()
+    holder = str(uuid.uuid4())
+    lease_seconds = settings["reindex_lease_seconds"]
+    
+    crawl_id = None
+    heartbeat = None
     try:
-        result = supabase.table("site_pages").delete().eq("metadata->>source", "pydantic_ai_docs").execute()
-        print("Cleared existing pydantic_ai_docs records from site_pages")
-        return result
+        # Crawl into a new version while retrieval keeps reading the active one,
+        # or continue an interrupted crawl if its version is still the next one
+        unfinished = state.get_unfinished(source.name)
+        version = await asyncio.to_thread(
+            begin_reindex, source.name, holder, unfinished["version"] if unfinished else None, lease_seconds
+        )
+        heartbeat = asyncio.create_task(keep_reindex_lease(source.name, holder, lease_seconds, log))
+        if unfinished and unfinished["version"] == version:
+            crawl_id = unfinished["id"]
+            log(f"Resuming the crawl into version {version} of {source.title} ({source.name})")
+        else:
+            if unfinished:
+                state.finish_crawl(unfinished["id"], ABANDONED)
+            crawl_id = state.start_crawl(source.name, version)
+            log(f"Crawling into version {version} of {source.title} ({source.name})")
+    
+        urls = await get_source_urls(source, http_client)
+        if not urls:
+            log(f"No URLs found to crawl for {source.name}")
+            return False
+    
+        state.add_urls(crawl_id, urls)
+        done = state.get_done_urls(crawl_id)
+        remaining = [url for url in urls if url not in done]
+        if tracker:
+            tracker.urls_found += len(urls)
+            tracker.urls_processed += len(urls) - len(remaining)
+            tracker.urls_succeeded += len(urls) - len(remaining)
+            tracker.chunks_stored += sum(done.values())
+        log(f"Found {len(urls)} URLs to crawl for {source.name}, {len(remaining)} remaining")
+    
+        stats = await crawl_parallel_with_requests(remaining, tracker, source.max_concurrent, http_client, version, source, limiter, crawl_id)
+        # Pages stored before an interruption are part of the new version too
+        stats["urls_succeeded"] += len(done)
+        stats["chunks_stored"] += sum(done.values())
+    
+        activated = await asyncio.to_thread(finish_reindex, source.name, version, stats, settings["reindex_min_ratio"], log)
+        state.finish_crawl(crawl_id, COMPLETED if activated else FAILED)
+        return activated
     except Exception as e:
-        print(f"Error clearing existing records: {e}")
-        return None
+        # Sources crawl side by side, so one failing mustn't stop the others
+        log(f"Error crawling {source.name}: {str(e)}")
+        if crawl_id is not None:
+            state.finish_crawl(crawl_id, FAILED)
+        return False
+    finally:
+        if heartbeat:
+            heartbeat.cancel()
+            try:
+                await asyncio.to_thread(end_reindex, source.name, holder)
+            except Exception as e:
+                log(f"Error releasing the re-index lease of {source.name}: {str(e)}")
 
-async def main_with_requests(tracker: Optional[CrawlProgressTracker] = None):
-    """Main function using direct HTTP requests instead of browser automation."""
+async def main_with_requests(tracker: Optional[CrawlProgressTracker] = None, sources: Optional[List[str]] = None):
+    """Main function using direct HTTP requests instead of browser automation.
+    
+    Args:
+        tracker: Progress tracker
+        sources: Names of the documentation sources to crawl (defaults to every enabled source)
+    """
     try:
         # Start tracking if tracker is provided
         if tracker:
@@ -439,40 +773,23 @@ async def main_with_requests(tracker: Optional[CrawlProgressTracker] = None):
         else:
             print("Starting crawling process...")
         
-        # Clear existing records first
-        if tracker:
-            tracker.log("Clearing existing Pydantic AI docs records...")
-        else:
-            print("Clearing existing Pydantic AI docs records...")
-        clear_existing_records()
-        if tracker:
-            tracker.log("Existing records cleared")
-        else:
-            print("Existing records cleared")
-        
-        # Get URLs from Pydantic AI docs
-        if tracker:
-            tracker.log("Fetching URLs from Pydantic AI sitemap...")
-        else:
-            print("Fetching URLs from Pydantic AI sitemap...")
-        urls = get_pydantic_ai_docs_urls()
-        
-        if not urls:
+        doc_sources = resolve_sources(sources)
+        if not doc_sources:
             if tracker:
-                tracker.log("No URLs found to crawl")
+                tracker.log("No documentation sources to crawl")
                 tracker.complete()
             else:
-                print("No URLs found to crawl")
+                print("No documentation sources to crawl")
             return
         
-        if tracker:
-            tracker.urls_found = len(urls)
-            tracker.log(f"Found {len(urls)} URLs to crawl")
-        else:
-            print(f"Found {len(urls)} URLs to crawl")
-        
-        # Crawl the URLs using direct HTTP requests
-        await crawl_parallel_with_requests(urls, tracker)
+        settings = get_crawl_settings()
+        # Sources crawl concurrently but share the connection pool and the LLM rate limit
+        limiter = TokenBucket(settings["llm_requests_per_minute"] / 60)
+        async with create_http_client(settings["max_concurrent"]) as http_client:
+            await asyncio.gather(*[
+                crawl_source(source, http_client, limiter, settings, tracker)
+                for source in doc_sources
+            ])
         
         # Mark as complete if tracker is provided
         if tracker:
@@ -487,13 +804,16 @@ async def main_with_requests(tracker: Optional[CrawlProgressTracker] = None):
         else:
             print(f"Error in crawling process: {str(e)}")
 
-def start_crawl_with_requests(progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None) -> CrawlProgressTracker:
+def start_crawl_with_requests(
+    progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+    sources: Optional[List[str]] = None
+) -> CrawlProgressTracker:
     """Start the crawling process using direct HTTP requests in a separate thread and return the tracker."""
     tracker = CrawlProgressTracker(progress_callback)
     
     def run_crawl():
         try:
-            asyncio.run(main_with_requests(tracker))
+            asyncio.run(main_with_requests(tracker, sources))
         except Exception as e:
             print(f"Error in crawl thread: {e}")
             tracker.log(f"Thread error: {str(e)}")
@@ -506,8 +826,31 @@ def start_crawl_with_requests(progress_callback: Optional[Callable[[Dict[str, An
     
     return tracker
 
-if __name__ == "__main__":    
-    # Run the main function directly
+async def run_refresh_schedule(check_minutes: float = 15):
+    """Re-crawl documentation sources as their refresh schedules come due, until cancelled."""
+    while True:
+        due = await asyncio.to_thread(get_due_sources)
+        if due:
+            print(f"Refreshing documentation sources: {', '.join(source.name for source in due)}")
+            await main_with_requests(sources=[source.name for source in due])
+        await asyncio.sleep(check_minutes * 60)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crawl documentation sources into site_pages")
+    parser.add_argument("--source", action="append", help="Source to crawl (repeatable, defaults to every enabled source)")
+    parser.add_argument("--due", action="store_true", help="Only crawl sources whose refresh schedule is due")
+    parser.add_argument("--schedule", action="store_true", help="Keep running and refresh sources on their schedules")
+    args = parser.parse_args()
+
     print("Starting crawler...")
-    asyncio.run(main_with_requests())
+    if args.schedule:
+        asyncio.run(run_refresh_schedule())
+    elif args.due:
+        due = get_due_sources(args.source)
+        if due:
+            asyncio.run(main_with_requests(sources=[source.name for source in due]))
+        else:
+            print("No documentation sources are due for a refresh")
+    else:
+        asyncio.run(main_with_requests(sources=args.source))
     print("Crawler finished.")
@@ -6,13 +6,15 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from archon.crawl_pydantic_ai_docs import start_crawl_with_requests, clear_existing_records
 from utils.utils import get_env_var, create_new_tab_button
+from utils.doc_sources import get_doc_sources, get_sources_path
+from utils.crawl_state import get_crawl_state_store
 
 def documentation_tab(supabase_client):
     """Display the documentation interface"""
     st.header("Documentation")
     
     # Create tabs for different documentation sources
-    doc_tabs = st.tabs(["Pydantic AI Docs", "Future Sources"])
+    doc_tabs = st.tabs(["Pydantic AI Docs", "All Sources"])
     
     with doc_tabs[0]:
         st.subheader("Pydantic AI Documentation")
@@ -47,6 +49,14 @@ def documentation_tab(supabase_client):
             if "last_update_time" not in st.session_state:
                 st.session_state.last_update_time = time.time()
             
+            # Let the user know a crawl interrupted by a restart picks up where it stopped
+            if not (st.session_state.crawl_tracker and st.session_state.crawl_tracker.is_running):
+                for crawl in get_crawl_state_store().list_unfinished():
+                    if crawl["source"] == "pydantic_ai_docs":
+                        done = crawl["urls"].get("done", 0)
+                        total = sum(crawl["urls"].values())
+                        st.info(f"A crawl started {crawl['started_at'][:16].replace('T', ' ')} UTC was interrupted after {done} of {total} pages. Crawling again resumes it.")
+            
             # Create columns for the buttons
             col1, col2 = st.columns(2)
             
@@ -59,7 +69,7 @@ def documentation_tab(supabase_client):
                             st.session_state.crawl_status = status
                         
                         # Start the crawling process in a separate thread
-                        st.session_state.crawl_tracker = start_crawl_with_requests(update_progress)
+                        st.session_state.crawl_tracker = start_crawl_with_requests(update_progress, ["pydantic_ai_docs"])
                         st.session_state.crawl_status = st.session_state.crawl_tracker.get_status()
                         
                         # Force a rerun to start showing progress
@@ -137,7 +147,7 @@ def documentation_tab(supabase_client):
         st.subheader("Database Statistics")
         try:            
             # Query the count of Pydantic AI docs
-            result = supabase_client.table("site_pages").select("count", count="exact").eq("metadata->>source", "pydantic_ai_docs").execute()
+            result = supabase_client.table("active_site_pages").select("count", count="exact").eq("metadata->>source", "pydantic_ai_docs").execute()
             count = result.count if hasattr(result, "count") else 0
             
             # Display the count
@@ -146,7 +156,7 @@ def documentation_tab(supabase_client):
             # Add a button to view the data
             if count > 0 and st.button("View Indexed Data", key="view_pydantic_data"):
                 # Query a sample of the data
-                sample_data = supabase_client.table("site_pages").select("url,title,summary,chunk_number").eq("metadata->>source", "pydantic_ai_docs").limit(10).execute()
+                sample_data = supabase_client.table("active_site_pages").select("url,title,summary,chunk_number").eq("metadata->>source", "pydantic_ai_docs").limit(10).execute()
                 
                 # Display the sample data
                 st.dataframe(sample_data.data)
@@ -155,4 +165,36 @@ def documentation_tab(supabase_client):
             st.error(f"Error querying database: {str(e)}")
     
     with doc_tabs[1]:
-        st.info("Additional documentation sources will be available in future updates.")
\ No newline at end of file
+        st.subheader("Documentation Sources")
+        st.markdown(f"""
+        Sources are configured in `{get_sources_path()}`. Each source has its own sitemaps or
+        llms.txt files, crawl concurrency, chunking and refresh schedule, and the agents search
+        every enabled source.
+        """)
+        
+        sources = get_doc_sources(enabled_only=False)
+        st.dataframe([
+            {
+                "Source": source.name,
+                "Title": source.title,
+                "Entry Points": ", ".join(source.sitemaps + source.llms_txt),
+                "Concurrency": source.max_concurrent,
+                "Chunk Size": source.chunk_size,
+                "Refresh (hours)": source.refresh_hours,
+                "Enabled": source.enabled
+            }
+            for source in sources
+        ])
+        
+        crawl_running = st.session_state.get("crawl_tracker") and st.session_state.crawl_tracker.is_running
+        if st.button("Crawl All Enabled Sources", key="crawl_all_sources") and not crawl_running:
+            try:
+                def update_all_progress(status):
+                    st.session_state.crawl_status = status
+                
+                # Progress shows up in the Pydantic AI Docs tab, which follows the current crawl
+                st.session_state.crawl_tracker = start_crawl_with_requests(update_all_progress)
+                st.session_state.crawl_status = st.session_state.crawl_tracker.get_status()
+                st.rerun()
+            except Exception as e:
+                st.error(f"❌ Error starting crawl: {str(e)}")
\ No newline at end of file
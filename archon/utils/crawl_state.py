@@ -0,0 +1,158 @@
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional
+import threading
+import sqlite3
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.utils import workbench_dir
+
+# Crawl states
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+ABANDONED = "abandoned"
+
+# URL states
+PENDING = "pending"
+DONE = "done"
+URL_FAILED = "failed"
+
+# Finished crawls kept for reference; older ones are deleted with their URLs
+MAX_FINISHED_CRAWLS = 20
+
+class CrawlStateStore:
+    """Per-URL state of documentation crawls, persisted in a local SQLite file.
+
+    A crawl that is still running when the process stops can be resumed: the URLs
+    already stored are skipped and the others are crawled into the same version.
+    """
+
+    def __init__(self, path: str):
+        """Open (and create if needed) the state database.
+
+        Args:
+            path: Path of the SQLite file
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        # The crawler writes from its event loop and from worker threads
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS crawls (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                source TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                started_at TEXT NOT NULL,
+                finished_at TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_crawls_source_status ON crawls (source, status);
+            CREATE TABLE IF NOT EXISTS crawl_urls (
+                crawl_id INTEGER NOT NULL REFERENCES crawls (id) ON DELETE CASCADE,
+                url TEXT NOT NULL,
+                status TEXT NOT NULL,
+                chunks INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (crawl_id, url)
+            );
+        """)
+        self.conn.commit()
+
+    def get_unfinished(self, source: str) -> Optional[Dict[str, Any]]:
+        """Get the most recent crawl of a source that never finished, if any."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT * FROM crawls WHERE source = ? AND status = ? ORDER BY id DESC LIMIT 1",
+                (source, RUNNING)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def start_crawl(self, source: str, version: int) -> int:
+        """Record a new crawl of a source into a version and return its ID."""
+        with self.lock:
+            cursor = self.conn.execute(
+                "INSERT INTO crawls (source, version, status, started_at) VALUES (?, ?, ?, ?)",
+                (source, version, RUNNING, _now())
+            )
+            self.conn.commit()
+            return cursor.lastrowid
+
+    def finish_crawl(self, crawl_id: int, status: str) -> None:
+        """Record how a crawl ended and delete the oldest finished crawls."""
+        with self.lock:
+            self.conn.execute(
+                "UPDATE crawls SET status = ?, finished_at = ? WHERE id = ?",
+                (status, _now(), crawl_id)
+            )
+            old_ids = [row["id"] for row in self.conn.execute(
+                "SELECT id FROM crawls WHERE status != ? ORDER BY id DESC LIMIT -1 OFFSET ?",
+                (RUNNING, MAX_FINISHED_CRAWLS)
+            )]
+            if old_ids:
+                placeholders = ",".join("?" * len(old_ids))
+                self.conn.execute(f"DELETE FROM crawl_urls WHERE crawl_id IN ({placeholders})", old_ids)
+                self.conn.execute(f"DELETE FROM crawls WHERE id IN ({placeholders})", old_ids)
+            self.conn.commit()
+
+    def add_urls(self, crawl_id: int, urls: List[str]) -> None:
+        """Add the URLs of a crawl as pending, keeping the state of those already known."""
+        now = _now()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO crawl_urls (crawl_id, url, status, updated_at) VALUES (?, ?, ?, ?)",
+                [(crawl_id, url, PENDING, now) for url in urls]
+            )
+            self.conn.commit()
+
+    def mark_url(self, crawl_id: int, url: str, status: str, chunks: int = 0, error: Optional[str] = None) -> None:
+        """Record the outcome of a URL of a crawl."""
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO crawl_urls (crawl_id, url, status, chunks, error, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (crawl_id, url, status, chunks, error, _now())
+            )
+            self.conn.commit()
+
+    def get_done_urls(self, crawl_id: int) -> Dict[str, int]:
+        """Get the URLs of a crawl whose chunks are all stored, with their number of chunks."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT url, chunks FROM crawl_urls WHERE crawl_id = ? AND status = ?",
+                (crawl_id, DONE)
+            ).fetchall()
+        return {row["url"]: row["chunks"] for row in rows}
+
+    def get_url_counts(self, crawl_id: int) -> Dict[str, int]:
+        """Count the URLs of a crawl by status."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT status, COUNT(*) AS count FROM crawl_urls WHERE crawl_id = ? GROUP BY status",
+                (crawl_id,)
+            ).fetchall()
+        return {row["status"]: row["count"] for row in rows}
+
+    def list_unfinished(self) -> List[Dict[str, Any]]:
+        """Get every crawl that can be resumed, with its URL counts."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT * FROM crawls WHERE status = ? ORDER BY id", (RUNNING,)
+            ).fetchall()
+        return [dict(row, urls=self.get_url_counts(row["id"])) for row in rows]
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+_store: Optional[CrawlStateStore] = None
+
+def get_crawl_state_store() -> CrawlStateStore:
+    """Get the crawl state store, stored in workbench/crawl_state.sqlite unless CRAWL_STATE_PATH is set."""
+    global _store
+    if _store is None:
+        _store = CrawlStateStore(os.environ.get("CRAWL_STATE_PATH") or os.path.join(workbench_dir, "crawl_state.sqlite"))
+    return _store
@@ -0,0 +1,116 @@
+from dataclasses import dataclass, field, asdict
+from typing import List, Dict, Any, Optional
+import json
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.utils import workbench_dir, write_to_log
+
+# Sources shipped with Archon
+DEFAULT_SOURCES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "doc_sources.json")
+
+# Sources configured for this installation; once it exists it replaces the defaults
+WORKBENCH_SOURCES_PATH = os.path.join(workbench_dir, "doc_sources.json")
+
+@dataclass
+class DocSource:
+    """A documentation site the crawler indexes into site_pages.
+
+    Attributes:
+        name: Value of metadata.source for the site's chunks
+        title: Human readable name of the documentation
+        sitemaps: Sitemap URLs listing the pages to crawl
+        llms_txt: llms.txt URLs whose links are the pages to crawl
+        max_concurrent: Pages of this source crawled at the same time
+        chunk_size: Maximum chunk size in characters
+        chunk_overlap: Characters repeated between consecutive chunks
+        refresh_hours: Re-crawl the source once its index is this old (None to only crawl on demand)
+        enabled: Whether the source is crawled and searched by default
+    """
+    name: str
+    title: str
+    sitemaps: List[str] = field(default_factory=list)
+    llms_txt: List[str] = field(default_factory=list)
+    max_concurrent: int = 10
+    chunk_size: int = 5000
+    chunk_overlap: int = 0
+    refresh_hours: Optional[float] = None
+    enabled: bool = True
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "DocSource":
+        """Create a source from its configuration, ignoring unknown keys."""
+        known = {key: value for key, value in data.items() if key in cls.__dataclass_fields__}
+        return cls(**known)
+
+def get_sources_path() -> str:
+    """Get the path of the configuration file in use (DOC_SOURCES_FILE overrides it)."""
+    path = os.environ.get("DOC_SOURCES_FILE")
+    if path:
+        return path
+    return WORKBENCH_SOURCES_PATH if os.path.exists(WORKBENCH_SOURCES_PATH) else DEFAULT_SOURCES_PATH
+
+def load_doc_sources(path: Optional[str] = None) -> List[DocSource]:
+    """Load every configured documentation source.
+
+    Args:
+        path: Configuration file to read (defaults to get_sources_path())
+
+    Returns:
+        The sources in configuration order
+    """
+    path = path or get_sources_path()
+    try:
+        with open(path, "r") as f:
+            config = json.load(f)
+        return [DocSource.from_dict(source) for source in config.get("sources", [])]
+    except (json.JSONDecodeError, IOError, TypeError) as e:
+        write_to_log(f"Error reading documentation sources from {path}: {str(e)}")
+        if path != DEFAULT_SOURCES_PATH:
+            return load_doc_sources(DEFAULT_SOURCES_PATH)
+        return []
+
+def get_doc_sources(enabled_only: bool = True) -> List[DocSource]:
+    """Get the configured documentation sources, by default only the enabled ones."""
+    return [source for source in load_doc_sources() if source.enabled or not enabled_only]
+
+def get_doc_source(name: str) -> Optional[DocSource]:
+    """Get a configured documentation source by name."""
+    return next((source for source in load_doc_sources() if source.name == name), None)
+
+def get_source_names(sources: Optional[List[str]] = None) -> List[str]:
+    """Get the source names to search: the given ones, or every enabled source."""
+    if sources:
+        return list(sources)
+    return [source.name for source in get_doc_sources()]
+
+def save_doc_sources(sources: List[DocSource]) -> bool:
+    """Save the documentation sources to DOC_SOURCES_FILE if set, otherwise to the workbench configuration file.
+
+    Args:
+        sources: Every source of the installation
+
+    Returns:
+        True if the file was written
+    """
+    # Write the file load_doc_sources reads, so changes aren't lost when DOC_SOURCES_FILE is set
+    path = os.environ.get("DOC_SOURCES_FILE") or WORKBENCH_SOURCES_PATH
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"sources": [asdict(source) for source in sources]}, f, indent=2)
+        return True
+    except IOError as e:
+        write_to_log(f"Error saving documentation sources to {path}: {str(e)}")
+        return False
+
+def register_doc_source(source: DocSource) -> bool:
+    """Add a documentation source, or replace the configuration of one with the same name."""
+    sources = [existing for existing in load_doc_sources() if existing.name != source.name]
+    sources.append(source)
+    return save_doc_sources(sources)
+
+def remove_doc_source(name: str) -> bool:
+    """Remove a documentation source from the configuration (its indexed chunks are kept)."""
+    return save_doc_sources([source for source in load_doc_sources() if source.name != name])
@@ -0,0 +1,397 @@
+"""
+Single-pass markdown chunker.
+
+The markdown is read line by line exactly once and split into structural blocks
+(headings, fenced code blocks, tables and paragraphs), which are then packed greedily
+into chunks of at most max_size characters, or tokens when a token counter is given.
+Chunks start at headings whenever the previous chunk is already reasonably full.
+Code blocks and tables are never split unless they don't fit in a chunk on their own;
+then they are split between lines, and every piece is a complete code block (the
+fence is closed and reopened) or a complete table (the header is repeated). Other
+blocks that are too large are split at sentence boundaries. Chunks can repeat the
+last sentences of the previous chunk as overlap. Every chunk carries the byte offsets
+of its source in the UTF-8 encoded document and the path of headings it sits under.
+
+The same module is used by mcp-crawl4ai-rag, archon and crawl4AI-agent-v2; keep the
+copies identical.
+"""
+import io
+import re
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, Union
+
+_HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+_FENCE = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+_TABLE_ROW = re.compile(r"^ {0,3}\|")
+_TABLE_SEPARATOR = re.compile(r"^ {0,3}\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?\s*$")
+_LINE_END = re.compile(r"\n")
+# A sentence ends at ., ! or ? followed by whitespace, or at a line break
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n")
+
+@dataclass
+class Block:
+    """A structural block of a markdown document."""
+    kind: str  # "heading", "fence", "table" or "paragraph"
+    text: str  # Source text of the block, including line endings
+    start: int  # Byte offset of the block in the document
+    gap: str = ""  # Blank lines between the previous block and this one
+    level: int = 0  # Heading level (headings only)
+    title: str = ""  # Heading text (headings only)
+
+@dataclass
+class Chunk:
+    """A chunk of a markdown document."""
+    text: str
+    # Byte range of the source the chunk was built from. The text is exactly this range
+    # of the document, except for pieces of split code blocks and tables, which also
+    # carry the reopened fence or repeated table header and a closing fence.
+    start: int
+    end: int
+    heading_path: List[str] = field(default_factory=list)  # Titles of the enclosing headings, outermost first
+
+@dataclass
+class _Piece:
+    """A block, or part of one, waiting to be packed into a chunk."""
+    gap: str
+    text: str
+    start: int
+    end: int  # Byte offset just past the last non-whitespace source character
+    size: int
+    kind: str
+
+def _byte_len(text: str) -> int:
+    return len(text.encode("utf-8"))
+
+def _text_end(start: int, text: str) -> int:
+    return start + _byte_len(text.rstrip())
+
+def _closes_fence(line: str, fence: str) -> bool:
+    stripped = line.strip()
+    return stripped.startswith(fence) and not stripped.lstrip(fence[0])
+
+def _iter_lines(source: Union[str, Iterable[str]]) -> Iterator[str]:
+    """Iterate over the lines of a string or of a stream of text pieces, keeping line endings."""
+    if isinstance(source, str):
+        yield from io.StringIO(source, newline="\n")
+        return
+    pending = ""
+    for piece in source:
+        pending += piece
+        if "\n" not in pending:
+            continue
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    if pending:
+        yield pending
+
+def iter_blocks(source: Union[str, Iterable[str]]) -> Iterator[Block]:
+    """
+    Split markdown into headings, fenced code blocks, tables and paragraphs in a single pass.
+
+    Args:
+        source: Markdown text, or an iterable of text pieces to stream it from
+
+    Yields:
+        The blocks of the document in order
+    """
+    offset = 0
+    gap: List[str] = []
+    lines: List[str] = []
+    start = 0
+    kind = None
+    fence = ""
+
+    def emit(block_kind: str, **extra) -> Block:
+        nonlocal gap, lines, kind
+        block = Block(kind=block_kind, text="".join(lines), start=start, gap="".join(gap), **extra)
+        gap, lines, kind = [], [], None
+        return block
+
+    for line in _iter_lines(source):
+        size = _byte_len(line)
+
+        if kind == "fence":
+            lines.append(line)
+            if _closes_fence(line, fence):
+                yield emit("fence")
+            offset += size
+            continue
+
+        if not line.strip():
+            if kind is not None:
+                yield emit(kind)
+            gap.append(line)
+            offset += size
+            continue
+
+        heading = _HEADING.match(line)
+        fence_open = _FENCE.match(line)
+        if heading or fence_open:
+            if kind is not None:
+                yield emit(kind)
+            start, lines = offset, [line]
+            if heading:
+                yield emit("heading", level=len(heading.group(1)), title=heading.group(2))
+            else:
+                kind, fence = "fence", fence_open.group(1)
+        else:
+            line_kind = "table" if _TABLE_ROW.match(line) else "paragraph"
+            if kind is not None and kind != line_kind:
+                yield emit(kind)
+            if kind is None:
+                start, kind = offset, line_kind
+            lines.append(line)
+        offset += size
+
+    if kind is not None:
+        # An unclosed fence runs to the end of the document
+        yield emit(kind)
+
+def _split_points(text: str, pattern: re.Pattern) -> Iterator[str]:
+    """Split text after every match of pattern, keeping the separators."""
+    position = 0
+    for match in pattern.finditer(text):
+        yield text[position:match.end()]
+        position = match.end()
+    if position < len(text):
+        yield text[position:]
+
+def _cut(text: str, start: int, max_size: int, measure: Callable[[str], int]) -> Iterator[Tuple[str, int]]:
+    """Cut text that is still too long into parts of roughly max_size by position."""
+    step = max(1, len(text) * max_size // measure(text))
+    for i in range(0, len(text), step):
+        part = text[i:i + step]
+        yield part, start
+        start += _byte_len(part)
+
+def _split_units(
+    text: str,
+    start: int,
+    pattern: re.Pattern,
+    max_size: int,
+    measure: Callable[[str], int]
+) -> Iterator[Tuple[str, int, int]]:
+    """Split text into sentences or lines of at most max_size, as (text, byte offset, size)."""
+    offset = start
+    for unit in _split_points(text, pattern):
+        size = measure(unit)
+        if size <= max_size:
+            yield unit, offset, size
+        else:
+            for part, part_start in _cut(unit, offset, max_size, measure):
+                yield part, part_start, measure(part)
+        offset += _byte_len(unit)
+
+def _split_wrapped(block: Block, max_size: int, measure: Callable[[str], int]) -> Iterator[_Piece]:
+    """
+    Split a code block or table that is too large into complete code blocks or tables.
+
+    Args:
+        block: The fence or table block
+        max_size: Maximum size of each piece
+        measure: Function returning the size of a text
+
+    Yields:
+        Pieces in order, each a balanced fence or a table with the original header
+    """
+    lines = list(_split_points(block.text, _LINE_END))
+    if block.kind == "fence":
+        fence = _FENCE.match(lines[0]).group(1)
+        head = lines[:1]
+        tail = lines[-1:] if len(lines) > 1 and _closes_fence(lines[-1], fence) else []
+        close = fence + "\n"
+    else:
+        head = lines[:2] if len(lines) > 1 and _TABLE_SEPARATOR.match(lines[1]) else []
+        tail = []
+        close = ""
+    body = lines[len(head):len(lines) - len(tail)]
+    head_text, tail_text = "".join(head), "".join(tail)
+
+    available = max_size - measure(head_text) - max(measure(tail_text), measure(close))
+    if not body or available < max_size // 4:
+        # The fence or header alone takes up most of a chunk; split by lines instead
+        for text, start, size in _split_units(block.text, block.start, _LINE_END, max_size, measure):
+            yield _Piece("", text, start, _text_end(start, text), size, block.kind)
+        return
+
+    groups: List[List[Tuple[str, int, int]]] = [[]]
+    group_size = 0
+    for unit in _split_units("".join(body), block.start + _byte_len(head_text), _LINE_END, available, measure):
+        if groups[-1] and group_size + unit[2] > available:
+            groups.append([])
+            group_size = 0
+        groups[-1].append(unit)
+        group_size += unit[2]
+
+    for i, group in enumerate(groups):
+        last = i == len(groups) - 1
+        body_text = "".join(text for text, _, _ in group)
+        suffix = tail_text if last else close
+        if suffix and not body_text.endswith("\n"):
+            body_text += "\n"
+        text = head_text + body_text + suffix
+        start = block.start if i == 0 else group[0][1]
+        end = _text_end(block.start, block.text) if last else _text_end(group[-1][1], group[-1][0])
+        yield _Piece("", text, start, end, measure(text), block.kind)
+
+def iter_chunks(
+    source: Union[str, Iterable[str]],
+    max_size: int = 5000,
+    token_counter: Optional[Callable[[str], int]] = None,
+    overlap: int = 0,
+    min_size_ratio: float = 0.3
+) -> Iterator[Chunk]:
+    """
+    Chunk markdown by its structure, streaming chunks as soon as they are complete.
+
+    Args:
+        source: Markdown text, or an iterable of text pieces to stream it from
+        max_size: Maximum chunk size in characters (or tokens with a token counter)
+        token_counter: Optional function returning the number of tokens in a text
+        overlap: Size of the trailing sentences of a chunk to repeat at the start of
+            the next one when a section is split across chunks (at most max_size / 2;
+            code blocks and tables are never repeated)
+        min_size_ratio: A heading only starts a new chunk once the current one is at
+            least this fraction of max_size
+
+    Yields:
+        Chunks in document order
+    """
+    measure = token_counter or len
+    min_size = max_size * min_size_ratio
+    overlap = max(0, min(overlap, max_size // 2))
+
+    path: List[Tuple[int, str]] = []
+    pieces: List[_Piece] = []
+    chunk_path: List[str] = []
+    current_size = 0
+
+    def gap_size(gap: str) -> int:
+        return measure(gap) if gap else 0
+
+    def pieces_size(selected: List[_Piece]) -> int:
+        return sum(piece.size for piece in selected) + sum(gap_size(piece.gap) for piece in selected[1:])
+
+    def flush() -> Optional[Chunk]:
+        nonlocal pieces, current_size
+        if not pieces:
+            return None
+        text = pieces[0].text + "".join(piece.gap + piece.text for piece in pieces[1:])
+        text = text.rstrip()
+        start = pieces[0].start
+        end = max(piece.end for piece in pieces)
+        pieces, current_size = [], 0
+        if not text:
+            return None
+        return Chunk(text=text, start=start, end=end, heading_path=chunk_path)
+
+    def tail_overlap(budget: int) -> List[_Piece]:
+        """Take the trailing sentences of the current chunk that fit in budget."""
+        kept: List[_Piece] = []
+        size = 0
+        for piece in reversed(pieces):
+            if piece.kind in ("fence", "table"):
+                break
+            if size + piece.size <= budget:
+                kept.append(piece)
+                size += piece.size + gap_size(piece.gap)
+                if piece.kind == "heading":
+                    break
+                continue
+            if piece.kind == "paragraph":
+                sentences = []
+                for sentence in reversed(list(_split_points(piece.text, _SENTENCE_END))):
+                    sentence_size = measure(sentence)
+                    if size + sentence_size > budget:
+                        break
+                    sentences.insert(0, sentence)
+                    size += sentence_size
+                if sentences:
+                    text = "".join(sentences)
+                    start = piece.start + _byte_len(piece.text[:len(piece.text) - len(text)])
+                    kept.append(_Piece("", text, start, piece.end, measure(text), piece.kind))
+            break
+        kept.reverse()
+        if kept:
+            kept[0] = _Piece("", kept[0].text, kept[0].start, kept[0].end, kept[0].size, kept[0].kind)
+        return kept
+
+    def add(piece: _Piece) -> Iterator[Chunk]:
+        nonlocal pieces, current_size, chunk_path
+        piece_gap_size = gap_size(piece.gap)
+        if pieces and current_size + piece_gap_size + piece.size > max_size:
+            carried = []
+            # Don't leave a heading dangling at the end of a chunk if it fits with what follows
+            if pieces[-1].kind == "heading" and len(pieces) > 1 and pieces[-1].size + piece_gap_size + piece.size <= max_size:
+                carried = [pieces.pop()]
+            elif overlap and piece.kind != "heading":
+                carried = tail_overlap(min(overlap, max_size - piece_gap_size - piece.size))
+            chunk = flush()
+            if chunk:
+                yield chunk
+            if carried:
+                pieces = carried
+                current_size = pieces_size(carried)
+                chunk_path = [title for _, title in path]
+        if not pieces:
+            chunk_path = [title for _, title in path]
+            piece.gap, piece_gap_size = "", 0
+        pieces.append(piece)
+        current_size += piece_gap_size + piece.size
+
+    for block in iter_blocks(source):
+        if block.kind == "heading":
+            if pieces and current_size >= min_size:
+                chunk = flush()
+                if chunk:
+                    yield chunk
+            while path and path[-1][0] >= block.level:
+                path.pop()
+            path.append((block.level, block.title))
+
+        size = measure(block.text)
+        if size <= max_size:
+            yield from add(_Piece(block.gap, block.text, block.start, _text_end(block.start, block.text), size, block.kind))
+            continue
+
+        # The block doesn't fit in a chunk on its own: pack its parts instead
+        if block.kind in ("fence", "table"):
+            parts = _split_wrapped(block, max_size, measure)
+        else:
+            parts = (
+                _Piece("", text, start, _text_end(start, text), part_size, "paragraph")
+                for text, start, part_size in _split_units(block.text, block.start, _SENTENCE_END, max_size, measure)
+            )
+        gap = block.gap
+        for part in parts:
+            part.gap, gap = gap, ""
+            yield from add(part)
+
+    chunk = flush()
+    if chunk:
+        yield chunk
+
+def chunk_markdown(
+    text: str,
+    max_size: int = 5000,
+    token_counter: Optional[Callable[[str], int]] = None,
+    overlap: int = 0
+) -> List[str]:
+    """
+    Split markdown into chunks of at most max_size, respecting its structure.
+
+    Args:
+        text: Markdown text
+        max_size: Maximum chunk size in characters (or tokens with a token counter)
+        token_counter: Optional function returning the number of tokens in a text
+        overlap: Size of the trailing sentences of a chunk to repeat in the next one
+
+    Returns:
+        List of chunk texts
+    """
+    return [
+        chunk.text
+        for chunk in iter_chunks(text, max_size=max_size, token_counter=token_counter, overlap=overlap)
+    ]
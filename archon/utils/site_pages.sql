@@ -1,6 +1,18 @@
 -- Enable the pgvector extension
 create extension if not exists vector;
 
+-- Active version of every documentation source. A re-index crawls into the next
+-- version next to the active one and only switches active_version once it is complete.
+-- Only one crawler at a time may re-index a source: it holds the lease in reindex_holder
+-- and keeps reindexing_since current while it runs
+create table if not exists site_page_versions (
+    source varchar primary key,
+    active_version integer not null default 0,
+    updated_at timestamp with time zone default timezone('utc'::text, now()) not null,
+    reindex_holder varchar,
+    reindexing_since timestamp with time zone
+);
+
 -- Create the documentation chunks table
 create table site_pages (
     id bigserial primary key,
@@ -10,11 +22,12 @@ create table site_pages (
     summary varchar not null,
     content text not null,  -- Added content column
     metadata jsonb not null default '{}'::jsonb,  -- Added metadata column
+    version integer not null default 0,  -- Version of the source the chunk belongs to
     embedding vector(1536),  -- OpenAI embeddings are 1536 dimensions
     created_at timestamp with time zone default timezone('utc'::text, now()) not null,
     
     -- Add a unique constraint to prevent duplicate chunks for the same URL
-    unique(url, chunk_number)
+    unique(url, chunk_number, version)
 );
 
 -- Create an index for better vector similarity search performance
@@ -23,11 +36,23 @@ create index on site_pages using ivfflat (embedding vector_cosine_ops);
 -- Create an index on metadata for faster filtering
 create index idx_site_pages_metadata on site_pages using gin (metadata);
 
--- Create a function to search for documentation chunks
-create function match_site_pages (
+-- Create an index for looking up the chunks of one version of a source
+create index idx_site_pages_source_version on site_pages ((metadata->>'source'), version);
+
+-- Chunks of the active version of every source; everything reading documentation goes through this view
+create or replace view active_site_pages as
+select site_pages.*
+from site_pages
+join site_page_versions
+  on site_page_versions.source = site_pages.metadata->>'source'
+  and site_page_versions.active_version = site_pages.version;
+
+-- Create a function to search for documentation chunks, optionally limited to some sources
+create or replace function match_site_pages (
   query_embedding vector(1536),
   match_count int default 10,
-  filter jsonb DEFAULT '{}'::jsonb
+  filter jsonb DEFAULT '{}'::jsonb,
+  sources varchar[] default null
 ) returns table (
   id bigint,
   url varchar,
@@ -51,14 +76,129 @@ begin
     summary,
     content,
     metadata,
-    1 - (site_pages.embedding <=> query_embedding) as similarity
-  from site_pages
+    1 - (active_site_pages.embedding <=> query_embedding) as similarity
+  from active_site_pages
   where metadata @> filter
-  order by site_pages.embedding <=> query_embedding
+    and (sources is null or metadata->>'source' = any(sources))
+  order by active_site_pages.embedding <=> query_embedding
   limit match_count;
 end;
 $$;
 
+-- List the distinct page URLs of the active versions of some sources (every source if null)
+create or replace function list_site_pages_urls (
+  sources varchar[] default null
+) returns table (url varchar)
+language sql stable
+as $$
+  select distinct active_site_pages.url
+  from active_site_pages
+  where sources is null or active_site_pages.metadata->>'source' = any(sources)
+  order by active_site_pages.url;
+$$;
+
+-- Make a version of a source the active one, if it has at least min_chunks chunks
+create or replace function activate_site_pages_version (
+  source_name varchar,
+  new_version integer,
+  min_chunks integer default 1
+) returns integer
+language plpgsql
+as $$
+declare
+  chunk_count integer;
+begin
+  -- Serialize activations of the same source
+  perform 1 from site_page_versions where source = source_name for update;
+
+  select count(*) into chunk_count
+  from site_pages
+  where metadata->>'source' = source_name and version = new_version;
+
+  if chunk_count < min_chunks then
+    raise exception 'Version % of % has % chunks, expected at least %', new_version, source_name, chunk_count, min_chunks;
+  end if;
+
+  insert into site_page_versions (source, active_version)
+  values (source_name, new_version)
+  on conflict (source) do update
+    set active_version = excluded.active_version,
+        updated_at = timezone('utc'::text, now());
+
+  return chunk_count;
+end;
+$$;
+
+-- Take (or renew) the lease on re-indexing a source and return the version to crawl into.
+-- Raises if another holder renewed its lease less than lease_seconds ago
+create or replace function begin_site_pages_reindex (
+  source_name varchar,
+  holder varchar,
+  lease_seconds integer default 600
+) returns integer
+language plpgsql
+as $$
+declare
+  lease site_page_versions%rowtype;
+begin
+  insert into site_page_versions (source, active_version)
+  values (source_name, 0)
+  on conflict (source) do nothing;
+
+  select * into lease from site_page_versions where source = source_name for update;
+
+  if lease.reindex_holder is not null
+    and lease.reindex_holder <> holder
+    and lease.reindexing_since > now() - make_interval(secs => lease_seconds) then
+    raise exception '% is already being re-indexed (since %)', source_name, lease.reindexing_since;
+  end if;
+
+  update site_page_versions
+  set reindex_holder = holder,
+      reindexing_since = now()
+  where source = source_name;
+
+  return lease.active_version + 1;
+end;
+$$;
+
+-- Release the lease on re-indexing a source, if holder still has it
+create or replace function end_site_pages_reindex (
+  source_name varchar,
+  holder varchar
+) returns void
+language sql
+as $$
+  update site_page_versions
+  set reindex_holder = null,
+      reindexing_since = null
+  where source = source_name and reindex_holder = holder;
+$$;
+
+-- Delete up to batch_size chunks of a source that aren't in its active version and return how many were deleted
+create or replace function delete_inactive_site_pages (
+  source_name varchar,
+  batch_size integer default 1000
+) returns integer
+language plpgsql
+as $$
+declare
+  deleted integer;
+begin
+  delete from site_pages
+  where id in (
+    select site_pages.id
+    from site_pages
+    join site_page_versions on site_page_versions.source = source_name
+    where site_pages.metadata->>'source' = source_name
+      and site_pages.version <> site_page_versions.active_version
+    limit batch_size
+  );
+  get diagnostics deleted = row_count;
+  return deleted;
+end;
+$$;
+
 -- Everything above will work for any PostgreSQL database. The below commands are for Supabase security
 
 -- Enable RLS on the table
@@ -69,4 +209,31 @@ create policy "Allow public read access"
   on site_pages
   for select
   to public
-  using (true);
\ No newline at end of file
+  using (true);
+
+alter table site_page_versions enable row level security;
+
+drop policy if exists "Allow public read access" on site_page_versions;
+create policy "Allow public read access"
+  on site_page_versions
+  for select
+  to public
+  using (true);
+
+-- To upgrade a site_page_versions table created before re-index leases were added, run
+-- the begin_site_pages_reindex and end_site_pages_reindex statements above after these:
+--
+-- alter table site_page_versions add column reindex_holder varchar;
+-- alter table site_page_versions add column reindexing_since timestamp with time zone;
+
+-- To upgrade a site_pages table created before versions were added, run the
+-- site_page_versions, view, function and policy statements above after these:
+--
+-- drop function if exists match_site_pages(vector(1536), int, jsonb);
+-- alter table site_pages add column version integer not null default 0;
+-- alter table site_pages drop constraint site_pages_url_chunk_number_key;
+-- alter table site_pages add constraint site_pages_url_chunk_number_version_key unique (url, chunk_number, version);
+-- create index idx_site_pages_source_version on site_pages ((metadata->>'source'), version);
+-- insert into site_page_versions (source, active_version)
+--   select distinct metadata->>'source', 0 from site_pages where metadata->>'source' is not null
+--   on conflict do nothing;
\ No newline at end of file
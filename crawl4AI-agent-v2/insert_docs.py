@@ -2,7 +2,7 @@
 insert_docs.py
 --------------
 Command-line utility to crawl any URL using Crawl4AI, detect content type (sitemap, .txt, or regular page),
-use the appropriate crawl method, chunk the resulting Markdown into <1000 character blocks by header hierarchy,
+use the appropriate crawl method, chunk the resulting Markdown into <1000 character blocks by its structure (headers, code blocks, tables, paragraphs),
 and insert all chunks into ChromaDB with metadata.
 
 Usage:
@@ -18,40 +18,7 @@ from xml.etree import ElementTree
 from crawl4ai import AsyncWebCrawler, BrowserConfig, CrawlerRunConfig, CacheMode, MemoryAdaptiveDispatcher
 import requests
 from utils import get_chroma_client, get_or_create_collection, add_documents_to_collection
-
-def smart_chunk_markdown(markdown: str, max_len: int = 1000) -> List[str]:
-    """Hierarchically splits markdown by #, ##, ### headers, then by characters, to ensure all chunks < max_len."""
-    def split_by_header(md, header_pattern):
-        indices = [m.start() for m in re.finditer(header_pattern, md, re.MULTILINE)]
-        indices.append(len(md))
-        return [md[indices[i]:indices[i+1]].strip() for i in range(len(indices)-1) if md[indices[i]:indices[i+1]].strip()]
-
-    chunks = []
-
-    for h1 in split_by_header(markdown, r'^# .+$'):
-        if len(h1) > max_len:
-            for h2 in split_by_header(h1, r'^## .+$'):
-                if len(h2) > max_len:
-                    for h3 in split_by_header(h2, r'^### .+$'):
-                        if len(h3) > max_len:
-                            for i in range(0, len(h3), max_len):
-                                chunks.append(h3[i:i+max_len].strip())
-                        else:
-                            chunks.append(h3)
-                else:
-                    chunks.append(h2)
-        else:
-            chunks.append(h1)
-
-    final_chunks = []
-
-    for c in chunks:
-        if len(c) > max_len:
-            final_chunks.extend([c[i:i+max_len].strip() for i in range(0, len(c), max_len)])
-        else:
-            final_chunks.append(c)
-
-    return [c for c in final_chunks if c]
+from markdown_chunker import iter_chunks
 
 def is_sitemap(url: str) -> bool:
     return url.endswith('sitemap.xml') or 'sitemap' in urlparse(url).path
@@ -159,6 +126,7 @@ def main():
     parser.add_argument("--db-dir", default="./chroma_db", help="ChromaDB directory")
     parser.add_argument("--embedding-model", default="all-MiniLM-L6-v2", help="Embedding model name")
     parser.add_argument("--chunk-size", type=int, default=1000, help="Max chunk size (chars)")
+    parser.add_argument("--chunk-overlap", type=int, default=0, help="Chars of trailing sentences repeated in the next chunk")
     parser.add_argument("--max-depth", type=int, default=3, help="Recursion depth for regular URLs")
     parser.add_argument("--max-concurrent", type=int, default=10, help="Max parallel browser sessions")
     parser.add_argument("--batch-size", type=int, default=100, help="ChromaDB insert batch size")
@@ -186,13 +154,13 @@ def main():
     for doc in crawl_results:
         url = doc['url']
         md = doc['markdown']
-        chunks = smart_chunk_markdown(md, max_len=args.chunk_size)
-        for chunk in chunks:
+        for chunk in iter_chunks(md, max_size=args.chunk_size, overlap=args.chunk_overlap):
             ids.append(f"chunk-{chunk_idx}")
-            documents.append(chunk)
-            meta = extract_section_info(chunk)
+            documents.append(chunk.text)
+            meta = extract_section_info(chunk.text)
             meta["chunk_index"] = chunk_idx
             meta["source"] = url
+            meta["heading_path"] = " > ".join(chunk.heading_path)
             metadatas.append(meta)
             chunk_idx += 1
 
@@ -0,0 +1,473 @@
+-- Enable the pgvector extension
+create extension if not exists vector;
+
+-- Drop tables if they exist (to allow rerunning the script)
+drop table if exists crawled_pages;
+drop table if exists code_examples;
+drop table if exists sources;
+
+-- Create the sources table
+create table sources (
+    source_id text primary key,
+    summary text,
+    -- Statistics kept up to date by the triggers at the end of this script
+    total_word_count integer not null default 0,
+    page_count integer not null default 0,
+    chunk_count integer not null default 0,
+    code_example_count integer not null default 0,
+    pages_changed_since_summary integer not null default 0,  -- Pages whose content changed since the summary was generated
+    last_crawled_at timestamp with time zone,
+    created_at timestamp with time zone default timezone('utc'::text, now()) not null,
+    updated_at timestamp with time zone default timezone('utc'::text, now()) not null
+);
+
+-- Create the documentation chunks table
+create table crawled_pages (
+    id bigserial primary key,
+    url varchar not null,
+    chunk_number integer not null,
+    content text not null,
+    content_hash text,  -- Hash of the original chunk, used to skip unchanged chunks on recrawls
+    metadata jsonb not null default '{}'::jsonb,
+    source_id text not null,
+    embedding vector(1536),  -- OpenAI embeddings are 1536 dimensions
+    fts tsvector generated always as (to_tsvector('english', content)) stored,  -- Full-text search vector for hybrid search
+    created_at timestamp with time zone default timezone('utc'::text, now()) not null,
+    
+    -- Add a unique constraint to prevent duplicate chunks for the same URL
+    unique(url, chunk_number),
+    
+    -- Add foreign key constraint to sources table
+    foreign key (source_id) references sources(source_id)
+);
+
+-- Create an index for better vector similarity search performance
+create index on crawled_pages using ivfflat (embedding vector_cosine_ops);
+
+-- Create an index for full-text search
+create index idx_crawled_pages_fts on crawled_pages using gin (fts);
+
+-- Create an index on metadata for faster filtering
+create index idx_crawled_pages_metadata on crawled_pages using gin (metadata);
+
+-- Create an index on source_id for faster filtering
+CREATE INDEX idx_crawled_pages_source_id ON crawled_pages (source_id);
+
+-- Create a function to search for documentation chunks
+create or replace function match_crawled_pages (
+  query_embedding vector(1536),
+  match_count int default 10,
+  filter jsonb DEFAULT '{}'::jsonb,
+  source_filter text DEFAULT NULL
+) returns table (
+  id bigint,
+  url varchar,
+  chunk_number integer,
+  content text,
+  metadata jsonb,
+  source_id text,
+  similarity float
+)
+language plpgsql
+as $$
+#variable_conflict use_column
+begin
+  return query
+  select
+    id,
+    url,
+    chunk_number,
+    content,
+    metadata,
+    source_id,
+    1 - (crawled_pages.embedding <=> query_embedding) as similarity
+  from crawled_pages
+  where metadata @> filter
+    AND (source_filter IS NULL OR source_id = source_filter)
+  order by crawled_pages.embedding <=> query_embedding
+  limit match_count;
+end;
+$$;
+
+-- Create a function for hybrid search over documentation chunks: the best full-text
+-- and vector matches are merged with reciprocal rank fusion, each weighted separately
+create or replace function hybrid_search_crawled_pages (
+  query_text text,
+  query_embedding vector(1536),
+  match_count int default 10,
+  filter jsonb DEFAULT '{}'::jsonb,
+  source_filter text DEFAULT NULL,
+  full_text_weight float DEFAULT 1.0,
+  semantic_weight float DEFAULT 1.0,
+  rrf_k int DEFAULT 50
+) returns table (
+  id bigint,
+  url varchar,
+  chunk_number integer,
+  content text,
+  metadata jsonb,
+  source_id text,
+  similarity float,
+  score float
+)
+language sql
+as $$
+  with full_text as (
+    select
+      crawled_pages.id,
+      row_number() over (order by ts_rank_cd(crawled_pages.fts, websearch_to_tsquery('english', query_text)) desc) as rank_ix
+    from crawled_pages
+    where crawled_pages.fts @@ websearch_to_tsquery('english', query_text)
+      and crawled_pages.metadata @> filter
+      and (source_filter is null or crawled_pages.source_id = source_filter)
+    order by rank_ix
+    limit match_count * 2
+  ),
+  semantic as (
+    select
+      crawled_pages.id,
+      row_number() over (order by crawled_pages.embedding <=> query_embedding) as rank_ix
+    from crawled_pages
+    where crawled_pages.metadata @> filter
+      and (source_filter is null or crawled_pages.source_id = source_filter)
+    order by rank_ix
+    limit match_count * 2
+  )
+  select
+    crawled_pages.id,
+    crawled_pages.url,
+    crawled_pages.chunk_number,
+    crawled_pages.content,
+    crawled_pages.metadata,
+    crawled_pages.source_id,
+    1 - (crawled_pages.embedding <=> query_embedding) as similarity,
+    coalesce(1.0 / (rrf_k + full_text.rank_ix), 0.0) * full_text_weight +
+      coalesce(1.0 / (rrf_k + semantic.rank_ix), 0.0) * semantic_weight as score
+  from full_text
+    full outer join semantic on full_text.id = semantic.id
+    join crawled_pages on coalesce(full_text.id, semantic.id) = crawled_pages.id
+  order by score desc
+  limit match_count;
+$$;
+
+-- Create a function to write a batch of documentation chunks in one transaction:
+-- new and changed chunks are upserted in place and chunks past the new end of each
+-- page are deleted, so a page never disappears from search while it's being rewritten
+create or replace function sync_crawled_pages (
+  chunk_rows jsonb DEFAULT '[]'::jsonb,
+  page_chunk_counts jsonb DEFAULT '{}'::jsonb
+) returns void
+language plpgsql
+as $$
+begin
+  insert into crawled_pages (url, chunk_number, content, content_hash, metadata, source_id, embedding)
+  select
+    r->>'url',
+    (r->>'chunk_number')::integer,
+    r->>'content',
+    r->>'content_hash',
+    coalesce(r->'metadata', '{}'::jsonb),
+    r->>'source_id',
+    (r->>'embedding')::vector
+  from jsonb_array_elements(chunk_rows) as r
+  on conflict (url, chunk_number) do update set
+    content = excluded.content,
+    content_hash = excluded.content_hash,
+    metadata = excluded.metadata,
+    source_id = excluded.source_id,
+    embedding = excluded.embedding;
+
+  delete from crawled_pages
+  using jsonb_each_text(page_chunk_counts) as p(page_url, chunk_count)
+  where crawled_pages.url = p.page_url
+    and crawled_pages.chunk_number >= p.chunk_count::integer;
+end;
+$$;
+
+-- Enable RLS on the crawled_pages table
+alter table crawled_pages enable row level security;
+
+-- Create a policy that allows anyone to read crawled_pages
+create policy "Allow public read access to crawled_pages"
+  on crawled_pages
+  for select
+  to public
+  using (true);
+
+-- Enable RLS on the sources table
+alter table sources enable row level security;
+
+-- Create a policy that allows anyone to read sources
+create policy "Allow public read access to sources"
+  on sources
+  for select
+  to public
+  using (true);
+
+-- Create the code_examples table
+create table code_examples (
+    id bigserial primary key,
+    url varchar not null,
+    chunk_number integer not null,
+    content text not null,  -- The code example content
+    summary text not null,  -- Summary of the code example
+    metadata jsonb not null default '{}'::jsonb,
+    source_id text not null,
+    embedding vector(1536),  -- OpenAI embeddings are 1536 dimensions
+    fts tsvector generated always as (
+      setweight(to_tsvector('english', summary), 'A') || setweight(to_tsvector('english', content), 'B')
+    ) stored,  -- Full-text search vector for hybrid search, ranking summary matches higher
+    created_at timestamp with time zone default timezone('utc'::text, now()) not null,
+    
+    -- Add a unique constraint to prevent duplicate chunks for the same URL
+    unique(url, chunk_number),
+    
+    -- Add foreign key constraint to sources table
+    foreign key (source_id) references sources(source_id)
+);
+
+-- Create an index for better vector similarity search performance
+create index on code_examples using ivfflat (embedding vector_cosine_ops);
+
+-- Create an index for full-text search
+create index idx_code_examples_fts on code_examples using gin (fts);
+
+-- Create an index on metadata for faster filtering
+create index idx_code_examples_metadata on code_examples using gin (metadata);
+
+-- Create an index on source_id for faster filtering
+CREATE INDEX idx_code_examples_source_id ON code_examples (source_id);
+
+-- Create a function to search for code examples
+create or replace function match_code_examples (
+  query_embedding vector(1536),
+  match_count int default 10,
+  filter jsonb DEFAULT '{}'::jsonb,
+  source_filter text DEFAULT NULL
+) returns table (
+  id bigint,
+  url varchar,
+  chunk_number integer,
+  content text,
+  summary text,
+  metadata jsonb,
+  source_id text,
+  similarity float
+)
+language plpgsql
+as $$
+#variable_conflict use_column
+begin
+  return query
+  select
+    id,
+    url,
+    chunk_number,
+    content,
+    summary,
+    metadata,
+    source_id,
+    1 - (code_examples.embedding <=> query_embedding) as similarity
+  from code_examples
+  where metadata @> filter
+    AND (source_filter IS NULL OR source_id = source_filter)
+  order by code_examples.embedding <=> query_embedding
+  limit match_count;
+end;
+$$;
+
+-- Create a function for hybrid search over code examples (see hybrid_search_crawled_pages)
+create or replace function hybrid_search_code_examples (
+  query_text text,
+  query_embedding vector(1536),
+  match_count int default 10,
+  filter jsonb DEFAULT '{}'::jsonb,
+  source_filter text DEFAULT NULL,
+  full_text_weight float DEFAULT 1.0,
+  semantic_weight float DEFAULT 1.0,
+  rrf_k int DEFAULT 50
+) returns table (
+  id bigint,
+  url varchar,
+  chunk_number integer,
+  content text,
+  summary text,
+  metadata jsonb,
+  source_id text,
+  similarity float,
+  score float
+)
+language sql
+as $$
+  with full_text as (
+    select
+      code_examples.id,
+      row_number() over (order by ts_rank_cd(code_examples.fts, websearch_to_tsquery('english', query_text)) desc) as rank_ix
+    from code_examples
+    where code_examples.fts @@ websearch_to_tsquery('english', query_text)
+      and code_examples.metadata @> filter
+      and (source_filter is null or code_examples.source_id = source_filter)
+    order by rank_ix
+    limit match_count * 2
+  ),
+  semantic as (
+    select
+      code_examples.id,
+      row_number() over (order by code_examples.embedding <=> query_embedding) as rank_ix
+    from code_examples
+    where code_examples.metadata @> filter
+      and (source_filter is null or code_examples.source_id = source_filter)
+    order by rank_ix
+    limit match_count * 2
+  )
+  select
+    code_examples.id,
+    code_examples.url,
+    code_examples.chunk_number,
+    code_examples.content,
+    code_examples.summary,
+    code_examples.metadata,
+    code_examples.source_id,
+    1 - (code_examples.embedding <=> query_embedding) as similarity,
+    coalesce(1.0 / (rrf_k + full_text.rank_ix), 0.0) * full_text_weight +
+      coalesce(1.0 / (rrf_k + semantic.rank_ix), 0.0) * semantic_weight as score
+  from full_text
+    full outer join semantic on full_text.id = semantic.id
+    join code_examples on coalesce(full_text.id, semantic.id) = code_examples.id
+  order by score desc
+  limit match_count;
+$$;
+
+-- Enable RLS on the code_examples table
+alter table code_examples enable row level security;
+
+-- Create a policy that allows anyone to read code_examples
+create policy "Allow public read access to code_examples"
+  on code_examples
+  for select
+  to public
+  using (true);
+
+-- Keep the page, chunk and word counts of each source up to date as chunks are written.
+-- Statement-level triggers apply one aggregated update per source for a whole batch;
+-- a page is counted through its first chunk
+create or replace function update_source_chunk_stats() returns trigger
+language plpgsql
+as $$
+begin
+  if TG_OP in ('INSERT', 'UPDATE') then
+    update sources set
+      page_count = sources.page_count + d.pages,
+      chunk_count = sources.chunk_count + d.chunks,
+      total_word_count = sources.total_word_count + d.words
+    from (
+      select
+        source_id,
+        count(*) filter (where chunk_number = 0) as pages,
+        count(*) as chunks,
+        coalesce(sum((metadata->>'word_count')::integer), 0) as words
+      from new_rows
+      group by source_id
+    ) d
+    where sources.source_id = d.source_id;
+  end if;
+
+  if TG_OP in ('DELETE', 'UPDATE') then
+    update sources set
+      page_count = sources.page_count - d.pages,
+      chunk_count = sources.chunk_count - d.chunks,
+      total_word_count = sources.total_word_count - d.words
+    from (
+      select
+        source_id,
+        count(*) filter (where chunk_number = 0) as pages,
+        count(*) as chunks,
+        coalesce(sum((metadata->>'word_count')::integer), 0) as words
+      from old_rows
+      group by source_id
+    ) d
+    where sources.source_id = d.source_id;
+  end if;
+
+  return null;
+end;
+$$;
+
+create trigger crawled_pages_stats_insert
+  after insert on crawled_pages
+  referencing new table as new_rows
+  for each statement execute function update_source_chunk_stats();
+
+create trigger crawled_pages_stats_update
+  after update on crawled_pages
+  referencing old table as old_rows new table as new_rows
+  for each statement execute function update_source_chunk_stats();
+
+create trigger crawled_pages_stats_delete
+  after delete on crawled_pages
+  referencing old table as old_rows
+  for each statement execute function update_source_chunk_stats();
+
+-- Keep the code example count of each source up to date
+create or replace function update_source_code_example_stats() returns trigger
+language plpgsql
+as $$
+begin
+  if TG_OP in ('INSERT', 'UPDATE') then
+    update sources set code_example_count = sources.code_example_count + d.examples
+    from (select source_id, count(*) as examples from new_rows group by source_id) d
+    where sources.source_id = d.source_id;
+  end if;
+
+  if TG_OP in ('DELETE', 'UPDATE') then
+    update sources set code_example_count = sources.code_example_count - d.examples
+    from (select source_id, count(*) as examples from old_rows group by source_id) d
+    where sources.source_id = d.source_id;
+  end if;
+
+  return null;
+end;
+$$;
+
+create trigger code_examples_stats_insert
+  after insert on code_examples
+  referencing new table as new_rows
+  for each statement execute function update_source_code_example_stats();
+
+create trigger code_examples_stats_update
+  after update on code_examples
+  referencing old table as old_rows new table as new_rows
+  for each statement execute function update_source_code_example_stats();
+
+create trigger code_examples_stats_delete
+  after delete on code_examples
+  referencing old table as old_rows
+  for each statement execute function update_source_code_example_stats();
+
+-- Recompute the statistics of every source from scratch, e.g. after loading data
+-- with the triggers disabled
+create or replace function refresh_source_stats() returns void
+language sql
+as $$
+  update sources set
+    page_count = coalesce(p.pages, 0),
+    chunk_count = coalesce(p.chunks, 0),
+    total_word_count = coalesce(p.words, 0),
+    code_example_count = coalesce(c.examples, 0)
+  from sources s
+  left join (
+    select
+      source_id,
+      count(*) filter (where chunk_number = 0) as pages,
+      count(*) as chunks,
+      coalesce(sum((metadata->>'word_count')::integer), 0) as words
+    from crawled_pages
+    group by source_id
+  ) p on p.source_id = s.source_id
+  left join (
+    select source_id, count(*) as examples
+    from code_examples
+    group by source_id
+  ) c on c.source_id = s.source_id
+  where sources.source_id = s.source_id;
+$$;
@@ -0,0 +1,234 @@
+"""
+Crawl-wide code example summaries for the Crawl4AI MCP server.
+
+Every page of a crawl summarizes its code examples through one shared summarizer, so
+the number of LLM requests in flight is bounded across the whole crawl instead of per
+page. Summaries are cached by the hash of the code: documentation that repeats the
+same snippet on many pages pays for a single summary, and concurrent requests for the
+same snippet share one LLM call.
+"""
+import os
+import asyncio
+import hashlib
+import time
+from typing import List, Dict, Optional, Any
+
+import openai
+
+from rate_limit import AdaptiveConcurrencyLimiter, MAX_RATE_LIMIT_RETRIES, get_retry_after
+from sqlite_store import SQLiteStore, default_store_path
+
+# Summary used when generation fails; it is never cached
+FALLBACK_SUMMARY = "Code example for demonstration purposes."
+
+def hash_code(code: str) -> str:
+    """
+    Hash a code example for use as a cache key.
+
+    Args:
+        code: Code example
+
+    Returns:
+        Hex sha256 digest of the code
+    """
+    return hashlib.sha256(code.encode("utf-8")).hexdigest()
+
+def build_summary_prompt(code: str, context_before: str, context_after: str) -> str:
+    """
+    Build the prompt asking for the summary of a code example.
+
+    Args:
+        code: The code example
+        context_before: Text before the code
+        context_after: Text after the code
+
+    Returns:
+        The user prompt
+    """
+    return f"""<context_before>
+{context_before[-500:]}
+</context_before>
+
+<code_example>
+{code[:1500]}
+</code_example>
+
+<context_after>
+{context_after[:500]}
+</context_after>
+
+Based on the code example and its surrounding context, provide a concise summary (2-3 sentences) that describes what this code example demonstrates and its purpose. Focus on the practical application and key concepts illustrated.
+"""
+
+class SummaryCache(SQLiteStore):
+    """SQLite-backed cache of code example summaries, keyed by (model, code hash)."""
+
+    def __init__(self, path: str, max_age_days: float = 30.0):
+        super().__init__(path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS code_summaries (
+                model TEXT NOT NULL,
+                code_hash TEXT NOT NULL,
+                summary TEXT NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, code_hash)
+            )
+        """)
+        self._conn.execute("DELETE FROM code_summaries WHERE last_used < ?", (time.time() - max_age_days * 86400,))
+        self._conn.commit()
+
+    def get_many(self, model: str, code_hashes: List[str]) -> Dict[str, str]:
+        """
+        Look up the cached summaries of code examples.
+
+        Args:
+            model: Model that generated the summaries
+            code_hashes: Hashes of the code examples
+
+        Returns:
+            Dictionary mapping each cached code hash to its summary
+        """
+        with self._lock:
+            found = dict(self._select_in(
+                "SELECT code_hash, summary FROM code_summaries WHERE model = ? AND code_hash IN ({placeholders})",
+                code_hashes, [model]
+            ))
+            if found:
+                self._conn.executemany(
+                    "UPDATE code_summaries SET last_used = ? WHERE model = ? AND code_hash = ?",
+                    [(time.time(), model, code_hash) for code_hash in found]
+                )
+                self._conn.commit()
+        return found
+
+    def put(self, model: str, code_hash: str, summary: str) -> None:
+        """
+        Store the summary of a code example.
+
+        Args:
+            model: Model that generated the summary
+            code_hash: Hash of the code example
+            summary: The summary
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO code_summaries (model, code_hash, summary, last_used) VALUES (?, ?, ?, ?)",
+                (model, code_hash, summary, time.time())
+            )
+            self._conn.commit()
+
+class CodeSummarizer:
+    """
+    Summarizes code examples with one adaptive concurrency limit for the whole crawl.
+
+    The limit starts at max_concurrency, backs off when the provider answers with
+    rate-limit errors (which are retried) and recovers as requests succeed again.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        model: str,
+        max_concurrency: int = 10,
+        cache: Optional[SummaryCache] = None
+    ):
+        self.client = client
+        self.model = model
+        self.cache = cache
+        self.limiter = AdaptiveConcurrencyLimiter(max_concurrency)
+
+        self.requests = 0
+        self.cache_hits = 0
+
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    async def summarize(self, code_blocks: List[Dict[str, Any]]) -> List[str]:
+        """
+        Summarize the code examples of a page.
+
+        Args:
+            code_blocks: Code blocks with their 'code', 'context_before' and 'context_after'
+
+        Returns:
+            Summary of each code block in the same order
+        """
+        code_hashes = [hash_code(block['code']) for block in code_blocks]
+        cached = {}
+        if self.cache:
+            cached = await asyncio.to_thread(self.cache.get_many, self.model, code_hashes)
+        self.cache_hits += len([code_hash for code_hash in code_hashes if code_hash in cached])
+
+        async def summary_of(block: Dict[str, Any], code_hash: str) -> str:
+            if code_hash in cached:
+                return cached[code_hash]
+            # Another page is already summarizing the same snippet; share its result
+            future = self._in_flight.get(code_hash)
+            if future is None:
+                future = asyncio.ensure_future(self._summarize_one(block, code_hash))
+                self._in_flight[code_hash] = future
+                future.add_done_callback(lambda _: self._in_flight.pop(code_hash, None))
+            return await asyncio.shield(future)
+
+        return list(await asyncio.gather(*(
+            summary_of(block, code_hash) for block, code_hash in zip(code_blocks, code_hashes)
+        )))
+
+    async def _summarize_one(self, block: Dict[str, Any], code_hash: str) -> str:
+        """Generate the summary of one code example and cache it."""
+        messages = [
+            {"role": "system", "content": "You are a helpful assistant that provides concise code example summaries."},
+            {"role": "user", "content": build_summary_prompt(block['code'], block['context_before'], block['context_after'])}
+        ]
+
+        summary = None
+        for attempt in range(MAX_RATE_LIMIT_RETRIES):
+            async with self.limiter.slot():
+                self.requests += 1
+                try:
+                    response = await self.client.chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                        temperature=0.3,
+                        max_tokens=100
+                    )
+                    self.limiter.record_success()
+                    summary = response.choices[0].message.content.strip()
+                    break
+                except openai.RateLimitError as e:
+                    self.limiter.record_rate_limit(get_retry_after(e))
+                    if attempt == MAX_RATE_LIMIT_RETRIES - 1:
+                        print(f"Still rate limited after {MAX_RATE_LIMIT_RETRIES} attempts summarizing a code example.")
+                except Exception as e:
+                    print(f"Error generating code example summary: {e}")
+                    break
+        if not summary:
+            return FALLBACK_SUMMARY
+
+        if self.cache:
+            await asyncio.to_thread(self.cache.put, self.model, code_hash, summary)
+        return summary
+
+_summary_cache: Optional[SummaryCache] = None
+
+def get_summary_cache() -> Optional[SummaryCache]:
+    """
+    Get the shared code summary cache, creating it on first use.
+
+    The cache is enabled unless USE_CODE_SUMMARY_CACHE is set to "false", and its
+    location is configured with CODE_SUMMARY_CACHE_PATH.
+
+    Returns:
+        The summary cache, or None if caching is disabled or the database can't be opened
+    """
+    global _summary_cache
+    if os.getenv("USE_CODE_SUMMARY_CACHE", "true") != "true":
+        return None
+
+    if _summary_cache is None:
+        path = os.getenv("CODE_SUMMARY_CACHE_PATH", default_store_path("code_summaries.sqlite"))
+        try:
+            _summary_cache = SummaryCache(path)
+        except Exception as e:
+            print(f"Failed to open code summary cache at {path}: {e}. Continuing without it.")
+            return None
+    return _summary_cache
@@ -0,0 +1,239 @@
+"""
+Batched contextual-embedding generation for the Crawl4AI MCP server.
+
+Instead of sending the full document once per chunk, the contextualizer asks for the
+context of many chunks of a document in one structured request. Every request for a
+document starts with the same document prefix, and the first request of a document
+completes before the rest are sent, so the provider's prompt cache is warm for them.
+Generated contexts are cached by (document hash, chunk hash).
+"""
+import os
+import json
+import asyncio
+import hashlib
+import time
+from typing import List, Dict, Optional, Any
+
+import openai
+
+from rate_limit import AdaptiveConcurrencyLimiter, MAX_RATE_LIMIT_RETRIES, get_retry_after
+from sqlite_store import SQLiteStore, default_store_path
+
+# Only the start of very long documents is sent as context
+MAX_DOCUMENT_CHARS = 25000
+
+SYSTEM_PROMPT = (
+    "You are a helpful assistant that provides concise contextual information. "
+    "Given a document and numbered chunks taken from it, give each chunk a short "
+    "succinct context that situates it within the overall document for the purposes "
+    "of improving search retrieval of the chunk. Respond with JSON of the form "
+    '{"contexts": [{"id": <chunk id>, "context": "<succinct context>"}]}, '
+    "with one entry per chunk and nothing else."
+)
+
+def _hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class ContextCache(SQLiteStore):
+    """SQLite-backed cache of generated chunk contexts, keyed by (document hash, chunk hash)."""
+
+    def __init__(self, path: str, max_age_days: float = 30.0):
+        super().__init__(path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS chunk_contexts (
+                model TEXT NOT NULL,
+                document_hash TEXT NOT NULL,
+                chunk_hash TEXT NOT NULL,
+                context TEXT NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, document_hash, chunk_hash)
+            )
+        """)
+        # Contexts of documents that haven't been seen in a while are unlikely to be needed again
+        self._conn.execute("DELETE FROM chunk_contexts WHERE last_used < ?", (time.time() - max_age_days * 86400,))
+        self._conn.commit()
+
+    def get_many(self, model: str, document_hash: str, chunk_hashes: List[str]) -> Dict[str, str]:
+        """
+        Look up the cached contexts of chunks of a document.
+
+        Args:
+            model: Model that generated the contexts
+            document_hash: Hash of the document
+            chunk_hashes: Hashes of the chunks
+
+        Returns:
+            Dictionary mapping each cached chunk hash to its context
+        """
+        with self._lock:
+            found = dict(self._select_in(
+                "SELECT chunk_hash, context FROM chunk_contexts WHERE model = ? AND document_hash = ? AND chunk_hash IN ({placeholders})",
+                chunk_hashes, [model, document_hash]
+            ))
+            if found:
+                self._conn.executemany(
+                    "UPDATE chunk_contexts SET last_used = ? WHERE model = ? AND document_hash = ? AND chunk_hash = ?",
+                    [(time.time(), model, document_hash, chunk_hash) for chunk_hash in found]
+                )
+                self._conn.commit()
+        return found
+
+    def put_many(self, model: str, document_hash: str, contexts: Dict[str, str]) -> None:
+        """
+        Store generated contexts of chunks of a document.
+
+        Args:
+            model: Model that generated the contexts
+            document_hash: Hash of the document
+            contexts: Dictionary mapping chunk hashes to their context
+        """
+        if not contexts:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunk_contexts (model, document_hash, chunk_hash, context, last_used) VALUES (?, ?, ?, ?, ?)",
+                [(model, document_hash, chunk_hash, context, now) for chunk_hash, context in contexts.items()]
+            )
+            self._conn.commit()
+
+class Contextualizer:
+    """
+    Generates contexts for the chunks of a document with as few LLM requests as possible.
+
+    Chunks are sent chunks_per_request at a time. Requests from all documents share one
+    adaptive concurrency limit: it starts at max_concurrency, backs off when the
+    provider answers with rate-limit errors (which are retried) and recovers as
+    requests succeed again.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        model: str,
+        chunks_per_request: int = 8,
+        max_concurrency: int = 10,
+        cache: Optional[ContextCache] = None
+    ):
+        self.client = client
+        self.model = model
+        self.chunks_per_request = chunks_per_request
+        self.cache = cache
+        self.limiter = AdaptiveConcurrencyLimiter(max_concurrency)
+
+        self.requests = 0
+        self.cache_hits = 0
+
+    async def contextualize(self, full_document: str, chunks: List[str]) -> List[Optional[str]]:
+        """
+        Generate the context of every chunk of a document.
+
+        Args:
+            full_document: The complete document text
+            chunks: Chunks of the document
+
+        Returns:
+            Context of each chunk in the same order as chunks (None where generation failed)
+        """
+        document = full_document[:MAX_DOCUMENT_CHARS]
+        document_hash = _hash(document)
+        chunk_hashes = [_hash(chunk) for chunk in chunks]
+
+        contexts: List[Optional[str]] = [None] * len(chunks)
+        cached = {}
+        if self.cache:
+            cached = await asyncio.to_thread(self.cache.get_many, self.model, document_hash, chunk_hashes)
+        for i, chunk_hash in enumerate(chunk_hashes):
+            contexts[i] = cached.get(chunk_hash)
+        self.cache_hits += len([c for c in contexts if c is not None])
+
+        missing = [i for i, context in enumerate(contexts) if context is None]
+        groups = [missing[i:i + self.chunks_per_request] for i in range(0, len(missing), self.chunks_per_request)]
+        if not groups:
+            return contexts
+
+        # The first request writes the document prefix to the provider's prompt cache,
+        # the rest of the document's requests then read it
+        results = [await self._request(document, [chunks[i] for i in groups[0]])]
+        results += await asyncio.gather(*(self._request(document, [chunks[i] for i in group]) for group in groups[1:]))
+
+        generated = {}
+        for group, group_contexts in zip(groups, results):
+            for i, context in zip(group, group_contexts):
+                contexts[i] = context
+                if context:
+                    generated[chunk_hashes[i]] = context
+        if self.cache and generated:
+            await asyncio.to_thread(self.cache.put_many, self.model, document_hash, generated)
+
+        return contexts
+
+    async def _request(self, document: str, chunks: List[str]) -> List[Optional[str]]:
+        """Ask for the contexts of a group of chunks in one request."""
+        chunk_list = "\n".join(f'<chunk id="{i}">\n{chunk}\n</chunk>' for i, chunk in enumerate(chunks))
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            # The document comes first so every request for it shares the same prefix
+            {"role": "user", "content": f"<document>\n{document}\n</document>\n\nChunks to situate within the document:\n{chunk_list}"}
+        ]
+
+        parsed = None
+        for attempt in range(MAX_RATE_LIMIT_RETRIES):
+            async with self.limiter.slot():
+                self.requests += 1
+                try:
+                    response = await self.client.chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                        temperature=0.3,
+                        max_tokens=150 * len(chunks) + 50,
+                        response_format={"type": "json_object"}
+                    )
+                    parsed = json.loads(response.choices[0].message.content)
+                    self.limiter.record_success()
+                    break
+                except openai.RateLimitError as e:
+                    self.limiter.record_rate_limit(get_retry_after(e))
+                    if attempt == MAX_RATE_LIMIT_RETRIES - 1:
+                        print(f"Still rate limited after {MAX_RATE_LIMIT_RETRIES} attempts. Using original chunks instead.")
+                except Exception as e:
+                    print(f"Error generating contexts for {len(chunks)} chunks: {e}. Using original chunks instead.")
+                    break
+        if parsed is None:
+            return [None] * len(chunks)
+
+        contexts: List[Optional[str]] = [None] * len(chunks)
+        for entry in parsed.get("contexts", []) if isinstance(parsed, dict) else []:
+            try:
+                chunk_id = int(entry["id"])
+                context = str(entry["context"]).strip()
+            except (KeyError, TypeError, ValueError):
+                continue
+            if 0 <= chunk_id < len(chunks) and context:
+                contexts[chunk_id] = context
+        return contexts
+
+_context_cache: Optional[ContextCache] = None
+
+def get_context_cache() -> Optional[ContextCache]:
+    """
+    Get the shared chunk context cache, creating it on first use.
+
+    The cache is enabled unless USE_CONTEXTUAL_CACHE is set to "false", and its location
+    is configured with CONTEXTUAL_CACHE_PATH.
+
+    Returns:
+        The context cache, or None if caching is disabled or the database can't be opened
+    """
+    global _context_cache
+    if os.getenv("USE_CONTEXTUAL_CACHE", "true") != "true":
+        return None
+
+    if _context_cache is None:
+        path = os.getenv("CONTEXTUAL_CACHE_PATH", default_store_path("contexts.sqlite"))
+        try:
+            _context_cache = ContextCache(path)
+        except Exception as e:
+            print(f"Failed to open contextual cache at {path}: {e}. Continuing without it.")
+            return None
+    return _context_cache
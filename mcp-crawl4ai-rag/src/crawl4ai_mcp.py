@@ -5,36 +5,46 @@ This server provides tools to crawl websites using Crawl4AI, automatically detec
 the appropriate crawl method based on URL type (sitemap, txt file, or regular webpage).
 """
 from mcp.server.fastmcp import FastMCP, Context
-from sentence_transformers import CrossEncoder
 from contextlib import asynccontextmanager
 from collections.abc import AsyncIterator
 from dataclasses import dataclass
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Set, Tuple, Union, Callable
 from urllib.parse import urlparse, urldefrag
-from xml.etree import ElementTree
 from dotenv import load_dotenv
-from supabase import Client
+from supabase import AsyncClient
 from pathlib import Path
-import requests
 import asyncio
 import json
 import os
 import re
-import concurrent.futures
+import httpx
+from functools import partial
 
-from crawl4ai import AsyncWebCrawler, BrowserConfig, CrawlerRunConfig, CacheMode, MemoryAdaptiveDispatcher
+from crawl4ai import CrawlerRunConfig, CacheMode
 
 from utils import (
     get_supabase_client, 
     add_documents_to_supabase, 
+    DocumentIndexer,
     search_documents,
+    hybrid_search_documents,
+    hybrid_search_code_examples,
     extract_code_blocks,
-    generate_code_example_summary,
     add_code_examples_to_supabase,
-    update_source_info,
-    extract_source_summary,
-    search_code_examples
+    ensure_source,
+    refresh_source_info,
+    search_code_examples,
+    get_token_counter,
+    get_code_summarizer
 )
+from crawl_ledger import CrawlLedger, get_crawl_ledger, hash_content
+from crawl_frontier import HostPoliteness, canonicalize_url, get_strip_query_params, iter_queue_until_done
+from sitemaps import iter_sitemap_entries
+from reranker import Reranker
+from markdown_chunker import iter_chunks
+from supabase_metrics import call_metrics, timed_execute
+from crawler_pool import CrawlerPool, CrawlerLease
+from crawl_jobs import CrawlJobQueue, JobProgress, get_crawl_job_store, FINISHED_STATES
 
 # Load environment variables from the project root .env file
 project_root = Path(__file__).resolve().parent.parent
@@ -47,9 +57,11 @@ load_dotenv(dotenv_path, override=True)
 @dataclass
 class Crawl4AIContext:
     """Context for the Crawl4AI MCP server."""
-    crawler: AsyncWebCrawler
-    supabase_client: Client
-    reranking_model: Optional[CrossEncoder] = None
+    crawler_pool: CrawlerPool
+    supabase_client: AsyncClient
+    http_client: httpx.AsyncClient
+    reranker: Optional[Reranker] = None
+    job_queue: Optional[CrawlJobQueue] = None
 
 @asynccontextmanager
 async def crawl4ai_lifespan(server: FastMCP) -> AsyncIterator[Crawl4AIContext]:
@@ -60,39 +72,55 @@ async def crawl4ai_lifespan(server: FastMCP) -> AsyncIterator[Crawl4AIContext]:
         server: The FastMCP server instance
         
     Yields:
-        Crawl4AIContext: The context containing the Crawl4AI crawler and Supabase client
+        Crawl4AIContext: The context containing the Crawl4AI crawler pool and Supabase client
     """
-    # Create browser configuration
-    browser_config = BrowserConfig(
-        headless=True,
-        verbose=False
-    )
+    # Start the browsers shared by every crawl
+    crawler_pool = CrawlerPool.from_env()
+    await crawler_pool.start()
     
-    # Initialize the crawler
-    crawler = AsyncWebCrawler(config=browser_config)
-    await crawler.__aenter__()
+    # Initialize the shared async Supabase client (one pooled, keep-alive session)
+    supabase_client = await get_supabase_client()
     
-    # Initialize Supabase client
-    supabase_client = get_supabase_client()
+    # Shared HTTP client for sitemaps, conditional GETs and the HTTP fast path, reusing connections
+    http_client = httpx.AsyncClient(
+        timeout=httpx.Timeout(30.0, connect=10.0),
+        follow_redirects=True,
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=20)
+    )
     
-    # Initialize cross-encoder model for reranking if enabled
-    reranking_model = None
-    if os.getenv("USE_RERANKING", "false") == "true":
-        try:
-            reranking_model = CrossEncoder("cross-encoder/ms-marco-MiniLM-L-6-v2")
-        except Exception as e:
-            print(f"Failed to load reranking model: {e}")
-            reranking_model = None
+    # Set up cross-encoder reranking if enabled (the model is loaded on first use)
+    reranker = Reranker.from_env() if os.getenv("USE_RERANKING", "false") == "true" else None
     
+    context = Crawl4AIContext(
+        crawler_pool=crawler_pool,
+        supabase_client=supabase_client,
+        http_client=http_client,
+        reranker=reranker
+    )
+    
+    # Background crawl jobs; jobs interrupted by the last shutdown are resumed
     try:
-        yield Crawl4AIContext(
-            crawler=crawler,
-            supabase_client=supabase_client,
-            reranking_model=reranking_model
+        context.job_queue = CrawlJobQueue(
+            get_crawl_job_store(),
+            partial(run_crawl_job, context),
+            max_concurrency=int(os.getenv("CRAWL_JOB_MAX_CONCURRENCY", "2"))
         )
+        await context.job_queue.start()
+    except Exception as e:
+        print(f"Failed to start the crawl job queue: {e}. Continuing without background jobs.")
+        context.job_queue = None
+    
+    try:
+        yield context
     finally:
-        # Clean up the crawler
-        await crawler.__aexit__(None, None, None)
+        # Stop the job workers first, then clean up the browsers, HTTP clients and reranker
+        if context.job_queue:
+            await context.job_queue.close()
+        await crawler_pool.close()
+        await http_client.aclose()
+        await supabase_client.postgrest.aclose()
+        if reranker:
+            await reranker.close()
 
 # Initialize FastMCP server
 mcp = FastMCP(
@@ -103,12 +131,12 @@ mcp = FastMCP(
     port=os.getenv("PORT", "8051")
 )
 
-def rerank_results(model: CrossEncoder, query: str, results: List[Dict[str, Any]], content_key: str = "content") -> List[Dict[str, Any]]:
+async def rerank_results(reranker: Optional[Reranker], query: str, results: List[Dict[str, Any]], content_key: str = "content") -> List[Dict[str, Any]]:
     """
     Rerank search results using a cross-encoder model.
     
     Args:
-        model: The cross-encoder model to use for reranking
+        reranker: The reranker to score the results with
         query: The search query
         results: List of search results
         content_key: The key in each result dict that contains the text content
@@ -116,18 +144,15 @@ def rerank_results(model: CrossEncoder, query: str, results: List[Dict[str, Any]
     Returns:
         Reranked list of results
     """
-    if not model or not results:
+    if not reranker or not results:
         return results
     
     try:
         # Extract content from results
-        texts = [result.get(content_key, "") for result in results]
-        
-        # Create pairs of [query, document] for the cross-encoder
-        pairs = [[query, text] for text in texts]
+        texts = [result.get(content_key, "") or "" for result in results]
         
-        # Get relevance scores from the cross-encoder
-        scores = model.predict(pairs)
+        # Get relevance scores from the cross-encoder (batched with concurrent queries and cached)
+        scores = await reranker.score(query, texts)
         
         # Add scores to results and sort by score (descending)
         for i, result in enumerate(results):
@@ -165,72 +190,183 @@ def is_txt(url: str) -> bool:
     """
     return url.endswith('.txt')
 
-def parse_sitemap(sitemap_url: str) -> List[str]:
+def extract_validators(headers: Optional[Dict[str, str]]) -> Dict[str, Optional[str]]:
     """
-    Parse a sitemap and extract URLs.
+    Extract the HTTP cache validators from a crawl response.
     
     Args:
-        sitemap_url: URL of the sitemap
+        headers: Response headers of the crawled page
         
     Returns:
-        List of URLs found in the sitemap
+        Dictionary with the etag and last_modified values (None if missing)
     """
-    resp = requests.get(sitemap_url)
-    urls = []
-
-    if resp.status_code == 200:
-        try:
-            tree = ElementTree.fromstring(resp.content)
-            urls = [loc.text for loc in tree.findall('.//{*}loc')]
-        except Exception as e:
-            print(f"Error parsing sitemap XML: {e}")
-
-    return urls
-
-def smart_chunk_markdown(text: str, chunk_size: int = 5000) -> List[str]:
-    """Split text into chunks, respecting code blocks and paragraphs."""
-    chunks = []
-    start = 0
-    text_length = len(text)
-
-    while start < text_length:
-        # Calculate end position
-        end = start + chunk_size
-
-        # If we're at the end of the text, just take what's left
-        if end >= text_length:
-            chunks.append(text[start:].strip())
-            break
-
-        # Try to find a code block boundary first (```)
-        chunk = text[start:end]
-        code_block = chunk.rfind('```')
-        if code_block != -1 and code_block > chunk_size * 0.3:
-            end = start + code_block
-
-        # If no code block, try to break at a paragraph
-        elif '\n\n' in chunk:
-            # Find the last paragraph break
-            last_break = chunk.rfind('\n\n')
-            if last_break > chunk_size * 0.3:  # Only break if we're past 30% of chunk_size
-                end = start + last_break
+    headers = {k.lower(): v for k, v in (headers or {}).items()}
+    return {
+        'etag': headers.get('etag'),
+        'last_modified': headers.get('last-modified')
+    }
 
-        # If no paragraph break, try to break at a sentence
-        elif '. ' in chunk:
-            # Find the last sentence break
-            last_period = chunk.rfind('. ')
-            if last_period > chunk_size * 0.3:  # Only break if we're past 30% of chunk_size
-                end = start + last_period + 1
+async def is_not_modified(http_client: httpx.AsyncClient, url: str, etag: Optional[str], last_modified: Optional[str]) -> bool:
+    """
+    Check with a conditional GET whether a page has changed since it was last crawled.
+    
+    Args:
+        http_client: Shared async HTTP client
+        url: URL of the page
+        etag: ETag returned by the previous crawl
+        last_modified: Last-Modified header returned by the previous crawl
+        
+    Returns:
+        True if the server answered 304 Not Modified, False otherwise
+    """
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    
+    try:
+        # Stream so a 200 response doesn't download the body we're about to render anyway
+        async with http_client.stream("GET", url, headers=headers, timeout=10) as resp:
+            return resp.status_code == 304
+    except Exception as e:
+        print(f"Conditional GET failed for {url}: {e}")
+        return False
 
-        # Extract chunk and clean it up
-        chunk = text[start:end].strip()
-        if chunk:
-            chunks.append(chunk)
+async def find_unchanged_urls(
+    http_client: httpx.AsyncClient,
+    ledger: CrawlLedger,
+    urls: List[str],
+    sitemap_lastmods: Optional[Dict[str, str]] = None,
+    max_concurrent: int = 20
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Find the URLs that haven't changed since their last crawl.
+    
+    A page is unchanged if its sitemap <lastmod> matches the one recorded in the ledger,
+    or, when the sitemap has no lastmod for it, if a conditional GET with the stored
+    ETag/Last-Modified validators returns 304 Not Modified.
+    
+    Args:
+        http_client: Shared async HTTP client for the conditional GETs
+        ledger: Crawl ledger with the previous crawl of each URL
+        urls: URLs to check
+        sitemap_lastmods: Optional mapping of URL to its current sitemap <lastmod>
+        max_concurrent: Maximum number of conditional GET requests in flight
+        
+    Returns:
+        Dictionary mapping each unchanged URL to its ledger entry
+    """
+    entries = await asyncio.to_thread(ledger.get_many, urls)
+    sitemap_lastmods = sitemap_lastmods or {}
+    unchanged = {}
+    to_check = []
+    
+    for url in urls:
+        entry = entries.get(url)
+        if not entry or not entry['content_hash']:
+            continue
+        lastmod = sitemap_lastmods.get(url)
+        if lastmod:
+            # The sitemap is authoritative when it provides a lastmod
+            if entry['lastmod'] == lastmod:
+                unchanged[url] = entry
+        elif entry['etag'] or entry['last_modified']:
+            to_check.append(entry)
+    
+    semaphore = asyncio.Semaphore(max_concurrent)
+    
+    async def check(entry: Dict[str, Any]) -> bool:
+        async with semaphore:
+            return await is_not_modified(http_client, entry['url'], entry['etag'], entry['last_modified'])
+    
+    results = await asyncio.gather(*(check(entry) for entry in to_check))
+    for entry, not_modified in zip(to_check, results):
+        if not_modified:
+            unchanged[entry['url']] = entry
+    
+    return unchanged
 
-        # Move start position for next chunk
-        start = end
+async def iter_changed_sitemap_urls(
+    http_client: httpx.AsyncClient,
+    entries: AsyncIterator[Dict[str, Optional[str]]],
+    ledger: Optional[CrawlLedger],
+    sitemap_lastmods: Dict[str, str],
+    unchanged_entries: Dict[str, Dict[str, Any]],
+    batch_size: int = 200
+) -> AsyncIterator[str]:
+    """
+    Yield the URLs of streamed sitemap entries that need to be crawled.
+    
+    Entries are checked against the ledger in batches as they are discovered, so the
+    crawl can start before the whole sitemap has been downloaded.
+    
+    Args:
+        http_client: Shared async HTTP client for conditional GETs
+        entries: Sitemap entries with their URL and <lastmod>
+        ledger: Crawl ledger to skip unchanged pages with (None crawls every URL)
+        sitemap_lastmods: Filled in with the <lastmod> of every entry that has one
+        unchanged_entries: Filled in with the ledger entry of every unchanged URL; URLs
+            that are already in it are skipped
+        batch_size: Number of URLs checked against the ledger at a time
+        
+    Yields:
+        URLs to crawl
+    """
+    async def changed(urls: List[str]) -> List[str]:
+        urls = [u for u in urls if u not in unchanged_entries]
+        if not ledger:
+            return urls
+        unchanged = await find_unchanged_urls(http_client, ledger, urls, sitemap_lastmods)
+        unchanged_entries.update(unchanged)
+        return [u for u in urls if u not in unchanged]
+    
+    batch = []
+    async for entry in entries:
+        if entry['lastmod']:
+            sitemap_lastmods[entry['url']] = entry['lastmod']
+        batch.append(entry['url'])
+        if len(batch) >= batch_size:
+            for changed_url in await changed(batch):
+                yield changed_url
+            batch = []
+    
+    if batch:
+        for changed_url in await changed(batch):
+            yield changed_url
 
-    return chunks
+def chunk_page(markdown: str, chunk_size: Optional[int] = None) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """
+    Chunk a page and build the metadata of each chunk.
+    
+    Chunks are sized in characters, or in tokens of the embedding model when
+    CHUNK_SIZE_UNIT is "tokens", and consecutive chunks of a section share
+    CHUNK_OVERLAP characters or tokens of trailing sentences.
+    
+    Args:
+        markdown: Markdown content of the page
+        chunk_size: Maximum size of each chunk (default: 5000 characters or 1000 tokens)
+        
+    Returns:
+        Tuple of the chunk texts and their metadata (section info, heading path and
+        byte offsets of the chunk in the page)
+    """
+    token_counter = get_token_counter()
+    if chunk_size is None:
+        chunk_size = 1000 if token_counter else 5000
+    overlap = int(os.getenv("CHUNK_OVERLAP", "0"))
+    
+    contents = []
+    metadatas = []
+    for i, chunk in enumerate(iter_chunks(markdown, max_size=chunk_size, token_counter=token_counter, overlap=overlap)):
+        meta = extract_section_info(chunk.text)
+        meta["chunk_index"] = i
+        meta["heading_path"] = " > ".join(chunk.heading_path)
+        meta["byte_start"] = chunk.start
+        meta["byte_end"] = chunk.end
+        contents.append(chunk.text)
+        metadatas.append(meta)
+    return contents, metadatas
 
 def extract_section_info(chunk: str) -> Dict[str, Any]:
     """
@@ -251,19 +387,288 @@ def extract_section_info(chunk: str) -> Dict[str, Any]:
         "word_count": len(chunk.split())
     }
 
-def process_code_example(args):
+def build_ledger_entry(
+    doc: Dict[str, Any],
+    content_hash: str,
+    word_count: int,
+    previous: Dict[str, Any],
+    sitemap_lastmods: Dict[str, str]
+) -> Dict[str, Any]:
+    """
+    Build the crawl ledger entry for a page rendered during a crawl.
+    
+    Args:
+        doc: Crawled page with its validators and internal links
+        content_hash: Hash of the page's markdown
+        word_count: Word count of the page
+        previous: Ledger entry from before this crawl (empty if the page is new)
+        sitemap_lastmods: Mapping of URL to its sitemap <lastmod>
+        
+    Returns:
+        Ledger entry ready for CrawlLedger.upsert_many
+    """
+    validators = doc.get('validators', {})
+    return {
+        'url': doc['url'],
+        'lastmod': sitemap_lastmods.get(doc['url']),
+        'etag': validators.get('etag'),
+        'last_modified': validators.get('last_modified'),
+        'content_hash': content_hash,
+        'word_count': word_count,
+        'internal_links': doc.get('internal_links', previous.get('internal_links', []))
+    }
+
+async def iterate_pages(docs: List[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
     """
-    Process a single code example to generate its summary.
-    This function is designed to be used with concurrent.futures.
+    Iterate over already crawled pages with the same interface as a streaming crawl.
     
     Args:
-        args: Tuple containing (code, context_before, context_after)
+        docs: Crawled pages
+        
+    Yields:
+        Each crawled page
+    """
+    for doc in docs:
+        yield doc
+
+async def index_code_examples(supabase_client: AsyncClient, url: str, source_id: str, code_blocks: List[Dict[str, Any]]) -> int:
+    """
+    Summarize the code blocks of a page and store them in the code_examples table.
+    
+    Args:
+        supabase_client: Supabase client
+        url: URL of the page the code blocks come from
+        source_id: Source ID of the page
+        code_blocks: Code blocks extracted from the page
         
     Returns:
-        The generated summary
+        Number of code examples stored
     """
-    code, context_before, context_after = args
-    return generate_code_example_summary(code, context_before, context_after)
+    # Summaries come from the crawl-wide summarizer, which bounds the LLM requests in
+    # flight across all pages and reuses summaries of snippets seen before
+    summaries = await get_code_summarizer().summarize(code_blocks)
+    
+    code_urls = []
+    code_chunk_numbers = []
+    code_examples = []
+    code_summaries = []
+    code_metadatas = []
+    
+    # Prepare code example data
+    for i, (block, summary) in enumerate(zip(code_blocks, summaries)):
+        code_urls.append(url)
+        code_chunk_numbers.append(i)
+        code_examples.append(block['code'])
+        code_summaries.append(summary)
+        
+        # Create metadata for code example
+        code_meta = {
+            "chunk_index": i,
+            "url": url,
+            "source": source_id,
+            "char_count": len(block['code']),
+            "word_count": len(block['code'].split())
+        }
+        code_metadatas.append(code_meta)
+    
+    # Add code examples to Supabase
+    await add_code_examples_to_supabase(
+        supabase_client, 
+        code_urls, 
+        code_chunk_numbers, 
+        code_examples, 
+        code_summaries, 
+        code_metadatas
+    )
+    return len(code_examples)
+
+# Finished pages recorded in the crawl ledger at a time while indexing
+LEDGER_FLUSH_PAGES = 50
+
+async def index_crawled_pages(
+    supabase_client: AsyncClient,
+    ledger: CrawlLedger,
+    pages: AsyncIterator[Dict[str, Any]],
+    crawl_type: str,
+    chunk_size: Optional[int] = None,
+    incremental: bool = False,
+    unchanged_entries: Optional[Dict[str, Dict[str, Any]]] = None,
+    sitemap_lastmods: Optional[Dict[str, str]] = None,
+    on_progress: Optional[Callable[[str, str], None]] = None
+) -> Dict[str, Any]:
+    """
+    Chunk, embed and store crawled pages as they arrive.
+    
+    Each page is chunked and handed to a DocumentIndexer as soon as it is yielded, so
+    with a streaming crawl the browser and the embedding/insert work overlap and only
+    the in-flight window of pages is held in memory. Code examples are summarized and
+    stored in the background for a bounded number of pages at a time.
+    
+    A page is recorded in the ledger once its chunks and code examples have been
+    stored, in batches of LEDGER_FLUSH_PAGES pages, so an interrupted crawl keeps the
+    record of every page it finished.
+    
+    Args:
+        supabase_client: Supabase client
+        ledger: Crawl ledger that records every rendered page
+        pages: Async iterator of crawled pages
+        crawl_type: Type of crawl, stored in the chunk metadata
+        chunk_size: Maximum size of each content chunk (default: see chunk_page)
+        incremental: Skip pages whose content hash matches the ledger
+        unchanged_entries: Ledger entries of pages already known to be unchanged
+        sitemap_lastmods: Mapping of URL to its sitemap <lastmod>
+        on_progress: Called with an event and a URL when a page is "crawled" (queued
+            for indexing), "unchanged", "stored" (finished and recorded in the ledger),
+            or "failed" (some of its chunks couldn't be written; not recorded)
+        
+    Returns:
+        Dictionary with the crawl statistics
+    """
+    unchanged_entries = unchanged_entries if unchanged_entries is not None else {}
+    sitemap_lastmods = sitemap_lastmods or {}
+    extract_code_examples_enabled = os.getenv("USE_AGENTIC_RAG", "false") == "true"
+    
+    report = on_progress or (lambda event, url: None)
+    
+    crawled_urls = []
+    chunk_count = 0
+    
+    # Ledger entries of pages still being stored, with the number of parts (chunks,
+    # code examples) left to store, and of finished pages not yet written to the ledger
+    pending_entries: Dict[str, Dict[str, Any]] = {}
+    pending_parts: Dict[str, int] = {}
+    finished_entries: List[Dict[str, Any]] = []
+    
+    failed_urls = []
+    
+    def part_stored(url: str) -> None:
+        # Pages that already failed stay out of the ledger
+        if url not in pending_parts:
+            return
+        pending_parts[url] -= 1
+        if not pending_parts[url]:
+            del pending_parts[url]
+            finished_entries.append(pending_entries.pop(url))
+    
+    def page_failed(url: str) -> None:
+        # Without a ledger entry the next incremental crawl indexes the page again
+        if url not in pending_parts:
+            return
+        del pending_parts[url]
+        pending_entries.pop(url)
+        failed_urls.append(url)
+        report("failed", url)
+    
+    async def flush_ledger() -> None:
+        entries = finished_entries[:]
+        finished_entries.clear()
+        await asyncio.to_thread(ledger.upsert_many, entries)
+        for entry in entries:
+            report("stored", entry['url'])
+    
+    # Pages whose content changed, per source, and the content each source's summary
+    # would be generated from (the first changed page of the source)
+    source_pages_changed: Dict[str, int] = {}
+    summary_inputs: Dict[str, str] = {}
+    
+    code_tasks = []
+    code_semaphore = asyncio.Semaphore(int(os.getenv("CODE_EXAMPLE_MAX_PENDING_PAGES", "4")))
+    
+    async def store_code_examples(source_url: str, source_id: str, code_blocks: List[Dict[str, Any]]) -> int:
+        try:
+            return await index_code_examples(supabase_client, source_url, source_id, code_blocks)
+        finally:
+            code_semaphore.release()
+            part_stored(source_url)
+    
+    async with DocumentIndexer(supabase_client, on_page_stored=part_stored, on_page_failed=page_failed) as indexer:
+        async for doc in pages:
+            source_url = doc['url']
+            if len(finished_entries) >= LEDGER_FLUSH_PAGES:
+                await flush_ledger()
+            
+            if doc.get('unchanged_entry'):
+                unchanged_entries[source_url] = doc['unchanged_entry']
+                report("unchanged", source_url)
+                continue
+            
+            md = doc['markdown']
+            content_hash = hash_content(md)
+            previous = (await asyncio.to_thread(ledger.get_many, [source_url])).get(source_url, {})
+            
+            # Pages that were rendered but whose content didn't change don't need re-indexing
+            if incremental and previous.get('content_hash') == content_hash:
+                unchanged_entries[source_url] = previous
+                finished_entries.append(build_ledger_entry(doc, content_hash, previous.get('word_count', 0), previous, sitemap_lastmods))
+                report("unchanged", source_url)
+                continue
+            
+            # Extract source_id
+            parsed_url = urlparse(source_url)
+            source_id = parsed_url.netloc or parsed_url.path
+            
+            # Make sure the source exists before its chunks are inserted
+            if source_id not in source_pages_changed:
+                await ensure_source(supabase_client, source_id)
+                source_pages_changed[source_id] = 0
+            if previous.get('content_hash') != content_hash:
+                source_pages_changed[source_id] += 1
+                summary_inputs.setdefault(source_id, md[:5000])  # Use first 5000 chars for summary
+            
+            chunks, metadatas = chunk_page(md, chunk_size=chunk_size)
+            page_word_count = 0
+            for meta in metadatas:
+                meta["url"] = source_url
+                meta["source"] = source_id
+                meta["crawl_type"] = crawl_type
+                meta["crawl_time"] = str(asyncio.current_task().get_coro().__name__)
+                
+                # Accumulate word count
+                page_word_count += meta.get("word_count", 0)
+            
+            chunk_count += len(chunks)
+            crawled_urls.append(source_url)
+            
+            code_blocks = extract_code_blocks(md) if extract_code_examples_enabled else []
+            pending_entries[source_url] = build_ledger_entry(doc, content_hash, page_word_count, previous, sitemap_lastmods)
+            pending_parts[source_url] = pending_parts.get(source_url, 0) + (2 if code_blocks else 1)
+            report("crawled", source_url)
+            
+            await indexer.add_page(source_url, list(range(len(chunks))), chunks, metadatas, md)
+            
+            # Extract and process code examples only if enabled
+            if extract_code_examples_enabled:
+                if code_blocks:
+                    await code_semaphore.acquire()
+                    code_tasks.append(asyncio.create_task(store_code_examples(source_url, source_id, code_blocks)))
+    
+    code_example_counts = await asyncio.gather(*code_tasks)
+    if code_tasks:
+        summarizer = get_code_summarizer()
+        print(f"Code example summaries so far: {summarizer.requests} requests, {summarizer.cache_hits} cache hits")
+    
+    # Sources with only unchanged pages are still recorded as crawled
+    for unchanged_url in unchanged_entries:
+        parsed_url = urlparse(unchanged_url)
+        source_pages_changed.setdefault(parsed_url.netloc or parsed_url.path, 0)
+    
+    # Source statistics are maintained by database triggers; only stale summaries are regenerated
+    summaries_regenerated = await refresh_source_info(supabase_client, source_pages_changed, summary_inputs)
+    
+    # Record the rest of this crawl in the ledger for future incremental crawls
+    await flush_ledger()
+    print(f"Supabase calls so far:\n{call_metrics.format()}")
+    
+    return {
+        "pages_crawled": len(crawled_urls),
+        "pages_unchanged": len(unchanged_entries),
+        "pages_failed": len(failed_urls),
+        "chunks_stored": chunk_count,
+        "code_examples_stored": sum(code_example_counts),
+        "sources_updated": len(source_pages_changed),
+        "source_summaries_regenerated": summaries_regenerated,
+        "urls_crawled": crawled_urls[:5] + (["..."] if len(crawled_urls) > 5 else [])
+    }
 
 @mcp.tool()
 async def crawl_single_page(ctx: Context, url: str) -> str:
@@ -281,8 +686,9 @@ async def crawl_single_page(ctx: Context, url: str) -> str:
         Summary of the crawling operation and storage in Supabase
     """
     try:
-        # Get the crawler from the context
-        crawler = ctx.request_context.lifespan_context.crawler
+        # Get a session quota of the crawler pool from the context
+        context = ctx.request_context.lifespan_context
+        crawler = context.crawler_pool.lease(url, 1, http_client=context.http_client)
         supabase_client = ctx.request_context.lifespan_context.supabase_client
         
         # Configure the crawl
@@ -297,27 +703,23 @@ async def crawl_single_page(ctx: Context, url: str) -> str:
             source_id = parsed_url.netloc or parsed_url.path
             
             # Chunk the content
-            chunks = smart_chunk_markdown(result.markdown)
+            chunks, metadatas = chunk_page(result.markdown)
             
             # Prepare data for Supabase
             urls = []
             chunk_numbers = []
             contents = []
-            metadatas = []
             total_word_count = 0
             
-            for i, chunk in enumerate(chunks):
+            for i, (chunk, meta) in enumerate(zip(chunks, metadatas)):
                 urls.append(url)
                 chunk_numbers.append(i)
                 contents.append(chunk)
                 
                 # Extract metadata
-                meta = extract_section_info(chunk)
-                meta["chunk_index"] = i
                 meta["url"] = url
                 meta["source"] = source_id
                 meta["crawl_time"] = str(asyncio.current_task().get_coro().__name__)
-                metadatas.append(meta)
                 
                 # Accumulate word count
                 total_word_count += meta.get("word_count", 0)
@@ -325,65 +727,28 @@ async def crawl_single_page(ctx: Context, url: str) -> str:
             # Create url_to_full_document mapping
             url_to_full_document = {url: result.markdown}
             
-            # Update source information FIRST (before inserting documents)
-            source_summary = extract_source_summary(source_id, result.markdown[:5000])  # Use first 5000 chars for summary
-            update_source_info(supabase_client, source_id, source_summary, total_word_count)
+            # Make sure the source exists FIRST (before inserting documents)
+            await ensure_source(supabase_client, source_id)
             
             # Add documentation chunks to Supabase (AFTER source exists)
-            add_documents_to_supabase(supabase_client, urls, chunk_numbers, contents, metadatas, url_to_full_document)
+            await add_documents_to_supabase(supabase_client, urls, chunk_numbers, contents, metadatas, url_to_full_document)
             
             # Extract and process code examples only if enabled
+            code_examples_stored = 0
             extract_code_examples = os.getenv("USE_AGENTIC_RAG", "false") == "true"
             if extract_code_examples:
                 code_blocks = extract_code_blocks(result.markdown)
                 if code_blocks:
-                    code_urls = []
-                    code_chunk_numbers = []
-                    code_examples = []
-                    code_summaries = []
-                    code_metadatas = []
-                    
-                    # Process code examples in parallel
-                    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-                        # Prepare arguments for parallel processing
-                        summary_args = [(block['code'], block['context_before'], block['context_after']) 
-                                        for block in code_blocks]
-                        
-                        # Generate summaries in parallel
-                        summaries = list(executor.map(process_code_example, summary_args))
-                    
-                    # Prepare code example data
-                    for i, (block, summary) in enumerate(zip(code_blocks, summaries)):
-                        code_urls.append(url)
-                        code_chunk_numbers.append(i)
-                        code_examples.append(block['code'])
-                        code_summaries.append(summary)
-                        
-                        # Create metadata for code example
-                        code_meta = {
-                            "chunk_index": i,
-                            "url": url,
-                            "source": source_id,
-                            "char_count": len(block['code']),
-                            "word_count": len(block['code'].split())
-                        }
-                        code_metadatas.append(code_meta)
-                    
-                    # Add code examples to Supabase
-                    add_code_examples_to_supabase(
-                        supabase_client, 
-                        code_urls, 
-                        code_chunk_numbers, 
-                        code_examples, 
-                        code_summaries, 
-                        code_metadatas
-                    )
+                    code_examples_stored = await index_code_examples(supabase_client, url, source_id, code_blocks)
+            
+            # Record the crawl, regenerating the source summary only if it went stale
+            await refresh_source_info(supabase_client, {source_id: 1}, {source_id: result.markdown[:5000]})
             
             return json.dumps({
                 "success": True,
                 "url": url,
                 "chunks_stored": len(chunks),
-                "code_examples_stored": len(code_blocks) if code_blocks else 0,
+                "code_examples_stored": code_examples_stored,
                 "content_length": len(result.markdown),
                 "total_word_count": total_word_count,
                 "source_id": source_id,
@@ -405,199 +770,460 @@ async def crawl_single_page(ctx: Context, url: str) -> str:
             "error": str(e)
         }, indent=2)
 
+async def run_smart_crawl(
+    context: Crawl4AIContext,
+    url: str,
+    max_depth: int = 3,
+    max_concurrent: int = 10,
+    chunk_size: Optional[int] = None,
+    incremental: bool = False,
+    stream: bool = False,
+    max_pages: Optional[int] = None,
+    fast_path: bool = False,
+    resume_entries: Optional[Dict[str, Dict[str, Any]]] = None,
+    on_progress: Optional[Callable[[str, str], None]] = None
+) -> Dict[str, Any]:
+    """
+    Crawl a URL based on its type and store its content in Supabase.
+    
+    This is the crawl behind smart_crawl_url and background crawl jobs.
+    
+    Args:
+        context: The server's lifespan context
+        url: URL to crawl (can be a regular webpage, sitemap.xml, or .txt file)
+        max_depth: Maximum recursion depth for regular URLs
+        max_concurrent: Maximum number of concurrent browser sessions
+        chunk_size: Maximum size of each content chunk (default: see chunk_page)
+        incremental: Only re-index pages that changed since the last crawl
+        stream: Index pages while the crawl is still running
+        max_pages: Maximum number of pages to crawl recursively for regular URLs
+        fast_path: Fetch static pages over plain HTTP, rendering only JavaScript pages
+        resume_entries: Ledger entries of pages finished by an earlier, interrupted run
+            of the same crawl; they are skipped and their recorded links followed
+        on_progress: Called with an event and a URL as pages progress (see index_crawled_pages)
+    
+    Returns:
+        Dictionary with the crawl summary, or with success False and an error
+    """
+    supabase_client = context.supabase_client
+    http_client = context.http_client
+    
+    # This crawl's share of the browser pool
+    crawler = context.crawler_pool.lease(url, max_concurrent, http_client=http_client, fast_path=fast_path)
+    
+    # The ledger is always updated so a later incremental crawl can use it
+    ledger = get_crawl_ledger()
+    incremental_ledger = ledger if incremental else None
+    
+    # Determine the crawl strategy
+    crawl_type = None
+    unchanged_entries = dict(resume_entries or {})
+    sitemap_lastmods = {}
+    
+    if is_txt(url):
+        # For text files, use simple crawl
+        if incremental_ledger and url not in unchanged_entries:
+            unchanged_entries.update(await find_unchanged_urls(http_client, incremental_ledger, [url]))
+        crawl_results = []
+        if url not in unchanged_entries:
+            crawl_results = await crawl_markdown_file(crawler, url)
+        pages = iterate_pages(crawl_results)
+        crawl_type = "text_file"
+    elif is_sitemap(url):
+        # For sitemaps, discover URLs (following sitemap indexes) and crawl in parallel
+        sitemap_entries = iter_sitemap_entries(http_client, url)
+        if stream:
+            # Crawl pages while the sitemaps are still being downloaded and parsed
+            sitemap_urls = iter_changed_sitemap_urls(http_client, sitemap_entries, incremental_ledger, sitemap_lastmods, unchanged_entries)
+            pages = crawl_batch_stream(crawler, sitemap_urls)
+        else:
+            sitemap_entries = [entry async for entry in sitemap_entries]
+            sitemap_urls = [entry['url'] for entry in sitemap_entries]
+            if not sitemap_urls:
+                return {
+                    "success": False,
+                    "url": url,
+                    "error": "No URLs found in sitemap"
+                }
+            sitemap_lastmods = {entry['url']: entry['lastmod'] for entry in sitemap_entries if entry['lastmod']}
+            sitemap_urls = [u for u in sitemap_urls if u not in unchanged_entries]
+            if incremental_ledger:
+                unchanged_entries.update(await find_unchanged_urls(http_client, incremental_ledger, sitemap_urls, sitemap_lastmods))
+                sitemap_urls = [u for u in sitemap_urls if u not in unchanged_entries]
+            pages = iterate_pages(await crawl_batch(crawler, sitemap_urls) if sitemap_urls else [])
+        crawl_type = "sitemap"
+    else:
+        # For regular URLs, use recursive crawl
+        if stream:
+            pages = iter_recursive_internal_links(crawler, [url], max_depth=max_depth, max_concurrent=max_concurrent, ledger=incremental_ledger, max_pages=max_pages, known_entries=resume_entries)
+        else:
+            pages = iterate_pages(await crawl_recursive_internal_links(crawler, [url], max_depth=max_depth, max_concurrent=max_concurrent, ledger=incremental_ledger, max_pages=max_pages, known_entries=resume_entries))
+        crawl_type = "webpage"
+    
+    stats = await index_crawled_pages(
+        supabase_client,
+        ledger,
+        pages,
+        crawl_type,
+        chunk_size=chunk_size,
+        incremental=incremental,
+        unchanged_entries=unchanged_entries,
+        sitemap_lastmods=sitemap_lastmods,
+        on_progress=on_progress
+    )
+    
+    if not stats["pages_crawled"] and not stats["pages_unchanged"]:
+        return {
+            "success": False,
+            "url": url,
+            "error": "No content found"
+        }
+    
+    return {
+        "success": True,
+        "url": url,
+        "crawl_type": crawl_type,
+        **stats
+    }
+
 @mcp.tool()
-async def smart_crawl_url(ctx: Context, url: str, max_depth: int = 3, max_concurrent: int = 10, chunk_size: int = 5000) -> str:
+async def smart_crawl_url(ctx: Context, url: str, max_depth: int = 3, max_concurrent: int = 10, chunk_size: Optional[int] = None, incremental: bool = False, stream: bool = False, max_pages: Optional[int] = None, fast_path: bool = False) -> str:
     """
     Intelligently crawl a URL based on its type and store content in Supabase.
     
     This tool automatically detects the URL type and applies the appropriate crawling method:
-    - For sitemaps: Extracts and crawls all URLs in parallel
+    - For sitemaps: Extracts and crawls all URLs in parallel, following nested sitemap indexes
     - For text files (llms.txt): Directly retrieves the content
     - For regular webpages: Recursively crawls internal links up to the specified depth
     
     All crawled content is chunked and stored in Supabase for later retrieval and querying.
     
+    With incremental=True, pages that haven't changed since the last crawl are skipped:
+    unchanged sitemap <lastmod> values or 304 responses to a conditional GET skip the
+    browser render, and pages whose content hash is unchanged skip re-indexing.
+    
+    With stream=True, each page is chunked, embedded and stored as soon as it has been
+    crawled instead of after the whole crawl finishes, which keeps memory bounded on
+    large sites.
+    
+    With fast_path=True, pages (and .txt files) are first fetched over plain HTTP, and
+    only pages that look rendered by JavaScript (an empty framework shell, very little
+    text) go through the headless browser. Static sites crawl many times faster.
+    
+    For large sites, prefer start_crawl_job, which runs the same crawl in the background
+    and can be polled, streamed, cancelled and resumed after a restart.
+    
     Args:
         ctx: The MCP server provided context
         url: URL to crawl (can be a regular webpage, sitemap.xml, or .txt file)
         max_depth: Maximum recursion depth for regular URLs (default: 3)
-        max_concurrent: Maximum number of concurrent browser sessions (default: 10)
-        chunk_size: Maximum size of each content chunk in characters (default: 1000)
+        max_concurrent: Maximum number of concurrent browser sessions, capped at CRAWLER_MAX_SESSIONS_PER_JOB (default: 10)
+        chunk_size: Maximum size of each content chunk, in characters or in embedding model tokens with CHUNK_SIZE_UNIT=tokens (default: 5000 characters or 1000 tokens)
+        incremental: Only re-index pages that changed since the last crawl (default: False)
+        stream: Index pages while the crawl is still running (default: False)
+        max_pages: Maximum number of pages to crawl recursively for regular URLs (default: no limit)
+        fast_path: Fetch static pages over plain HTTP instead of rendering them (default: False)
     
     Returns:
         JSON string with crawl summary and storage information
     """
     try:
-        # Get the crawler from the context
-        crawler = ctx.request_context.lifespan_context.crawler
-        supabase_client = ctx.request_context.lifespan_context.supabase_client
-        
-        # Determine the crawl strategy
-        crawl_results = []
-        crawl_type = None
-        
-        if is_txt(url):
-            # For text files, use simple crawl
-            crawl_results = await crawl_markdown_file(crawler, url)
-            crawl_type = "text_file"
-        elif is_sitemap(url):
-            # For sitemaps, extract URLs and crawl in parallel
-            sitemap_urls = parse_sitemap(url)
-            if not sitemap_urls:
-                return json.dumps({
-                    "success": False,
-                    "url": url,
-                    "error": "No URLs found in sitemap"
-                }, indent=2)
-            crawl_results = await crawl_batch(crawler, sitemap_urls, max_concurrent=max_concurrent)
-            crawl_type = "sitemap"
-        else:
-            # For regular URLs, use recursive crawl
-            crawl_results = await crawl_recursive_internal_links(crawler, [url], max_depth=max_depth, max_concurrent=max_concurrent)
-            crawl_type = "webpage"
-        
-        if not crawl_results:
-            return json.dumps({
-                "success": False,
-                "url": url,
-                "error": "No content found"
-            }, indent=2)
-        
-        # Process results and store in Supabase
-        urls = []
-        chunk_numbers = []
-        contents = []
-        metadatas = []
-        chunk_count = 0
+        result = await run_smart_crawl(
+            ctx.request_context.lifespan_context,
+            url,
+            max_depth=max_depth,
+            max_concurrent=max_concurrent,
+            chunk_size=chunk_size,
+            incremental=incremental,
+            stream=stream,
+            max_pages=max_pages,
+            fast_path=fast_path
+        )
+        return json.dumps(result, indent=2)
+    except Exception as e:
+        return json.dumps({
+            "success": False,
+            "url": url,
+            "error": str(e)
+        }, indent=2)
+
+async def run_crawl_job(context: Crawl4AIContext, job: Dict[str, Any], progress: JobProgress, checkpoints: List[str]) -> Dict[str, Any]:
+    """
+    Run a background crawl job as a streaming smart crawl.
+    
+    Args:
+        context: The server's lifespan context
+        job: The job, with its URL and crawl parameters
+        progress: Live progress of the job
+        checkpoints: URLs finished by earlier attempts of the job
         
-        # Track sources and their content
-        source_content_map = {}
-        source_word_counts = {}
+    Returns:
+        The crawl summary
+    """
+    resume_entries = {}
+    if checkpoints:
+        # Pages finished before the interruption are skipped; their ledger entries
+        # carry their word counts and the links to follow
+        resume_entries = await asyncio.to_thread(get_crawl_ledger().get_many, checkpoints)
+    
+    result = await run_smart_crawl(
+        context,
+        job["url"],
+        stream=True,
+        resume_entries=resume_entries,
+        on_progress=progress.record,
+        **job["params"]
+    )
+    if not result["success"]:
+        raise RuntimeError(result["error"])
+    return result
+
+def describe_job(queue: CrawlJobQueue, job: Dict[str, Any], since_event: int = 0) -> Dict[str, Any]:
+    """
+    Build the status of a crawl job returned by the job tools.
+    
+    Args:
+        queue: The crawl job queue
+        job: The job as stored
+        since_event: Only include events after this sequence number
         
-        # Process documentation chunks
-        for doc in crawl_results:
-            source_url = doc['url']
-            md = doc['markdown']
-            chunks = smart_chunk_markdown(md, chunk_size=chunk_size)
-            
-            # Extract source_id
-            parsed_url = urlparse(source_url)
-            source_id = parsed_url.netloc or parsed_url.path
-            
-            # Store content for source summary generation
-            if source_id not in source_content_map:
-                source_content_map[source_id] = md[:5000]  # Store first 5000 chars
-                source_word_counts[source_id] = 0
+    Returns:
+        Dictionary with the job's status, progress, recent events and result
+    """
+    progress = queue.get_progress(job["id"])
+    return {
+        "job_id": job["id"],
+        "url": job["url"],
+        "status": job["status"],
+        "params": job["params"],
+        "attempts": job["attempts"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "progress": dict(progress.counters) if progress else job["progress"],
+        "events": progress.events_since(since_event) if progress else [],
+        "last_event": progress.version if progress else since_event,
+        "result": job["result"],
+        "error": job["error"]
+    }
+
+def get_job_queue(ctx: Context) -> CrawlJobQueue:
+    """Get the crawl job queue from the context, or raise if background jobs are unavailable."""
+    queue = ctx.request_context.lifespan_context.job_queue
+    if queue is None:
+        raise RuntimeError("Background crawl jobs are not available; see the server log")
+    return queue
+
+@mcp.tool()
+async def start_crawl_job(ctx: Context, url: str, max_depth: int = 3, max_concurrent: int = 10, chunk_size: Optional[int] = None, incremental: bool = False, max_pages: Optional[int] = None, fast_path: bool = False) -> str:
+    """
+    Start crawling a URL in the background and return a job ID right away.
+    
+    The job runs the same crawl as smart_crawl_url with stream=True. Jobs are queued and
+    run a few at a time (CRAWL_JOB_MAX_CONCURRENCY); use get_crawl_job to poll a job,
+    stream_crawl_job to follow it, and cancel_crawl_job to stop it. A job that is still
+    running when the server stops is resumed on the next start, skipping the pages it
+    already stored.
+    
+    Args:
+        ctx: The MCP server provided context
+        url: URL to crawl (can be a regular webpage, sitemap.xml, or .txt file)
+        max_depth: Maximum recursion depth for regular URLs (default: 3)
+        max_concurrent: Maximum number of concurrent browser sessions for this job (default: 10)
+        chunk_size: Maximum size of each content chunk (default: 5000 characters or 1000 tokens)
+        incremental: Only re-index pages that changed since the last crawl (default: False)
+        max_pages: Maximum number of pages to crawl recursively for regular URLs (default: no limit)
+        fast_path: Fetch static pages over plain HTTP instead of rendering them (default: False)
+    
+    Returns:
+        JSON string with the job ID and status
+    """
+    try:
+        queue = get_job_queue(ctx)
+        job = await queue.submit(url, {
+            "max_depth": max_depth,
+            "max_concurrent": max_concurrent,
+            "chunk_size": chunk_size,
+            "incremental": incremental,
+            "max_pages": max_pages,
+            "fast_path": fast_path
+        })
+        return json.dumps({
+            "success": True,
+            "job_id": job["id"],
+            "url": url,
+            "status": job["status"],
+            "queue_depth": queue.queue_depth()
+        }, indent=2)
+    except Exception as e:
+        return json.dumps({
+            "success": False,
+            "url": url,
+            "error": str(e)
+        }, indent=2)
+
+@mcp.tool()
+async def get_crawl_job(ctx: Context, job_id: str, since_event: int = 0) -> str:
+    """
+    Get the status and progress of a background crawl job.
+    
+    Args:
+        ctx: The MCP server provided context
+        job_id: ID returned by start_crawl_job
+        since_event: Only return events after this sequence number; pass the previous
+            response's last_event to get just the new ones (default: 0)
+    
+    Returns:
+        JSON string with the job's status, page counters, recent events and, once the job
+        has completed, its crawl summary
+    """
+    try:
+        queue = get_job_queue(ctx)
+        job = await asyncio.to_thread(queue.store.get, job_id)
+        if not job:
+            return json.dumps({"success": False, "job_id": job_id, "error": "Unknown job"}, indent=2)
+        return json.dumps({"success": True, **describe_job(queue, job, since_event)}, indent=2)
+    except Exception as e:
+        return json.dumps({
+            "success": False,
+            "job_id": job_id,
+            "error": str(e)
+        }, indent=2)
+
+@mcp.tool()
+async def stream_crawl_job(ctx: Context, job_id: str, timeout_seconds: float = 300, since_event: int = 0) -> str:
+    """
+    Follow a background crawl job, sending progress notifications until it finishes.
+    
+    Each new job event is sent as a log message and the number of finished pages as a
+    progress notification. The call returns when the job finishes or after
+    timeout_seconds, whichever comes first; call it again to keep following the job.
+    
+    Args:
+        ctx: The MCP server provided context
+        job_id: ID returned by start_crawl_job
+        timeout_seconds: Maximum number of seconds to follow the job (default: 300)
+        since_event: Only send events after this sequence number (default: 0)
+    
+    Returns:
+        JSON string with the job's status when the call returns (see get_crawl_job)
+    """
+    try:
+        queue = get_job_queue(ctx)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout_seconds
+        while True:
+            job = await asyncio.to_thread(queue.store.get, job_id)
+            if not job:
+                return json.dumps({"success": False, "job_id": job_id, "error": "Unknown job"}, indent=2)
             
-            for i, chunk in enumerate(chunks):
-                urls.append(source_url)
-                chunk_numbers.append(i)
-                contents.append(chunk)
-                
-                # Extract metadata
-                meta = extract_section_info(chunk)
-                meta["chunk_index"] = i
-                meta["url"] = source_url
-                meta["source"] = source_id
-                meta["crawl_type"] = crawl_type
-                meta["crawl_time"] = str(asyncio.current_task().get_coro().__name__)
-                metadatas.append(meta)
-                
-                # Accumulate word count
-                source_word_counts[source_id] += meta.get("word_count", 0)
-                
-                chunk_count += 1
-        
-        # Create url_to_full_document mapping
-        url_to_full_document = {}
-        for doc in crawl_results:
-            url_to_full_document[doc['url']] = doc['markdown']
-        
-        # Update source information for each unique source FIRST (before inserting documents)
-        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-            source_summary_args = [(source_id, content) for source_id, content in source_content_map.items()]
-            source_summaries = list(executor.map(lambda args: extract_source_summary(args[0], args[1]), source_summary_args))
-        
-        for (source_id, _), summary in zip(source_summary_args, source_summaries):
-            word_count = source_word_counts.get(source_id, 0)
-            update_source_info(supabase_client, source_id, summary, word_count)
-        
-        # Add documentation chunks to Supabase (AFTER sources exist)
-        batch_size = 20
-        add_documents_to_supabase(supabase_client, urls, chunk_numbers, contents, metadatas, url_to_full_document, batch_size=batch_size)
-        
-        # Extract and process code examples from all documents only if enabled
-        extract_code_examples_enabled = os.getenv("USE_AGENTIC_RAG", "false") == "true"
-        if extract_code_examples_enabled:
-            all_code_blocks = []
-            code_urls = []
-            code_chunk_numbers = []
-            code_examples = []
-            code_summaries = []
-            code_metadatas = []
+            progress = queue.get_progress(job_id)
+            if progress:
+                for event in progress.events_since(since_event):
+                    await ctx.info(event["message"])
+                since_event = progress.version
+                counters = progress.counters
+                await ctx.report_progress(counters["pages_stored"] + counters["pages_unchanged"] + counters["pages_resumed"])
             
-            # Extract code blocks from all documents
-            for doc in crawl_results:
-                source_url = doc['url']
-                md = doc['markdown']
-                code_blocks = extract_code_blocks(md)
-                
-                if code_blocks:
-                    # Process code examples in parallel
-                    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-                        # Prepare arguments for parallel processing
-                        summary_args = [(block['code'], block['context_before'], block['context_after']) 
-                                        for block in code_blocks]
-                        
-                        # Generate summaries in parallel
-                        summaries = list(executor.map(process_code_example, summary_args))
-                    
-                    # Prepare code example data
-                    parsed_url = urlparse(source_url)
-                    source_id = parsed_url.netloc or parsed_url.path
-                    
-                    for i, (block, summary) in enumerate(zip(code_blocks, summaries)):
-                        code_urls.append(source_url)
-                        code_chunk_numbers.append(len(code_examples))  # Use global code example index
-                        code_examples.append(block['code'])
-                        code_summaries.append(summary)
-                        
-                        # Create metadata for code example
-                        code_meta = {
-                            "chunk_index": len(code_examples) - 1,
-                            "url": source_url,
-                            "source": source_id,
-                            "char_count": len(block['code']),
-                            "word_count": len(block['code'].split())
-                        }
-                        code_metadatas.append(code_meta)
+            remaining = deadline - loop.time()
+            if job["status"] in FINISHED_STATES or remaining <= 0:
+                return json.dumps({"success": True, **describe_job(queue, job, since_event)}, indent=2)
             
-            # Add all code examples to Supabase
-            if code_examples:
-                add_code_examples_to_supabase(
-                    supabase_client, 
-                    code_urls, 
-                    code_chunk_numbers, 
-                    code_examples, 
-                    code_summaries, 
-                    code_metadatas,
-                    batch_size=batch_size
-                )
-        
+            if progress:
+                await progress.wait_for_change(since_event, min(remaining, 5.0))
+            else:
+                # Still queued
+                await asyncio.sleep(min(remaining, 1.0))
+    except Exception as e:
+        return json.dumps({
+            "success": False,
+            "job_id": job_id,
+            "error": str(e)
+        }, indent=2)
+
+@mcp.tool()
+async def cancel_crawl_job(ctx: Context, job_id: str) -> str:
+    """
+    Cancel a queued or running background crawl job.
+    
+    Pages the job already stored are kept, and so is its record in the crawl ledger.
+    
+    Args:
+        ctx: The MCP server provided context
+        job_id: ID returned by start_crawl_job
+    
+    Returns:
+        JSON string with the job's status after cancelling it
+    """
+    try:
+        queue = get_job_queue(ctx)
+        job = await queue.cancel(job_id)
+        if not job:
+            return json.dumps({"success": False, "job_id": job_id, "error": "Unknown job"}, indent=2)
+        return json.dumps({"success": True, **describe_job(queue, job)}, indent=2)
+    except Exception as e:
+        return json.dumps({
+            "success": False,
+            "job_id": job_id,
+            "error": str(e)
+        }, indent=2)
+
+@mcp.tool()
+async def list_crawl_jobs(ctx: Context, status: Optional[str] = None, limit: int = 20) -> str:
+    """
+    List background crawl jobs, most recent first.
+    
+    Args:
+        ctx: The MCP server provided context
+        status: Only list jobs in this state: queued, running, completed, failed or cancelled (default: all)
+        limit: Maximum number of jobs to list (default: 20)
+    
+    Returns:
+        JSON string with the jobs and their progress
+    """
+    try:
+        queue = get_job_queue(ctx)
+        jobs = await asyncio.to_thread(queue.store.list, status, limit)
         return json.dumps({
             "success": True,
-            "url": url,
-            "crawl_type": crawl_type,
-            "pages_crawled": len(crawl_results),
-            "chunks_stored": chunk_count,
-            "code_examples_stored": len(code_examples),
-            "sources_updated": len(source_content_map),
-            "urls_crawled": [doc['url'] for doc in crawl_results][:5] + (["..."] if len(crawl_results) > 5 else [])
+            "queue_depth": queue.queue_depth(),
+            "jobs": [
+                {key: value for key, value in describe_job(queue, job).items() if key not in ("events", "result")}
+                for job in jobs
+            ]
+        }, indent=2)
+    except Exception as e:
+        return json.dumps({
+            "success": False,
+            "error": str(e)
+        }, indent=2)
+
+@mcp.tool()
+async def get_crawl_metrics(ctx: Context) -> str:
+    """
+    Get the current load of the crawler: browser sessions, queues and memory.
+    
+    Reports the active and waiting browser sessions of the shared crawler pool (overall,
+    per browser and per running crawl), the number of queued crawl jobs, the memory
+    used by the server and its browsers, and timings of the Supabase calls so far.
+    
+    Args:
+        ctx: The MCP server provided context
+    
+    Returns:
+        JSON string with the crawler metrics
+    """
+    try:
+        context = ctx.request_context.lifespan_context
+        return json.dumps({
+            "success": True,
+            "crawler_pool": context.crawler_pool.metrics(),
+            "queued_crawl_jobs": context.job_queue.queue_depth() if context.job_queue else 0,
+            "supabase_calls": call_metrics.snapshot()
         }, indent=2)
     except Exception as e:
         return json.dumps({
             "success": False,
-            "url": url,
             "error": str(e)
         }, indent=2)
 
@@ -623,11 +1249,14 @@ async def get_available_sources(ctx: Context) -> str:
         # Get the Supabase client from the context
         supabase_client = ctx.request_context.lifespan_context.supabase_client
         
-        # Query the sources table directly
-        result = supabase_client.from_('sources')\
-            .select('*')\
-            .order('source_id')\
-            .execute()
+        # Statistics are precomputed per source, so this is a single small query
+        result = await timed_execute(
+            "sources.select",
+            supabase_client.from_('sources').select(
+                'source_id, summary, total_word_count, page_count, chunk_count, '
+                'code_example_count, last_crawled_at, created_at, updated_at'
+            ).order('source_id')
+        )
         
         # Format the sources with their details
         sources = []
@@ -636,7 +1265,11 @@ async def get_available_sources(ctx: Context) -> str:
                 sources.append({
                     "source_id": source.get("source_id"),
                     "summary": source.get("summary"),
-                    "total_words": source.get("total_words"),
+                    "total_words": source.get("total_word_count"),
+                    "pages": source.get("page_count"),
+                    "chunks": source.get("chunk_count"),
+                    "code_examples": source.get("code_example_count"),
+                    "last_crawled_at": source.get("last_crawled_at"),
                     "created_at": source.get("created_at"),
                     "updated_at": source.get("updated_at")
                 })
@@ -683,73 +1316,17 @@ async def perform_rag_query(ctx: Context, query: str, source: str = None, match_
             filter_metadata = {"source": source}
         
         if use_hybrid_search:
-            # Hybrid search: combine vector and keyword search
-            
-            # 1. Get vector search results (get more to account for filtering)
-            vector_results = search_documents(
+            # Hybrid search: full-text and vector search fused server-side in one query
+            results = await hybrid_search_documents(
                 client=supabase_client,
                 query=query,
-                match_count=match_count * 2,  # Get double to have room for filtering
+                match_count=match_count,
                 filter_metadata=filter_metadata
             )
             
-            # 2. Get keyword search results using ILIKE
-            keyword_query = supabase_client.from_('crawled_pages')\
-                .select('id, url, chunk_number, content, metadata, source_id')\
-                .ilike('content', f'%{query}%')
-            
-            # Apply source filter if provided
-            if source and source.strip():
-                keyword_query = keyword_query.eq('source_id', source)
-            
-            # Execute keyword search
-            keyword_response = keyword_query.limit(match_count * 2).execute()
-            keyword_results = keyword_response.data if keyword_response.data else []
-            
-            # 3. Combine results with preference for items appearing in both
-            seen_ids = set()
-            combined_results = []
-            
-            # First, add items that appear in both searches (these are the best matches)
-            vector_ids = {r.get('id') for r in vector_results if r.get('id')}
-            for kr in keyword_results:
-                if kr['id'] in vector_ids and kr['id'] not in seen_ids:
-                    # Find the vector result to get similarity score
-                    for vr in vector_results:
-                        if vr.get('id') == kr['id']:
-                            # Boost similarity score for items in both results
-                            vr['similarity'] = min(1.0, vr.get('similarity', 0) * 1.2)
-                            combined_results.append(vr)
-                            seen_ids.add(kr['id'])
-                            break
-            
-            # Then add remaining vector results (semantic matches without exact keyword)
-            for vr in vector_results:
-                if vr.get('id') and vr['id'] not in seen_ids and len(combined_results) < match_count:
-                    combined_results.append(vr)
-                    seen_ids.add(vr['id'])
-            
-            # Finally, add pure keyword matches if we still need more results
-            for kr in keyword_results:
-                if kr['id'] not in seen_ids and len(combined_results) < match_count:
-                    # Convert keyword result to match vector result format
-                    combined_results.append({
-                        'id': kr['id'],
-                        'url': kr['url'],
-                        'chunk_number': kr['chunk_number'],
-                        'content': kr['content'],
-                        'metadata': kr['metadata'],
-                        'source_id': kr['source_id'],
-                        'similarity': 0.5  # Default similarity for keyword-only matches
-                    })
-                    seen_ids.add(kr['id'])
-            
-            # Use combined results
-            results = combined_results[:match_count]
-            
         else:
             # Standard vector search only
-            results = search_documents(
+            results = await search_documents(
                 client=supabase_client,
                 query=query,
                 match_count=match_count,
@@ -758,8 +1335,8 @@ async def perform_rag_query(ctx: Context, query: str, source: str = None, match_
         
         # Apply reranking if enabled
         use_reranking = os.getenv("USE_RERANKING", "false") == "true"
-        if use_reranking and ctx.request_context.lifespan_context.reranking_model:
-            results = rerank_results(ctx.request_context.lifespan_context.reranking_model, query, results, content_key="content")
+        if use_reranking and ctx.request_context.lifespan_context.reranker:
+            results = await rerank_results(ctx.request_context.lifespan_context.reranker, query, results, content_key="content")
         
         # Format the results
         formatted_results = []
@@ -780,7 +1357,7 @@ async def perform_rag_query(ctx: Context, query: str, source: str = None, match_
             "query": query,
             "source_filter": source,
             "search_mode": "hybrid" if use_hybrid_search else "vector",
-            "reranking_applied": use_reranking and ctx.request_context.lifespan_context.reranking_model is not None,
+            "reranking_applied": any("rerank_score" in result for result in results),
             "results": formatted_results,
             "count": len(formatted_results)
         }, indent=2)
@@ -832,79 +1409,19 @@ async def search_code_examples(ctx: Context, query: str, source_id: str = None,
             filter_metadata = {"source": source_id}
         
         if use_hybrid_search:
-            # Hybrid search: combine vector and keyword search
-            
-            # Import the search function from utils
-            from utils import search_code_examples as search_code_examples_impl
-            
-            # 1. Get vector search results (get more to account for filtering)
-            vector_results = search_code_examples_impl(
+            # Hybrid search: full-text and vector search fused server-side in one query
+            results = await hybrid_search_code_examples(
                 client=supabase_client,
                 query=query,
-                match_count=match_count * 2,  # Get double to have room for filtering
+                match_count=match_count,
                 filter_metadata=filter_metadata
             )
             
-            # 2. Get keyword search results using ILIKE on both content and summary
-            keyword_query = supabase_client.from_('code_examples')\
-                .select('id, url, chunk_number, content, summary, metadata, source_id')\
-                .or_(f'content.ilike.%{query}%,summary.ilike.%{query}%')
-            
-            # Apply source filter if provided
-            if source_id and source_id.strip():
-                keyword_query = keyword_query.eq('source_id', source_id)
-            
-            # Execute keyword search
-            keyword_response = keyword_query.limit(match_count * 2).execute()
-            keyword_results = keyword_response.data if keyword_response.data else []
-            
-            # 3. Combine results with preference for items appearing in both
-            seen_ids = set()
-            combined_results = []
-            
-            # First, add items that appear in both searches (these are the best matches)
-            vector_ids = {r.get('id') for r in vector_results if r.get('id')}
-            for kr in keyword_results:
-                if kr['id'] in vector_ids and kr['id'] not in seen_ids:
-                    # Find the vector result to get similarity score
-                    for vr in vector_results:
-                        if vr.get('id') == kr['id']:
-                            # Boost similarity score for items in both results
-                            vr['similarity'] = min(1.0, vr.get('similarity', 0) * 1.2)
-                            combined_results.append(vr)
-                            seen_ids.add(kr['id'])
-                            break
-            
-            # Then add remaining vector results (semantic matches without exact keyword)
-            for vr in vector_results:
-                if vr.get('id') and vr['id'] not in seen_ids and len(combined_results) < match_count:
-                    combined_results.append(vr)
-                    seen_ids.add(vr['id'])
-            
-            # Finally, add pure keyword matches if we still need more results
-            for kr in keyword_results:
-                if kr['id'] not in seen_ids and len(combined_results) < match_count:
-                    # Convert keyword result to match vector result format
-                    combined_results.append({
-                        'id': kr['id'],
-                        'url': kr['url'],
-                        'chunk_number': kr['chunk_number'],
-                        'content': kr['content'],
-                        'summary': kr['summary'],
-                        'metadata': kr['metadata'],
-                        'source_id': kr['source_id'],
-                        'similarity': 0.5  # Default similarity for keyword-only matches
-                    })
-                    seen_ids.add(kr['id'])
-            
-            # Use combined results
-            results = combined_results[:match_count]
-            
         else:
             # Standard vector search only
             from utils import search_code_examples as search_code_examples_impl
             
-            results = search_code_examples_impl(
+            results = await search_code_examples_impl(
                 client=supabase_client,
                 query=query,
                 match_count=match_count,
@@ -913,8 +1430,8 @@ async def search_code_examples(ctx: Context, query: str, source_id: str = None,
         
         # Apply reranking if enabled
         use_reranking = os.getenv("USE_RERANKING", "false") == "true"
-        if use_reranking and ctx.request_context.lifespan_context.reranking_model:
-            results = rerank_results(ctx.request_context.lifespan_context.reranking_model, query, results, content_key="content")
+        if use_reranking and ctx.request_context.lifespan_context.reranker:
+            results = await rerank_results(ctx.request_context.lifespan_context.reranker, query, results, content_key="content")
         
         # Format the results
         formatted_results = []
@@ -937,7 +1454,7 @@ async def search_code_examples(ctx: Context, query: str, source_id: str = None,
             "query": query,
             "source_filter": source_id,
             "search_mode": "hybrid" if use_hybrid_search else "vector",
-            "reranking_applied": use_reranking and ctx.request_context.lifespan_context.reranking_model is not None,
+            "reranking_applied": any("rerank_score" in result for result in results),
             "results": formatted_results,
             "count": len(formatted_results)
         }, indent=2)
@@ -948,12 +1465,12 @@ async def search_code_examples(ctx: Context, query: str, source_id: str = None,
             "error": str(e)
         }, indent=2)
 
-async def crawl_markdown_file(crawler: AsyncWebCrawler, url: str) -> List[Dict[str, Any]]:
+async def crawl_markdown_file(crawler: CrawlerLease, url: str) -> List[Dict[str, Any]]:
     """
     Crawl a .txt or markdown file.
     
     Args:
-        crawler: AsyncWebCrawler instance
+        crawler: Lease of the shared crawler pool
         url: URL of the file
         
     Returns:
@@ -963,83 +1480,209 @@ async def crawl_markdown_file(crawler: AsyncWebCrawler, url: str) -> List[Dict[s
 
     result = await crawler.arun(url=url, config=crawl_config)
     if result.success and result.markdown:
-        return [{'url': url, 'markdown': result.markdown}]
+        return [{'url': url, 'markdown': result.markdown, 'validators': extract_validators(result.response_headers)}]
     else:
         print(f"Failed to crawl {url}: {result.error_message}")
         return []
 
-async def crawl_batch(crawler: AsyncWebCrawler, urls: List[str], max_concurrent: int = 10) -> List[Dict[str, Any]]:
+async def crawl_batch(crawler: CrawlerLease, urls: List[str]) -> List[Dict[str, Any]]:
     """
     Batch crawl multiple URLs in parallel.
     
     Args:
-        crawler: AsyncWebCrawler instance
+        crawler: Lease of the shared crawler pool, which bounds the concurrent sessions
         urls: List of URLs to crawl
-        max_concurrent: Maximum number of concurrent browser sessions
         
     Returns:
         List of dictionaries with URL and markdown content
     """
+    return [doc async for doc in crawl_batch_stream(crawler, urls)]
+
+async def crawl_batch_stream(crawler: CrawlerLease, urls: Union[List[str], AsyncIterator[str]], window_size: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Crawl multiple URLs in parallel, yielding each page as soon as it has been crawled.
+    
+    At most window_size pages are crawled ahead of the consumer, and a new URL is
+    started as soon as one of them is done. The URLs can also be an async iterator
+    (e.g. a sitemap that is still being parsed), in which case pages are crawled as
+    soon as their URLs arrive.
+    
+    Args:
+        crawler: Lease of the shared crawler pool, which bounds the concurrent sessions
+        urls: List or async iterator of URLs to crawl
+        window_size: Number of pages in flight at a time (default: 4x the lease's sessions)
+        
+    Yields:
+        Dictionaries with URL and markdown content
+    """
     crawl_config = CrawlerRunConfig(cache_mode=CacheMode.BYPASS, stream=False)
-    dispatcher = MemoryAdaptiveDispatcher(
-        memory_threshold_percent=70.0,
-        check_interval=1.0,
-        max_session_permit=max_concurrent
-    )
+    window_size = window_size or crawler.max_sessions * 4
+
+    async def crawl_url(url: str) -> Optional[Dict[str, Any]]:
+        try:
+            r = await crawler.arun(url=url, config=crawl_config)
+        except Exception as e:
+            print(f"Error crawling {url}: {e}")
+            return None
+        if r.success and r.markdown:
+            return {'url': r.url, 'markdown': r.markdown, 'validators': extract_validators(r.response_headers)}
+        return None
 
-    results = await crawler.arun_many(urls=urls, config=crawl_config, dispatcher=dispatcher)
-    return [{'url': r.url, 'markdown': r.markdown} for r in results if r.success and r.markdown]
+    async def all_urls() -> AsyncIterator[str]:
+        if isinstance(urls, list):
+            for url in urls:
+                yield url
+        else:
+            async for url in urls:
+                yield url
+
+    pending: Set[asyncio.Task] = set()
+    try:
+        async for url in all_urls():
+            pending.add(asyncio.create_task(crawl_url(url)))
+            if len(pending) < window_size:
+                continue
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.result():
+                    yield task.result()
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.result():
+                    yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
 
-async def crawl_recursive_internal_links(crawler: AsyncWebCrawler, start_urls: List[str], max_depth: int = 3, max_concurrent: int = 10) -> List[Dict[str, Any]]:
+async def crawl_recursive_internal_links(crawler: CrawlerLease, start_urls: List[str], max_depth: int = 3, max_concurrent: int = 10, ledger: Optional[CrawlLedger] = None, max_pages: Optional[int] = None, known_entries: Optional[Dict[str, Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
     """
     Recursively crawl internal links from start URLs up to a maximum depth.
     
+    When a crawl ledger is given, pages that answer a conditional GET with 304 Not Modified
+    aren't rendered again. Their links from the previous crawl are followed instead, and they
+    are returned with an 'unchanged_entry' key holding their ledger entry instead of markdown.
+    
     Args:
-        crawler: AsyncWebCrawler instance
+        crawler: Lease of the shared crawler pool
         start_urls: List of starting URLs
         max_depth: Maximum recursion depth
         max_concurrent: Maximum number of concurrent browser sessions
+        ledger: Optional crawl ledger used to skip unchanged pages
+        max_pages: Optional maximum number of pages to crawl
+        known_entries: Ledger entries of pages to skip without checking for changes
         
     Returns:
         List of dictionaries with URL and markdown content
     """
+    return [doc async for doc in iter_recursive_internal_links(crawler, start_urls, max_depth, max_concurrent, ledger, max_pages, known_entries)]
+
+async def iter_recursive_internal_links(
+    crawler: CrawlerLease,
+    start_urls: List[str],
+    max_depth: int = 3,
+    max_concurrent: int = 10,
+    ledger: Optional[CrawlLedger] = None,
+    max_pages: Optional[int] = None,
+    known_entries: Optional[Dict[str, Dict[str, Any]]] = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Recursively crawl internal links, yielding each page as soon as it has been crawled.
+    
+    Uses a continuous work queue instead of crawling depth by depth: a link is crawled as
+    soon as a browser slot frees up, so one slow page never holds up the next level.
+    URLs are deduplicated on their canonical form, per-host concurrency and delay are
+    limited by CRAWL_MAX_PER_HOST and CRAWL_HOST_DELAY_SECONDS, and browser sessions
+    come from the shared crawler pool.
+    
+    Args:
+        crawler: Lease of the shared crawler pool
+        start_urls: List of starting URLs
+        max_depth: Maximum recursion depth
+        max_concurrent: Maximum number of concurrent browser sessions
+        ledger: Optional crawl ledger used to skip unchanged pages
+        max_pages: Optional maximum number of pages to crawl
+        known_entries: Ledger entries of pages that are skipped without checking for
+            changes, such as the pages an interrupted crawl job already finished
+        
+    Yields:
+        Dictionaries with URL and markdown content (or an 'unchanged_entry' for skipped pages)
+    """
+    known_entries = known_entries or {}
     run_config = CrawlerRunConfig(cache_mode=CacheMode.BYPASS, stream=False)
-    dispatcher = MemoryAdaptiveDispatcher(
-        memory_threshold_percent=70.0,
-        check_interval=1.0,
-        max_session_permit=max_concurrent
+    politeness = HostPoliteness(
+        max_per_host=int(os.getenv("CRAWL_MAX_PER_HOST", str(max_concurrent))),
+        min_delay=float(os.getenv("CRAWL_HOST_DELAY_SECONDS", "0"))
     )
-
-    visited = set()
-
-    def normalize_url(url):
-        return urldefrag(url)[0]
-
-    current_urls = set([normalize_url(u) for u in start_urls])
-    results_all = []
-
-    for depth in range(max_depth):
-        urls_to_crawl = [normalize_url(url) for url in current_urls if normalize_url(url) not in visited]
-        if not urls_to_crawl:
-            break
-
-        results = await crawler.arun_many(urls=urls_to_crawl, config=run_config, dispatcher=dispatcher)
-        next_level_urls = set()
-
-        for result in results:
-            norm_url = normalize_url(result.url)
-            visited.add(norm_url)
-
-            if result.success and result.markdown:
-                results_all.append({'url': result.url, 'markdown': result.markdown})
-                for link in result.links.get("internal", []):
-                    next_url = normalize_url(link["href"])
-                    if next_url not in visited:
-                        next_level_urls.add(next_url)
-
-        current_urls = next_level_urls
-
-    return results_all
+    strip_query_params = get_strip_query_params()
+    
+    frontier: asyncio.Queue = asyncio.Queue()
+    results: asyncio.Queue = asyncio.Queue(maxsize=max_concurrent * 2)
+    seen: Set[str] = set()
+    scheduled = 0
+    
+    def schedule(link: str, depth: int) -> None:
+        nonlocal scheduled
+        if depth >= max_depth or (max_pages and scheduled >= max_pages):
+            return
+        key = canonicalize_url(link, strip_query_params)
+        if key in seen:
+            return
+        seen.add(key)
+        scheduled += 1
+        frontier.put_nowait((urldefrag(link)[0], depth))
+    
+    async def crawl_one(page_url: str, depth: int) -> None:
+        entry = known_entries.get(page_url)
+        if entry is None and ledger:
+            entry = (await find_unchanged_urls(crawler.http_client, ledger, [page_url])).get(page_url)
+        if entry is not None:
+            for link in entry['internal_links']:
+                schedule(link, depth + 1)
+            await results.put({'url': page_url, 'markdown': None, 'unchanged_entry': entry})
+            return
+        
+        async with politeness.slot(page_url):
+            result = await crawler.arun(url=page_url, config=run_config)
+        
+        if result.success and result.markdown:
+            # Redirects can land on a page we'd otherwise crawl again
+            seen.add(canonicalize_url(result.url, strip_query_params))
+            internal_links = [urldefrag(link["href"])[0] for link in result.links.get("internal", [])]
+            for link in internal_links:
+                schedule(link, depth + 1)
+            await results.put({
+                'url': result.url,
+                'markdown': result.markdown,
+                'validators': extract_validators(result.response_headers),
+                'internal_links': internal_links
+            })
+        else:
+            print(f"Failed to crawl {page_url}: {result.error_message}")
+    
+    async def worker() -> None:
+        while True:
+            page_url, depth = await frontier.get()
+            try:
+                await crawl_one(page_url, depth)
+            except Exception as e:
+                print(f"Error crawling {page_url}: {e}")
+            finally:
+                frontier.task_done()
+    
+    for start_url in start_urls:
+        schedule(start_url, 0)
+    
+    workers = [asyncio.create_task(worker()) for _ in range(max_concurrent)]
+    # Completes once every scheduled URL has been crawled and its links scheduled
+    frontier_done = asyncio.create_task(frontier.join())
+    try:
+        async for doc in iter_queue_until_done(results, frontier_done):
+            yield doc
+    finally:
+        frontier_done.cancel()
+        for task in workers:
+            task.cancel()
 
 async def main():
     transport = os.getenv("TRANSPORT", "sse")
@@ -0,0 +1,118 @@
+"""
+URL canonicalization and per-host politeness for the recursive crawler.
+"""
+import os
+import asyncio
+import fnmatch
+from contextlib import asynccontextmanager
+from collections.abc import AsyncIterator
+from typing import List, Dict, Optional
+from urllib.parse import urlparse, urlunparse, urldefrag, parse_qsl, urlencode
+
+# Query parameters that never change the content of a page
+DEFAULT_STRIP_QUERY_PARAMS = "utm_*,gclid,fbclid,msclkid,mc_cid,mc_eid,ref_src"
+
+def get_strip_query_params() -> List[str]:
+    """
+    Get the query parameter patterns to strip from URLs before deduplicating them.
+
+    Patterns come from CRAWL_STRIP_QUERY_PARAMS as a comma-separated list of
+    fnmatch patterns (e.g. "utm_*,sessionid"). Use "*" to ignore query strings entirely.
+
+    Returns:
+        List of query parameter patterns
+    """
+    value = os.getenv("CRAWL_STRIP_QUERY_PARAMS", DEFAULT_STRIP_QUERY_PARAMS)
+    return [pattern.strip() for pattern in value.split(",") if pattern.strip()]
+
+def canonicalize_url(url: str, strip_query_params: Optional[List[str]] = None) -> str:
+    """
+    Canonicalize a URL so different spellings of the same page are crawled once.
+
+    Drops the fragment, lowercases the scheme and host, removes default ports and
+    trailing slashes, strips matching query parameters and sorts the remaining ones.
+
+    Args:
+        url: URL to canonicalize
+        strip_query_params: fnmatch patterns of query parameters to drop (default: from the environment)
+
+    Returns:
+        Canonical form of the URL, suitable as a deduplication key
+    """
+    if strip_query_params is None:
+        strip_query_params = get_strip_query_params()
+
+    parsed = urlparse(urldefrag(url)[0])
+    scheme = parsed.scheme.lower()
+    netloc = parsed.netloc.lower()
+    if (scheme == "http" and netloc.endswith(":80")) or (scheme == "https" and netloc.endswith(":443")):
+        netloc = netloc.rsplit(":", 1)[0]
+
+    path = parsed.path or "/"
+    if len(path) > 1:
+        path = path.rstrip("/")
+
+    query_params = [
+        (key, value) for key, value in parse_qsl(parsed.query, keep_blank_values=True)
+        if not any(fnmatch.fnmatch(key, pattern) for pattern in strip_query_params)
+    ]
+    query = urlencode(sorted(query_params))
+
+    return urlunparse((scheme, netloc, path, parsed.params, query, ""))
+
+class HostPoliteness:
+    """
+    Limits how hard the crawler hits each host.
+
+    Caps the number of concurrent requests per host and optionally enforces a
+    minimum delay between the start of consecutive requests to the same host.
+    """
+
+    def __init__(self, max_per_host: int, min_delay: float = 0.0):
+        self.max_per_host = max_per_host
+        self.min_delay = min_delay
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._next_start: Dict[str, float] = {}
+
+    @asynccontextmanager
+    async def slot(self, url: str) -> AsyncIterator[None]:
+        """
+        Wait for a free request slot for the host of a URL.
+
+        Args:
+            url: URL about to be requested
+        """
+        host = urlparse(url).netloc.lower()
+        semaphore = self._semaphores.setdefault(host, asyncio.Semaphore(self.max_per_host))
+        async with semaphore:
+            if self.min_delay > 0:
+                async with self._locks.setdefault(host, asyncio.Lock()):
+                    loop = asyncio.get_running_loop()
+                    wait = self._next_start.get(host, 0.0) - loop.time()
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                    self._next_start[host] = loop.time() + self.min_delay
+            yield
+
+async def iter_queue_until_done(results: asyncio.Queue, done: asyncio.Future) -> AsyncIterator:
+    """
+    Yield items from a results queue until the producers are done and the queue is drained.
+
+    Args:
+        results: Queue the producer tasks put their results on
+        done: Future that completes once every producer has finished (e.g. a Queue.join() task)
+
+    Yields:
+        Each item put on the results queue
+    """
+    while True:
+        next_result = asyncio.ensure_future(results.get())
+        finished, _ = await asyncio.wait({next_result, done}, return_when=asyncio.FIRST_COMPLETED)
+        if next_result in finished:
+            yield next_result.result()
+            continue
+        next_result.cancel()
+        while not results.empty():
+            yield results.get_nowait()
+        break
@@ -0,0 +1,492 @@
+"""
+Persistent background crawl jobs for the Crawl4AI MCP server.
+
+Crawl jobs are recorded in a local SQLite database and run by a bounded number of
+in-process workers, so the MCP tool that starts a crawl returns immediately and
+clients follow the job's progress with separate, short tool calls. Every page whose
+chunks have been stored is checkpointed; jobs that were still running when the
+server stopped are queued again on startup and skip their checkpointed pages.
+"""
+import os
+import json
+import uuid
+import asyncio
+import sqlite3
+import time
+from collections import deque
+from typing import List, Dict, Any, Optional, Callable, Awaitable
+
+from sqlite_store import SQLiteStore, default_store_path
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (COMPLETED, FAILED, CANCELLED)
+
+# Progress is written to the database at most this often per job
+PROGRESS_FLUSH_SECONDS = 2.0
+
+# Events kept in memory per job for polling and streaming
+MAX_JOB_EVENTS = 200
+
+# Finished jobs whose live progress and events are kept in memory
+MAX_FINISHED_PROGRESS = 50
+
+class CrawlJobStore(SQLiteStore):
+    """SQLite-backed record of crawl jobs and the pages each one has finished."""
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS crawl_jobs (
+                id TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                params TEXT NOT NULL,
+                status TEXT NOT NULL,
+                progress TEXT NOT NULL DEFAULT '{}',
+                result TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS crawl_job_pages (
+                job_id TEXT NOT NULL,
+                url TEXT NOT NULL,
+                PRIMARY KEY (job_id, url)
+            )
+        """)
+        self._conn.commit()
+
+    def _row_to_job(self, cursor: sqlite3.Cursor, row: tuple) -> Dict[str, Any]:
+        job = dict(zip([column[0] for column in cursor.description], row))
+        job["params"] = json.loads(job["params"])
+        job["progress"] = json.loads(job["progress"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def create(self, url: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Record a new queued job.
+
+        Args:
+            url: URL to crawl
+            params: Crawl parameters
+
+        Returns:
+            The new job
+        """
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO crawl_jobs (id, url, params, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, url, json.dumps(params), QUEUED, time.time())
+            )
+            self._conn.commit()
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a job by ID.
+
+        Args:
+            job_id: ID of the job
+
+        Returns:
+            The job, or None if it doesn't exist
+        """
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM crawl_jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+            return self._row_to_job(cursor, row) if row else None
+
+    def list(self, status: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        List jobs, most recent first.
+
+        Args:
+            status: Only list jobs in this state
+            limit: Maximum number of jobs
+
+        Returns:
+            List of jobs
+        """
+        query = "SELECT * FROM crawl_jobs"
+        args: List[Any] = []
+        if status:
+            query += " WHERE status = ?"
+            args.append(status)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        args.append(limit)
+        with self._lock:
+            cursor = self._conn.execute(query, args)
+            return [self._row_to_job(cursor, row) for row in cursor.fetchall()]
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        """
+        Update fields of a job.
+
+        Args:
+            job_id: ID of the job
+            **fields: Columns to set; progress and result are stored as JSON
+        """
+        for key in ("progress", "result"):
+            if key in fields and fields[key] is not None:
+                fields[key] = json.dumps(fields[key])
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE crawl_jobs SET {assignments} WHERE id = ?", [*fields.values(), job_id])
+            self._conn.commit()
+
+    def claim(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Mark a queued job as running, unless it has left the queue (e.g. was cancelled).
+
+        Args:
+            job_id: ID of the job
+
+        Returns:
+            The running job, or None if it wasn't queued
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE crawl_jobs SET status = ?, started_at = ?, attempts = attempts + 1 WHERE id = ? AND status = ?",
+                (RUNNING, time.time(), job_id, QUEUED)
+            )
+            self._conn.commit()
+            if not cursor.rowcount:
+                return None
+        return self.get(job_id)
+
+    def cancel_queued(self, job_id: str) -> bool:
+        """
+        Cancel a job if it is still queued.
+
+        Args:
+            job_id: ID of the job
+
+        Returns:
+            True if the job was queued and is now cancelled
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE crawl_jobs SET status = ?, finished_at = ? WHERE id = ? AND status = ?",
+                (CANCELLED, time.time(), job_id, QUEUED)
+            )
+            self._conn.commit()
+            return cursor.rowcount > 0
+
+    def requeue_interrupted(self) -> List[str]:
+        """
+        Queue the jobs that were running when the server stopped again.
+
+        Returns:
+            IDs of the requeued jobs
+        """
+        with self._lock:
+            job_ids = [row[0] for row in self._conn.execute("SELECT id FROM crawl_jobs WHERE status = ?", (RUNNING,))]
+            self._conn.execute("UPDATE crawl_jobs SET status = ? WHERE status = ?", (QUEUED, RUNNING))
+            self._conn.commit()
+        return job_ids
+
+    def add_checkpoints(self, job_id: str, urls: List[str]) -> None:
+        """
+        Record pages of a job whose chunks have been stored.
+
+        Args:
+            job_id: ID of the job
+            urls: URLs of the finished pages
+        """
+        if not urls:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO crawl_job_pages (job_id, url) VALUES (?, ?)",
+                [(job_id, url) for url in urls]
+            )
+            self._conn.commit()
+
+    def get_checkpoints(self, job_id: str) -> List[str]:
+        """
+        Get the pages of a job whose chunks have been stored.
+
+        Args:
+            job_id: ID of the job
+
+        Returns:
+            URLs of the finished pages
+        """
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT url FROM crawl_job_pages WHERE job_id = ?", (job_id,))]
+
+class JobProgress:
+    """
+    Live progress of a running job.
+
+    Crawl code reports pages through record(); counters and a bounded list of recent
+    events are kept in memory, waiters are woken up on every change, and the progress
+    and checkpoints are written to the job store at most every PROGRESS_FLUSH_SECONDS.
+    """
+
+    def __init__(self, job_id: str, store: CrawlJobStore, counters: Optional[Dict[str, Any]] = None):
+        self.job_id = job_id
+        self.store = store
+        self.counters: Dict[str, Any] = {
+            "pages_crawled": 0,
+            "pages_stored": 0,
+            "pages_unchanged": 0,
+            "pages_resumed": 0,
+            "last_url": None,
+            **(counters or {})
+        }
+        self.events: deque = deque(maxlen=MAX_JOB_EVENTS)
+        self.version = 0
+        self._changed = asyncio.Condition()
+        self._checkpoints: List[str] = []
+        self._last_flush = 0.0
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def record(self, event: str, url: str) -> None:
+        """
+        Record a page event.
+
+        Args:
+            event: "crawled" (rendered and queued for indexing), "stored" (chunks
+                written, the page is checkpointed), "unchanged" (checkpointed too) or
+                "failed" (chunks not written, crawled again when the job resumes)
+            url: URL of the page
+        """
+        self.counters[f"pages_{event}"] = self.counters.get(f"pages_{event}", 0) + 1
+        self.counters["last_url"] = url
+        if event in ("stored", "unchanged"):
+            self._checkpoints.append(url)
+        self.log(f"{event}: {url}")
+        if time.monotonic() - self._last_flush >= PROGRESS_FLUSH_SECONDS and not self._flush_task:
+            self._flush_task = asyncio.ensure_future(self.flush())
+
+    def log(self, message: str) -> None:
+        """
+        Add an event to the job's event log and wake up waiters.
+
+        Args:
+            message: Event message
+        """
+        self.version += 1
+        self.events.append({"seq": self.version, "time": time.time(), "message": message})
+        asyncio.ensure_future(self._notify())
+
+    async def _notify(self) -> None:
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def wait_for_change(self, since: int, timeout: float) -> bool:
+        """
+        Wait until the progress changes past a version.
+
+        Args:
+            since: Version the caller has already seen
+            timeout: Maximum number of seconds to wait
+
+        Returns:
+            True if the progress changed, False on timeout
+        """
+        async with self._changed:
+            try:
+                await asyncio.wait_for(self._changed.wait_for(lambda: self.version > since), timeout)
+                return True
+            except asyncio.TimeoutError:
+                return False
+
+    def events_since(self, since: int) -> List[Dict[str, Any]]:
+        """Get the events after a sequence number that are still in memory."""
+        return [event for event in self.events if event["seq"] > since]
+
+    async def flush(self) -> None:
+        """Write the progress and new checkpoints to the job store."""
+        checkpoints, self._checkpoints = self._checkpoints, []
+        self._last_flush = time.monotonic()
+        try:
+            await asyncio.to_thread(self.store.add_checkpoints, self.job_id, checkpoints)
+            await asyncio.to_thread(self.store.update, self.job_id, progress=dict(self.counters))
+        except Exception as e:
+            print(f"Error saving progress of crawl job {self.job_id}: {e}")
+        finally:
+            self._flush_task = None
+
+class CrawlJobQueue:
+    """
+    Runs queued crawl jobs with at most max_concurrency jobs at a time.
+
+    The run function receives the job and its JobProgress, and the URLs checkpointed
+    by earlier attempts of the job, and returns the job's result.
+    """
+
+    def __init__(
+        self,
+        store: CrawlJobStore,
+        run: Callable[[Dict[str, Any], JobProgress, List[str]], Awaitable[Dict[str, Any]]],
+        max_concurrency: int = 2
+    ):
+        self.store = store
+        self.run = run
+        self.max_concurrency = max(1, max_concurrency)
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._running: Dict[str, asyncio.Task] = {}
+        # Jobs cancelled after a worker claimed them but before their crawl started
+        self._cancel_requested: set = set()
+        # Set once a job's final state has been stored
+        self._finished: Dict[str, asyncio.Event] = {}
+        self._progress: Dict[str, JobProgress] = {}
+
+    async def start(self) -> None:
+        """Requeue interrupted jobs and start the workers."""
+        self._queue = asyncio.Queue()
+        requeued = await asyncio.to_thread(self.store.requeue_interrupted)
+        if requeued:
+            print(f"Resuming {len(requeued)} interrupted crawl jobs")
+        for job in reversed(await asyncio.to_thread(self.store.list, QUEUED, 1000)):
+            self._queue.put_nowait(job["id"])
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_concurrency)]
+
+    async def close(self) -> None:
+        """
+        Stop the workers.
+
+        Jobs that are still running stay marked as running, so they are resumed from
+        their checkpoints the next time the queue starts.
+        """
+        for progress in self._progress.values():
+            await progress.flush()
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+    async def submit(self, url: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Queue a new crawl job.
+
+        Args:
+            url: URL to crawl
+            params: Crawl parameters
+
+        Returns:
+            The queued job
+        """
+        job = await asyncio.to_thread(self.store.create, url, params)
+        self._queue.put_nowait(job["id"])
+        return job
+
+    async def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Cancel a queued or running job.
+
+        Args:
+            job_id: ID of the job
+
+        Returns:
+            The job after cancelling it, or None if it doesn't exist
+        """
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if not job or job["status"] in FINISHED_STATES:
+            return job
+        task = self._running.get(job_id)
+        if task:
+            # The worker records the cancellation once the crawl has stopped
+            finished = self._finished[job_id]
+            task.cancel()
+            await finished.wait()
+        elif not await asyncio.to_thread(self.store.cancel_queued, job_id):
+            # A worker claimed the job in the meantime; it cancels the crawl as soon as it starts.
+            # Ask for that before reading the status again, so a worker finishing in between
+            # either sees the request or has already recorded its final status.
+            self._cancel_requested.add(job_id)
+            finished = self._finished.get(job_id)
+            created = finished is None
+            if created:
+                finished = self._finished[job_id] = asyncio.Event()
+            job = await asyncio.to_thread(self.store.get, job_id)
+            if job and job["status"] == RUNNING:
+                await finished.wait()
+            elif created and self._finished.get(job_id) is finished:
+                # The worker finished before the event was registered and will never set it
+                del self._finished[job_id]
+            self._cancel_requested.discard(job_id)
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    def get_progress(self, job_id: str) -> Optional[JobProgress]:
+        """Get the live progress of a job that is running (or finished since the server started)."""
+        return self._progress.get(job_id)
+
+    def queue_depth(self) -> int:
+        """Number of jobs waiting for a worker."""
+        return self._queue.qsize() if self._queue else 0
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            # Claiming is atomic, so jobs cancelled while queued are skipped
+            job = await asyncio.to_thread(self.store.claim, job_id)
+            if not job:
+                continue
+            self._finished.setdefault(job_id, asyncio.Event())
+
+            checkpoints = await asyncio.to_thread(self.store.get_checkpoints, job_id)
+            progress = JobProgress(job_id, self.store, counters={"pages_resumed": len(checkpoints)})
+            self._progress[job_id] = progress
+            self._forget_finished()
+            progress.log(f"started, resuming after {len(checkpoints)} finished pages" if checkpoints else "started")
+
+            task = asyncio.create_task(self.run(job, progress, checkpoints))
+            self._running[job_id] = task
+            if job_id in self._cancel_requested:
+                task.cancel()
+            try:
+                result = await asyncio.shield(task)
+                status, fields = COMPLETED, {"result": result}
+            except asyncio.CancelledError:
+                if not task.cancelled():
+                    # The worker itself is being stopped; leave the job to be resumed
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+                    raise
+                status, fields = CANCELLED, {}
+            except Exception as e:
+                status, fields = FAILED, {"error": str(e)}
+            finally:
+                self._running.pop(job_id, None)
+                self._cancel_requested.discard(job_id)
+
+            await progress.flush()
+            await asyncio.to_thread(self.store.update, job_id, status=status, finished_at=time.time(), **fields)
+            self._finished.pop(job_id).set()
+            progress.log(status if status != FAILED else f"failed: {fields['error']}")
+    
+    def _forget_finished(self) -> None:
+        """Drop the live progress of the oldest finished jobs beyond MAX_FINISHED_PROGRESS."""
+        finished = [job_id for job_id in self._progress if job_id not in self._running]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_PROGRESS)]:
+            del self._progress[job_id]
+
+_job_store: Optional[CrawlJobStore] = None
+
+def get_crawl_job_store() -> CrawlJobStore:
+    """
+    Get the shared crawl job store, creating it on first use.
+
+    The database location is configured with CRAWL_JOBS_PATH.
+
+    Returns:
+        The crawl job store
+    """
+    global _job_store
+    if _job_store is None:
+        _job_store = CrawlJobStore(os.getenv("CRAWL_JOBS_PATH", default_store_path("crawl_jobs.sqlite")))
+    return _job_store
@@ -0,0 +1,122 @@
+"""
+Per-URL crawl ledger for incremental recrawls.
+
+The ledger remembers what each page looked like the last time it was crawled (sitemap
+lastmod, HTTP validators, content hash and internal links), so an incremental crawl can
+skip pages that haven't changed without rendering them in the browser again.
+"""
+import os
+import json
+import hashlib
+import sqlite3
+import time
+from typing import List, Dict, Any, Optional
+
+from sqlite_store import SQLiteStore, default_store_path
+
+def hash_content(content: str) -> str:
+    """
+    Hash page content to detect changes between crawls.
+
+    Args:
+        content: Markdown content of the page
+
+    Returns:
+        Hex sha256 digest of the content
+    """
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+class CrawlLedger(SQLiteStore):
+    """SQLite-backed record of the last crawl of every URL."""
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS crawl_ledger (
+                url TEXT PRIMARY KEY,
+                lastmod TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                content_hash TEXT,
+                word_count INTEGER NOT NULL DEFAULT 0,
+                internal_links TEXT NOT NULL DEFAULT '[]',
+                last_crawled REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def get_many(self, urls: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Get the ledger entries for a list of URLs.
+
+        Args:
+            urls: URLs to look up
+
+        Returns:
+            Dictionary mapping each known URL to its ledger entry
+        """
+        entries = {}
+        with self._lock:
+            rows = self._select_in("SELECT * FROM crawl_ledger WHERE url IN ({placeholders})", urls)
+        for row in rows:
+            entry = dict(row)
+            entry["internal_links"] = json.loads(entry["internal_links"])
+            entries[entry["url"]] = entry
+        return entries
+
+    def upsert_many(self, entries: List[Dict[str, Any]]) -> None:
+        """
+        Record the latest crawl of a list of pages.
+
+        Args:
+            entries: Dictionaries with url, content_hash and optionally lastmod, etag,
+                last_modified, word_count and internal_links
+        """
+        now = time.time()
+        rows = [
+            (
+                entry["url"],
+                entry.get("lastmod"),
+                entry.get("etag"),
+                entry.get("last_modified"),
+                entry.get("content_hash"),
+                entry.get("word_count", 0),
+                json.dumps(entry.get("internal_links", [])),
+                now
+            )
+            for entry in entries
+        ]
+        if not rows:
+            return
+
+        with self._lock:
+            self._conn.executemany("""
+                INSERT INTO crawl_ledger (url, lastmod, etag, last_modified, content_hash, word_count, internal_links, last_crawled)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (url) DO UPDATE SET
+                    lastmod = COALESCE(excluded.lastmod, crawl_ledger.lastmod),
+                    etag = excluded.etag,
+                    last_modified = excluded.last_modified,
+                    content_hash = excluded.content_hash,
+                    word_count = excluded.word_count,
+                    internal_links = excluded.internal_links,
+                    last_crawled = excluded.last_crawled
+            """, rows)
+            self._conn.commit()
+
+_crawl_ledger: Optional[CrawlLedger] = None
+
+def get_crawl_ledger() -> CrawlLedger:
+    """
+    Get the shared crawl ledger, creating it on first use.
+
+    The ledger location is configured with CRAWL_LEDGER_PATH.
+
+    Returns:
+        The crawl ledger
+    """
+    global _crawl_ledger
+    if _crawl_ledger is None:
+        _crawl_ledger = CrawlLedger(os.getenv("CRAWL_LEDGER_PATH", default_store_path("crawl_ledger.sqlite")))
+    return _crawl_ledger
@@ -0,0 +1,286 @@
+"""
+Shared browser pool for the Crawl4AI MCP server.
+
+Every crawl (tool calls and background jobs alike) renders pages through one pool of
+browsers with a server-wide limit on concurrent sessions. Each crawl takes a lease
+with its own session quota, so a large crawl can't take every session away from the
+others, and new sessions wait while system memory is above the threshold instead of
+each crawl throttling on its own.
+"""
+import os
+import asyncio
+import time
+import weakref
+from contextlib import asynccontextmanager
+from collections.abc import AsyncIterator
+from typing import List, Dict, Any, Optional
+
+import httpx
+import psutil
+from crawl4ai import AsyncWebCrawler, BrowserConfig, CrawlerRunConfig
+
+from http_fetch import fetch_static_page
+
+class CrawlerLease:
+    """
+    A crawl's share of the pool: at most max_sessions concurrent browser sessions.
+
+    With fast_path, arun first fetches each page with the HTTP client and only renders
+    it in a browser when it looks like it needs JavaScript (see http_fetch).
+    """
+
+    def __init__(
+        self,
+        pool: "CrawlerPool",
+        name: str,
+        max_sessions: int,
+        http_client: Optional[httpx.AsyncClient] = None,
+        fast_path: bool = False
+    ):
+        self.pool = pool
+        self.name = name
+        self.max_sessions = max_sessions
+        self.http_client = http_client
+        self.fast_path = fast_path and http_client is not None
+        self.active = 0
+        self.waiting = 0
+        self.pages = 0
+        self.http_pages = 0
+        self._semaphore = asyncio.Semaphore(max_sessions)
+
+    @asynccontextmanager
+    async def session(self) -> AsyncIterator[AsyncWebCrawler]:
+        """
+        Hold one browser session of the pool.
+
+        Waits for a free slot of this lease, then for a free session of the pool.
+
+        Yields:
+            The crawler (browser) to render the page with
+        """
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            async with self.pool._session(self) as crawler:
+                self.active += 1
+                try:
+                    yield crawler
+                finally:
+                    self.active -= 1
+                    self.pages += 1
+        finally:
+            self._semaphore.release()
+
+    async def arun(self, url: str, config: CrawlerRunConfig) -> Any:
+        """
+        Crawl a page, over plain HTTP when the fast path allows it, else in a browser session.
+
+        Args:
+            url: URL of the page
+            config: Crawl4AI run configuration
+
+        Returns:
+            The Crawl4AI result, or a StaticPage with the same attributes
+        """
+        if self.fast_path:
+            page = await fetch_static_page(self.http_client, url)
+            if page:
+                self.http_pages += 1
+                self.pool.http_pages += 1
+                return page
+            self.pool.escalations += 1
+        async with self.session() as crawler:
+            return await crawler.arun(url=url, config=config)
+
+class CrawlerPool:
+    """
+    A fixed number of browsers shared by every crawl.
+
+    Sessions go to the browser with the fewest active sessions. At most max_sessions
+    sessions are open across the pool, and a lease can hold at most
+    max_sessions_per_job of them. No new session starts while system memory is at or
+    above memory_threshold percent, for at most memory_wait_seconds; after that the
+    session starts anyway with a warning, so a machine that always sits above the
+    threshold slows crawls down instead of hanging them.
+    """
+
+    def __init__(
+        self,
+        browser_config: BrowserConfig,
+        size: int = 1,
+        max_sessions: int = 20,
+        max_sessions_per_job: int = 10,
+        memory_threshold: float = 70.0,
+        memory_wait_seconds: float = 30.0
+    ):
+        self.browser_config = browser_config
+        self.size = max(1, size)
+        self.max_sessions = max(1, max_sessions)
+        self.max_sessions_per_job = max(1, max_sessions_per_job)
+        self.memory_threshold = memory_threshold
+        self.memory_wait_seconds = memory_wait_seconds
+
+        self.crawlers: List[AsyncWebCrawler] = []
+        self._active: List[int] = []
+        self._semaphore = asyncio.Semaphore(self.max_sessions)
+        # Leases drop out of the metrics once their crawl no longer references them
+        self._leases = weakref.WeakSet()
+
+        self.waiting = 0
+        self.memory_waits = 0
+        self.memory_wait_seconds_total = 0.0
+        self.memory_wait_timeouts = 0
+        self.pages = 0
+        self.render_seconds = 0.0
+        # Fast path pages fetched over HTTP, and those handed to the browser after all
+        self.http_pages = 0
+        self.escalations = 0
+
+    @classmethod
+    def from_env(cls) -> "CrawlerPool":
+        """
+        Create a pool configured from the environment.
+
+        CRAWLER_POOL_SIZE sets the number of browsers, CRAWLER_MAX_SESSIONS the total
+        number of concurrent sessions and CRAWLER_MAX_SESSIONS_PER_JOB the quota of a
+        single crawl. CRAWL_MEMORY_WAIT_SECONDS caps how long a session waits for memory
+        to drop below CRAWL_MEMORY_THRESHOLD_PERCENT. With CRAWLER_BLOCK_RESOURCES=true the browsers run in text mode
+        (no images or rich media) and light mode (no background features).
+
+        Returns:
+            The crawler pool (not started yet)
+        """
+        block_resources = os.getenv("CRAWLER_BLOCK_RESOURCES", "false") == "true"
+        browser_config = BrowserConfig(
+            headless=True,
+            verbose=False,
+            text_mode=block_resources,
+            light_mode=block_resources
+        )
+        return cls(
+            browser_config,
+            size=int(os.getenv("CRAWLER_POOL_SIZE", "1")),
+            max_sessions=int(os.getenv("CRAWLER_MAX_SESSIONS", "20")),
+            max_sessions_per_job=int(os.getenv("CRAWLER_MAX_SESSIONS_PER_JOB", "10")),
+            memory_threshold=float(os.getenv("CRAWL_MEMORY_THRESHOLD_PERCENT", "70")),
+            memory_wait_seconds=float(os.getenv("CRAWL_MEMORY_WAIT_SECONDS", "30"))
+        )
+
+    async def start(self) -> None:
+        """Start the browsers."""
+        for _ in range(self.size):
+            crawler = AsyncWebCrawler(config=self.browser_config)
+            await crawler.__aenter__()
+            self.crawlers.append(crawler)
+            self._active.append(0)
+
+    async def close(self) -> None:
+        """Close the browsers."""
+        for crawler in self.crawlers:
+            await crawler.__aexit__(None, None, None)
+        self.crawlers = []
+        self._active = []
+
+    def lease(
+        self,
+        name: str,
+        max_sessions: Optional[int] = None,
+        http_client: Optional[httpx.AsyncClient] = None,
+        fast_path: bool = False
+    ) -> CrawlerLease:
+        """
+        Get a share of the pool for one crawl.
+
+        Args:
+            name: Name of the crawl in the metrics (e.g. its URL)
+            max_sessions: Concurrent sessions the crawl asks for; capped at max_sessions_per_job
+            http_client: Shared HTTP client, used for conditional requests and the fast path
+            fast_path: Fetch static pages over plain HTTP instead of rendering them
+
+        Returns:
+            The lease
+        """
+        quota = min(max_sessions or self.max_sessions_per_job, self.max_sessions_per_job)
+        lease = CrawlerLease(self, name, max(1, quota), http_client, fast_path)
+        self._leases.add(lease)
+        return lease
+
+    @asynccontextmanager
+    async def _session(self, lease: CrawlerLease) -> AsyncIterator[AsyncWebCrawler]:
+        self.waiting += 1
+        try:
+            # Don't open new browser pages while the machine is under memory pressure
+            waited = 0.0
+            while psutil.virtual_memory().percent >= self.memory_threshold:
+                if waited >= self.memory_wait_seconds:
+                    self.memory_wait_timeouts += 1
+                    print(f"Memory still above {self.memory_threshold}% after {waited:.0f}s, starting a session for {lease.name} anyway")
+                    break
+                self.memory_waits += 1
+                await asyncio.sleep(1.0)
+                waited += 1.0
+                self.memory_wait_seconds_total += 1.0
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        index = min(range(len(self.crawlers)), key=lambda i: self._active[i])
+        self._active[index] += 1
+        start = time.perf_counter()
+        try:
+            yield self.crawlers[index]
+        finally:
+            self.render_seconds += time.perf_counter() - start
+            self.pages += 1
+            self._active[index] -= 1
+            self._semaphore.release()
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Get the current state of the pool.
+
+        Returns:
+            Dictionary with the active and waiting sessions (overall, per browser and per
+            lease), pages rendered, average render time, system memory use and the RSS
+            of the server and its browser processes
+        """
+        process = psutil.Process()
+        rss = process.memory_info().rss
+        for child in process.children(recursive=True):
+            try:
+                rss += child.memory_info().rss
+            except psutil.Error:
+                # The process exited in the meantime
+                pass
+
+        return {
+            "browsers": len(self.crawlers),
+            "max_sessions": self.max_sessions,
+            "max_sessions_per_job": self.max_sessions_per_job,
+            "active_sessions": sum(self._active),
+            "active_sessions_per_browser": list(self._active),
+            "waiting_sessions": self.waiting,
+            "memory_waits": self.memory_waits,
+            "memory_wait_seconds": self.memory_wait_seconds_total,
+            "memory_wait_timeouts": self.memory_wait_timeouts,
+            "pages_rendered": self.pages,
+            "pages_fetched_over_http": self.http_pages,
+            "fast_path_escalations": self.escalations,
+            "avg_render_ms": round(self.render_seconds / self.pages * 1000, 1) if self.pages else 0.0,
+            "memory_percent": psutil.virtual_memory().percent,
+            "rss_mb": round(rss / 1024 / 1024, 1),
+            "leases": [
+                {
+                    "name": lease.name,
+                    "max_sessions": lease.max_sessions,
+                    "active_sessions": lease.active,
+                    "waiting_sessions": lease.waiting,
+                    "pages_rendered": lease.pages,
+                    "pages_fetched_over_http": lease.http_pages
+                }
+                for lease in self._leases
+            ]
+        }
@@ -0,0 +1,189 @@
+"""
+Persistent embedding cache for the Crawl4AI MCP server.
+
+Embeddings are keyed on (model, sha256(text)) and stored in a local SQLite database,
+so recrawling pages that haven't changed doesn't pay for the same embeddings again.
+"""
+import os
+import hashlib
+import time
+from array import array
+from typing import List, Dict, Any, Optional
+
+from sqlite_store import SQLiteStore, SQLITE_MAX_PARAMS, default_store_path
+
+class EmbeddingCache(SQLiteStore):
+    """
+    SQLite-backed embedding cache with size-based LRU eviction.
+
+    Embeddings are stored as packed float32 blobs. Whenever the total stored size
+    exceeds max_bytes, the least recently used entries are evicted until the cache
+    is back under 90% of the limit.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        super().__init__(path)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                size_bytes INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def hash_text(text: str) -> str:
+        """
+        Hash a text for use as a cache key.
+
+        Args:
+            text: Text to hash
+
+        Returns:
+            Hex sha256 digest of the text
+        """
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, model: str, texts: List[str]) -> Dict[int, List[float]]:
+        """
+        Look up cached embeddings for a list of texts.
+
+        Args:
+            model: Embedding model name
+            texts: Texts to look up
+
+        Returns:
+            Dictionary mapping the index of each cached text to its embedding
+        """
+        hashes = [self.hash_text(text) for text in texts]
+
+        with self._lock:
+            found: Dict[str, bytes] = dict(self._select_in(
+                "SELECT text_hash, embedding FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                hashes, [model]
+            ))
+
+            # Touch the entries we used so they survive eviction the longest
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, text_hash) for text_hash in found]
+                )
+                self._conn.commit()
+
+        results = {}
+        for i, text_hash in enumerate(hashes):
+            blob = found.get(text_hash)
+            if blob is not None:
+                results[i] = array("f", blob).tolist()
+
+        self.hits += len(results)
+        self.misses += len(texts) - len(results)
+        return results
+
+    def put_many(self, model: str, texts: List[str], embeddings: List[List[float]]) -> None:
+        """
+        Store embeddings for a list of texts, evicting old entries if the cache is full.
+
+        Args:
+            model: Embedding model name
+            texts: Texts that were embedded
+            embeddings: Embedding for each text
+        """
+        now = time.time()
+        rows = []
+        for text, embedding in zip(texts, embeddings):
+            blob = array("f", embedding).tobytes()
+            rows.append((model, self.hash_text(text), blob, len(blob), now))
+        if not rows:
+            return
+
+        with self._lock:
+            cursor = self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, text_hash, embedding, size_bytes, last_used) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            # rowcount only counts rows that were actually inserted; assume each has the same size
+            self._total_bytes += max(cursor.rowcount, 0) * rows[0][3]
+            self._conn.commit()
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        """Delete least recently used entries until the cache is under 90% of its limit."""
+        target = int(self.max_bytes * 0.9)
+        while self._total_bytes > target:
+            rows = self._conn.execute(
+                "SELECT model, text_hash, size_bytes FROM embeddings ORDER BY last_used LIMIT ?",
+                (SQLITE_MAX_PARAMS,)
+            ).fetchall()
+            if not rows:
+                self._total_bytes = 0
+                break
+
+            evicted = []
+            for model, text_hash, size_bytes in rows:
+                if self._total_bytes <= target:
+                    break
+                evicted.append((model, text_hash))
+                self._total_bytes -= size_bytes
+
+            self._conn.executemany("DELETE FROM embeddings WHERE model = ? AND text_hash = ?", evicted)
+            self.evictions += len(evicted)
+        self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the hit/miss counters and size of the cache.
+
+        Returns:
+            Dictionary with cache statistics
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "size_bytes": self._total_bytes,
+            "max_bytes": self.max_bytes
+        }
+
+_embedding_cache: Optional[EmbeddingCache] = None
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """
+    Get the shared embedding cache, creating it on first use.
+
+    The cache is enabled unless USE_EMBEDDING_CACHE is set to "false". Its location and
+    size are configured with EMBEDDING_CACHE_PATH and EMBEDDING_CACHE_MAX_MB.
+
+    Returns:
+        The embedding cache, or None if caching is disabled or the database can't be opened
+    """
+    global _embedding_cache
+    if os.getenv("USE_EMBEDDING_CACHE", "true") != "true":
+        return None
+
+    if _embedding_cache is None:
+        path = os.getenv("EMBEDDING_CACHE_PATH", default_store_path("embeddings.sqlite"))
+        max_bytes = int(float(os.getenv("EMBEDDING_CACHE_MAX_MB", "512")) * 1024 * 1024)
+        try:
+            _embedding_cache = EmbeddingCache(path, max_bytes)
+        except Exception as e:
+            print(f"Failed to open embedding cache at {path}: {e}. Continuing without it.")
+            return None
+    return _embedding_cache
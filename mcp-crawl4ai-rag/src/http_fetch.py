@@ -0,0 +1,178 @@
+"""
+Plain HTTP fast path for static pages in the Crawl4AI MCP server.
+
+Many documentation sites serve their full content in the initial HTML, so rendering
+them in a headless browser only costs time and memory. fetch_static_page downloads a
+page with the shared async HTTP client and converts it to markdown with Crawl4AI's
+markdown generator. Pages that look rendered by JavaScript (little text, an empty
+framework root element, a "please enable JavaScript" notice) or that aren't HTML or
+text are left to the browser.
+"""
+import os
+import re
+import asyncio
+from html.parser import HTMLParser
+from typing import List, Dict, Optional
+from urllib.parse import urljoin, urlparse, urldefrag
+
+import httpx
+from crawl4ai import DefaultMarkdownGenerator
+
+# Content types returned as they are, without conversion
+TEXT_CONTENT_TYPES = ("text/plain", "text/markdown", "text/x-markdown")
+
+# Content types converted from HTML
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+
+# Larger responses are left to the browser
+MAX_STATIC_PAGE_BYTES = 10 * 1024 * 1024
+
+# Elements whose content never ends up in the markdown
+_INVISIBLE_ELEMENTS = re.compile(r"<(script|style|noscript|template|svg)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+
+# Signs of a page whose content is rendered by JavaScript
+_JS_SHELL_MARKERS = re.compile(
+    r"<div[^>]+id=[\"'](?:root|app|__next|__nuxt|svelte|___gatsby)[\"'][^>]*>\s*</div>"
+    r"|<app-root[^>]*>\s*</app-root>"
+    r"|(?:enable|requires?) javascript",
+    re.IGNORECASE
+)
+
+class StaticPage:
+    """A page fetched over plain HTTP, with the attributes of a Crawl4AI result used by the crawlers."""
+
+    def __init__(self, url: str, markdown: str, response_headers: Dict[str, str], links: Dict[str, List[Dict[str, str]]]):
+        self.url = url
+        self.markdown = markdown
+        self.response_headers = response_headers
+        self.links = links
+        self.success = True
+        self.error_message = None
+
+class _LinkParser(HTMLParser):
+    """Collects the href of every anchor and the document's <base href>."""
+
+    def __init__(self):
+        super().__init__()
+        self.base: Optional[str] = None
+        self.hrefs: List[str] = []
+
+    def handle_starttag(self, tag: str, attrs: List[tuple]) -> None:
+        href = dict(attrs).get("href")
+        if not href:
+            return
+        if tag == "a":
+            self.hrefs.append(href)
+        elif tag == "base" and self.base is None:
+            self.base = href
+
+def extract_links(html: str, page_url: str) -> Dict[str, List[Dict[str, str]]]:
+    """
+    Extract the links of a page, split into internal and external links.
+
+    Args:
+        html: HTML of the page
+        page_url: Final URL of the page, used to resolve relative links
+
+    Returns:
+        Dictionary with 'internal' and 'external' lists of {'href': absolute URL}
+    """
+    parser = _LinkParser()
+    try:
+        parser.feed(html)
+    except Exception as e:
+        print(f"Error parsing links of {page_url}: {e}")
+    base_url = urljoin(page_url, parser.base) if parser.base else page_url
+    host = urlparse(page_url).netloc.lower()
+
+    links = {"internal": [], "external": []}
+    seen = set()
+    for href in parser.hrefs:
+        url = urldefrag(urljoin(base_url, href.strip()))[0]
+        parsed = urlparse(url)
+        if parsed.scheme not in ("http", "https") or url in seen:
+            continue
+        seen.add(url)
+        kind = "internal" if parsed.netloc.lower() == host else "external"
+        links[kind].append({"href": url})
+    return links
+
+def html_to_markdown(html: str, base_url: str) -> str:
+    """
+    Convert the HTML of a page to markdown with Crawl4AI's markdown generator.
+
+    Args:
+        html: HTML of the page
+        base_url: URL of the page, used to resolve relative links
+
+    Returns:
+        Markdown of the page
+    """
+    html = _INVISIBLE_ELEMENTS.sub("", html)
+    result = DefaultMarkdownGenerator().generate_markdown(html, base_url=base_url)
+    return re.sub(r"\n{3,}", "\n\n", result.raw_markdown).strip()
+
+def looks_js_rendered(html: str, markdown: str, min_words: int) -> bool:
+    """
+    Check whether a page's content probably only appears after JavaScript runs.
+
+    Args:
+        html: HTML as served
+        markdown: Markdown converted from the HTML
+        min_words: Pages with fewer words of markdown are treated as JavaScript shells
+
+    Returns:
+        True if the page should be rendered in a browser
+    """
+    if len(markdown.split()) < min_words:
+        return True
+    # A framework root or a JavaScript notice only matters when there is little text around it
+    return bool(_JS_SHELL_MARKERS.search(html)) and len(markdown.split()) < min_words * 4
+
+async def fetch_static_page(http_client: httpx.AsyncClient, url: str) -> Optional[StaticPage]:
+    """
+    Fetch a page over plain HTTP if it doesn't need a browser.
+
+    The minimum number of words for an HTML page to count as static is configured
+    with STATIC_FETCH_MIN_WORDS.
+
+    Args:
+        http_client: Shared async HTTP client
+        url: URL of the page
+
+    Returns:
+        The page, or None if it should be rendered in a browser instead
+    """
+    min_words = int(os.getenv("STATIC_FETCH_MIN_WORDS", "50"))
+    try:
+        # Stream the body so large or binary responses are dropped before they are downloaded
+        async with http_client.stream("GET", url) as response:
+            content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+            if response.status_code != 200 or content_type not in TEXT_CONTENT_TYPES + HTML_CONTENT_TYPES:
+                return None
+            content_length = response.headers.get("content-length", "")
+            if content_length.isdigit() and int(content_length) > MAX_STATIC_PAGE_BYTES:
+                return None
+
+            body = bytearray()
+            async for chunk in response.aiter_bytes():
+                body.extend(chunk)
+                if len(body) > MAX_STATIC_PAGE_BYTES:
+                    return None
+    except httpx.HTTPError as e:
+        print(f"HTTP fetch failed for {url}, using the browser: {e}")
+        return None
+
+    text = body.decode(response.encoding or "utf-8", errors="replace")
+    final_url = str(response.url)
+    headers = dict(response.headers)
+    if content_type in TEXT_CONTENT_TYPES:
+        return StaticPage(final_url, text, headers, {"internal": [], "external": []})
+
+    html = text
+    # Converting large pages takes a while, so keep it off the event loop
+    markdown = await asyncio.to_thread(html_to_markdown, html, final_url)
+    if looks_js_rendered(html, markdown, min_words):
+        return None
+    links = await asyncio.to_thread(extract_links, html, final_url)
+    return StaticPage(final_url, markdown, headers, links)
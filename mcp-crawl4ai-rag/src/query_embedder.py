@@ -0,0 +1,135 @@
+"""
+Async query embeddings for the Crawl4AI MCP server.
+
+Search queries are embedded through an in-process TTL/LRU cache keyed on the normalized
+query text. Concurrent requests for the same query share a single API call, and
+concurrent distinct queries are sent to the embeddings API together in one batch.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+def normalize_query(text: str) -> str:
+    """
+    Normalize a query so queries differing only in whitespace share a cache entry.
+
+    Case is kept, since it can change the embedding (e.g. of code identifiers).
+
+    Args:
+        text: Query text
+
+    Returns:
+        The query with runs of whitespace collapsed
+    """
+    return " ".join(text.split())
+
+class QueryEmbedder:
+    """
+    Caching, coalescing and micro-batching front end for query embeddings.
+
+    Embeddings are kept for ttl seconds, at most max_entries at a time (least recently
+    used first out). Cache misses are queued, and a background batcher sends up to
+    max_batch_size queued queries per request, waiting at most max_wait seconds for
+    more queries to arrive.
+    """
+
+    def __init__(
+        self,
+        embed_batch: Callable[[List[str]], Awaitable[List[List[float]]]],
+        ttl: float = 3600.0,
+        max_entries: int = 2048,
+        max_batch_size: int = 32,
+        max_wait: float = 0.01
+    ):
+        self.embed_batch = embed_batch
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.hits = 0
+        self.misses = 0
+
+        self._cache: "OrderedDict[str, Tuple[float, List[float]]]" = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._batcher: Optional[asyncio.Task] = None
+        self._batch_tasks = set()
+
+    async def embed(self, text: str) -> List[float]:
+        """
+        Get the embedding of a query.
+
+        Args:
+            text: Query text
+
+        Returns:
+            The query embedding
+        """
+        key = normalize_query(text)
+
+        cached = self._cache.get(key)
+        if cached and cached[0] > time.monotonic():
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return cached[1]
+
+        # Another caller is already embedding this query; wait for its result
+        future = self._in_flight.get(key)
+        if future is None:
+            self.misses += 1
+            self._ensure_batcher()
+            future = asyncio.get_running_loop().create_future()
+            self._in_flight[key] = future
+            # The normalized query is what gets embedded, so the key always matches the embedding
+            await self._queue.put((key, future))
+        return await asyncio.shield(future)
+
+    def _ensure_batcher(self) -> None:
+        """Start the background batcher on the running event loop."""
+        if self._batcher is None or self._batcher.done():
+            self._queue = asyncio.Queue()
+            self._batcher = asyncio.create_task(self._run_batcher())
+
+    async def _run_batcher(self) -> None:
+        """Collect queued queries into batches and embed each batch with one request."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Don't hold up the next batch while this one is being embedded
+            task = asyncio.create_task(self._embed_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _embed_batch(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        """Embed one batch of queries and resolve their futures."""
+        try:
+            embeddings = await self.embed_batch([key for key, _ in batch])
+        except Exception as e:
+            for key, future in batch:
+                self._in_flight.pop(key, None)
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        expires_at = time.monotonic() + self.ttl
+        for (key, future), embedding in zip(batch, embeddings):
+            self._in_flight.pop(key, None)
+            # Zero vectors are failed embeddings; don't keep them around
+            if any(value != 0.0 for value in embedding):
+                self._cache[key] = (expires_at, embedding)
+                self._cache.move_to_end(key)
+            if not future.done():
+                future.set_result(embedding)
+
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
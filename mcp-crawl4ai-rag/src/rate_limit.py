@@ -0,0 +1,99 @@
+"""
+Adaptive concurrency limiting for calls to rate-limited APIs.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from collections.abc import AsyncIterator
+from typing import Optional
+
+# Attempts per request when the provider keeps answering with rate-limit errors
+MAX_RATE_LIMIT_RETRIES = 5
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """
+    Get the delay a rate-limit response asked for, if any.
+
+    Args:
+        error: The rate-limit error raised by the API client
+
+    Returns:
+        Seconds from the response's Retry-After header, or None if it has none
+    """
+    try:
+        return float(error.response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Concurrency limit that adapts to rate-limit responses (AIMD).
+
+    The limit starts at max_limit. Every rate-limit response halves it (at most once
+    per cooldown, so a burst of 429s from requests that were already in flight only
+    counts once) and pauses new requests for the retry delay. After a full limit's
+    worth of successful requests the limit grows by one again, up to max_limit.
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 1, cooldown: float = 1.0):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.cooldown = cooldown
+        self.limit = self.max_limit
+        self.rate_limited = 0
+
+        self._in_flight = 0
+        self._successes = 0
+        self._last_decrease = float("-inf")
+        self._resume_at = 0.0
+        self._condition: Optional[asyncio.Condition] = None
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Wait until a request may be sent, holding a slot while it runs."""
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        loop = asyncio.get_running_loop()
+
+        while True:
+            delay = self._resume_at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            async with self._condition:
+                if self._resume_at > loop.time():
+                    continue
+                if self._in_flight < self.limit:
+                    self._in_flight += 1
+                    break
+                await self._condition.wait()
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._in_flight -= 1
+                self._condition.notify_all()
+
+    def record_success(self) -> None:
+        """Record a successful request, growing the limit after enough of them."""
+        self._successes += 1
+        if self._successes >= self.limit and self.limit < self.max_limit:
+            # Waiters are woken up when the request that succeeded releases its slot
+            self.limit += 1
+            self._successes = 0
+
+    def record_rate_limit(self, retry_after: Optional[float] = None) -> None:
+        """
+        Record a rate-limit response, shrinking the limit and pausing new requests.
+
+        Args:
+            retry_after: Seconds the provider asked us to wait (default: 1 second)
+        """
+        self.rate_limited += 1
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self._resume_at = max(self._resume_at, now + (retry_after if retry_after is not None else 1.0))
+        if now - self._last_decrease >= self.cooldown:
+            self.limit = max(self.min_limit, self.limit // 2)
+            self._successes = 0
+            self._last_decrease = now
+            print(f"Rate limited; lowering concurrency to {self.limit}")
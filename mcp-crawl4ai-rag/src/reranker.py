@@ -0,0 +1,216 @@
+"""
+Cross-encoder reranking for the Crawl4AI MCP server.
+
+The model is loaded lazily on first use and runs in a thread pool so scoring never
+blocks the event loop. Pairs from concurrent queries are scored together in batches,
+and scores are cached per (query, passage) so repeated queries skip the model.
+"""
+import os
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Optional, Any
+
+from query_embedder import normalize_query
+
+DEFAULT_RERANKING_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+# Generous upper bound of characters per token, used to cut passages before tokenizing
+# them; the tokenizer still truncates to the exact max length
+_MAX_CHARS_PER_TOKEN = 8
+
+class Reranker:
+    """
+    Batched, cached cross-encoder reranker.
+
+    Each call to score() queues its (query, passage) pairs; a background batcher
+    collects pairs from all concurrent calls for up to max_wait seconds (or until
+    batch_size pairs are queued) and scores them with a single model call.
+    """
+
+    def __init__(
+        self,
+        model_name: str = DEFAULT_RERANKING_MODEL,
+        backend: str = "torch",
+        onnx_file: Optional[str] = None,
+        max_length: int = 512,
+        batch_size: int = 64,
+        max_wait: float = 0.005,
+        cache_size: int = 10000,
+        max_workers: int = 1
+    ):
+        self.model_name = model_name
+        self.backend = backend
+        self.onnx_file = onnx_file
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.cache_size = cache_size
+        self.max_workers = max_workers
+
+        self._model = None
+        self._load_failed = False
+        self._model_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="reranker")
+        self._cache: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._batcher: Optional[asyncio.Task] = None
+        self._batch_tasks = set()
+
+    @classmethod
+    def from_env(cls) -> "Reranker":
+        """
+        Create a reranker configured from the RERANKING_* environment variables.
+
+        Returns:
+            The reranker (the model itself is only loaded on first use)
+        """
+        return cls(
+            model_name=os.getenv("RERANKING_MODEL", DEFAULT_RERANKING_MODEL),
+            backend=os.getenv("RERANKING_BACKEND", "torch"),
+            onnx_file=os.getenv("RERANKING_ONNX_FILE") or None,
+            max_length=int(os.getenv("RERANKING_MAX_LENGTH", "512")),
+            batch_size=int(os.getenv("RERANKING_BATCH_SIZE", "64")),
+            max_wait=float(os.getenv("RERANKING_BATCH_WAIT_MS", "5")) / 1000,
+            cache_size=int(os.getenv("RERANKING_CACHE_SIZE", "10000")),
+            max_workers=int(os.getenv("RERANKING_MAX_WORKERS", "1"))
+        )
+
+    def _load_model(self) -> Any:
+        """Load the cross-encoder on first use, falling back to the torch backend if needed."""
+        with self._model_lock:
+            if self._model is not None or self._load_failed:
+                return self._model
+
+            # Imported here so the server starts without loading torch
+            from sentence_transformers import CrossEncoder
+
+            kwargs = {"max_length": self.max_length}
+            if self.backend != "torch":
+                kwargs["backend"] = self.backend
+                if self.onnx_file:
+                    kwargs["model_kwargs"] = {"file_name": self.onnx_file}
+            try:
+                self._model = CrossEncoder(self.model_name, **kwargs)
+            except Exception as e:
+                if self.backend == "torch":
+                    print(f"Failed to load reranking model: {e}")
+                    self._load_failed = True
+                    return None
+                print(f"Failed to load reranking model with the {self.backend} backend: {e}. Falling back to torch.")
+                try:
+                    self._model = CrossEncoder(self.model_name, max_length=self.max_length)
+                except Exception as e:
+                    print(f"Failed to load reranking model: {e}")
+                    self._load_failed = True
+            return self._model
+
+    def _predict(self, pairs: List[List[str]]) -> List[float]:
+        """Score a batch of (query, passage) pairs with the model."""
+        model = self._load_model()
+        if model is None:
+            raise RuntimeError("Reranking model is not available")
+        scores = model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+        return [float(score) for score in scores]
+
+    def _truncate(self, passage: str) -> str:
+        """Cut a passage to roughly the most the model can attend to."""
+        return passage[:self.max_length * _MAX_CHARS_PER_TOKEN]
+
+    @staticmethod
+    def _hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    async def score(self, query: str, passages: List[str]) -> List[float]:
+        """
+        Score the relevance of passages to a query.
+
+        Args:
+            query: The search query
+            passages: Passages to score
+
+        Returns:
+            Relevance score of each passage
+        """
+        passages = [self._truncate(passage) for passage in passages]
+        # Scores are cached by the exact query the model sees
+        query = normalize_query(query)
+        query_hash = self._hash(query)
+        # Passages are identified by content so chunks updated in place get new scores
+        keys = [(query_hash, self._hash(passage)) for passage in passages]
+
+        scores: List[Optional[float]] = [None] * len(passages)
+        missing = []
+        for i, key in enumerate(keys):
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                scores[i] = self._cache[key]
+            else:
+                missing.append(i)
+
+        if missing:
+            self._ensure_batcher()
+            loop = asyncio.get_running_loop()
+            futures = []
+            for i in missing:
+                future = loop.create_future()
+                await self._queue.put((query, passages[i], future))
+                futures.append(future)
+
+            for i, score in zip(missing, await asyncio.gather(*futures)):
+                scores[i] = score
+                self._cache[keys[i]] = score
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return scores
+
+    def _ensure_batcher(self) -> None:
+        """Start the background batcher on the running event loop."""
+        if self._batcher is None or self._batcher.done():
+            self._queue = asyncio.Queue()
+            self._batcher = asyncio.create_task(self._run_batcher())
+
+    async def _run_batcher(self) -> None:
+        """Collect queued pairs into batches and score them in the thread pool."""
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(self.max_workers)
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            await slots.acquire()
+            task = asyncio.create_task(self._score_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(lambda t: (self._batch_tasks.discard(t), slots.release()))
+
+    async def _score_batch(self, batch: List[Tuple[str, str, asyncio.Future]]) -> None:
+        """Score one batch and resolve the futures of its pairs."""
+        pairs = [[query, passage] for query, passage, _ in batch]
+        try:
+            scores = await asyncio.get_running_loop().run_in_executor(self._executor, self._predict, pairs)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, _, future), score in zip(batch, scores):
+            if not future.done():
+                future.set_result(score)
+
+    async def close(self) -> None:
+        """Stop the batcher and shut down the thread pool."""
+        if self._batcher:
+            self._batcher.cancel()
+            await asyncio.gather(self._batcher, *self._batch_tasks, return_exceptions=True)
+        self._executor.shutdown(wait=False, cancel_futures=True)
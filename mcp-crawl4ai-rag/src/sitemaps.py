@@ -0,0 +1,154 @@
+"""
+Async sitemap discovery for the Crawl4AI MCP server.
+
+Sitemaps are downloaded and parsed incrementally, so page URLs are available while the
+file is still arriving and memory stays flat on sitemaps with hundreds of thousands of
+entries. Sitemap indexes are followed recursively and gzipped sitemaps are decompressed
+on the fly.
+"""
+import os
+import asyncio
+import zlib
+from collections.abc import AsyncIterator
+from typing import Dict, Optional, Tuple
+from xml.etree import ElementTree
+
+import httpx
+
+from crawl_frontier import iter_queue_until_done
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+def _local_name(tag: str) -> str:
+    """Strip the XML namespace from a tag name."""
+    return tag.rsplit("}", 1)[-1]
+
+def _child_text(element: ElementTree.Element, name: str) -> Optional[str]:
+    """Get the stripped text of the first child with the given local name."""
+    for child in element:
+        if _local_name(child.tag) == name:
+            return child.text.strip() if child.text and child.text.strip() else None
+    return None
+
+async def stream_sitemap(client: httpx.AsyncClient, sitemap_url: str) -> AsyncIterator[Tuple[str, Dict[str, Optional[str]]]]:
+    """
+    Download and parse a single sitemap, yielding its entries as they are parsed.
+
+    Both <urlset> sitemaps and <sitemapindex> files are supported. Gzipped sitemaps
+    (e.g. sitemap.xml.gz) are detected from their magic bytes and decompressed while
+    streaming. Parsed elements are discarded as soon as they have been yielded.
+
+    Args:
+        client: HTTP client to download the sitemap with
+        sitemap_url: URL of the sitemap
+
+    Yields:
+        Tuples of ("url" or "sitemap", {'url': <loc>, 'lastmod': <lastmod or None>})
+    """
+    parser = ElementTree.XMLPullParser(events=("start", "end"))
+    decompressor = None
+    root = None
+
+    def parse(data: bytes):
+        nonlocal root
+        parser.feed(data)
+        for event, element in parser.read_events():
+            if event == "start":
+                if root is None:
+                    root = element
+                continue
+            kind = _local_name(element.tag)
+            if kind not in ("url", "sitemap"):
+                continue
+            loc = _child_text(element, "loc")
+            if loc:
+                yield kind, {'url': loc, 'lastmod': _child_text(element, "lastmod")}
+            # Drop the parsed entries so the tree doesn't grow with the sitemap
+            root.clear()
+
+    try:
+        async with client.stream("GET", sitemap_url) as response:
+            if response.status_code != 200:
+                print(f"Failed to fetch sitemap {sitemap_url}: HTTP {response.status_code}")
+                return
+
+            first_chunk = True
+            async for chunk in response.aiter_bytes():
+                if first_chunk:
+                    first_chunk = False
+                    if chunk.startswith(GZIP_MAGIC):
+                        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                if decompressor:
+                    chunk = decompressor.decompress(chunk)
+                for entry in parse(chunk):
+                    yield entry
+
+        if decompressor:
+            for entry in parse(decompressor.flush()):
+                yield entry
+        parser.close()
+    except (httpx.HTTPError, ElementTree.ParseError, zlib.error) as e:
+        print(f"Error parsing sitemap {sitemap_url}: {e}")
+
+async def iter_sitemap_entries(
+    client: httpx.AsyncClient,
+    sitemap_url: str,
+    max_concurrent: Optional[int] = None,
+    max_sitemaps: Optional[int] = None
+) -> AsyncIterator[Dict[str, Optional[str]]]:
+    """
+    Discover the pages listed in a sitemap, following nested sitemap indexes.
+
+    Child sitemaps of an index are fetched concurrently and page entries are yielded as
+    soon as they are parsed, deduplicated across all sitemaps.
+
+    Args:
+        client: HTTP client to download the sitemaps with
+        sitemap_url: URL of the sitemap or sitemap index
+        max_concurrent: Maximum number of sitemaps downloaded at once (default: SITEMAP_MAX_CONCURRENCY or 8)
+        max_sitemaps: Maximum number of sitemap files fetched in total (default: SITEMAP_MAX_FILES or 1000)
+
+    Yields:
+        Dictionaries with the page URL and its <lastmod> value (None if missing)
+    """
+    if max_concurrent is None:
+        max_concurrent = int(os.getenv("SITEMAP_MAX_CONCURRENCY", "8"))
+    if max_sitemaps is None:
+        max_sitemaps = int(os.getenv("SITEMAP_MAX_FILES", "1000"))
+
+    pending: asyncio.Queue = asyncio.Queue()
+    # Bounded so discovery doesn't run arbitrarily far ahead of the crawl
+    results: asyncio.Queue = asyncio.Queue(maxsize=1000)
+    seen_sitemaps = {sitemap_url}
+    seen_urls = set()
+    pending.put_nowait(sitemap_url)
+
+    async def worker() -> None:
+        while True:
+            current = await pending.get()
+            try:
+                async for kind, entry in stream_sitemap(client, current):
+                    if kind == "sitemap":
+                        if entry['url'] not in seen_sitemaps and len(seen_sitemaps) < max_sitemaps:
+                            seen_sitemaps.add(entry['url'])
+                            pending.put_nowait(entry['url'])
+                    elif entry['url'] not in seen_urls:
+                        seen_urls.add(entry['url'])
+                        await results.put(entry)
+            except Exception as e:
+                print(f"Error processing sitemap {current}: {e}")
+            finally:
+                pending.task_done()
+
+    workers = [asyncio.create_task(worker()) for _ in range(max_concurrent)]
+    # Completes once every discovered sitemap has been parsed
+    sitemaps_done = asyncio.create_task(pending.join())
+    try:
+        async for entry in iter_queue_until_done(results, sitemaps_done):
+            yield entry
+    finally:
+        sitemaps_done.cancel()
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, sitemaps_done, return_exceptions=True)
+        print(f"Sitemap discovery: {len(seen_urls)} URLs in {len(seen_sitemaps)} sitemap file(s)")
@@ -0,0 +1,63 @@
+"""
+Shared SQLite plumbing for the local stores of the Crawl4AI MCP server.
+
+The embedding cache, crawl ledger, context and summary caches and crawl job store each
+keep their data in a SQLite file under .cache and open it the same way.
+"""
+import sqlite3
+import threading
+from pathlib import Path
+from typing import List, Sequence, Any
+
+# SQLite limits the number of bound parameters per statement
+SQLITE_MAX_PARAMS = 500
+
+def default_store_path(filename: str) -> str:
+    """
+    Get the default location of a store's database.
+
+    Args:
+        filename: Name of the database file
+
+    Returns:
+        Path of the file in the server's .cache directory
+    """
+    return str(Path(__file__).resolve().parent.parent / ".cache" / filename)
+
+class SQLiteStore:
+    """
+    Base class of the SQLite-backed stores.
+
+    Opens one WAL-mode connection shared by every thread. Subclasses create their
+    tables after calling __init__ and hold self._lock whenever they use self._conn.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+
+    def _select_in(self, query: str, keys: Sequence[Any], params: Sequence[Any] = ()) -> List[Any]:
+        """
+        Run a query matching a column against many keys, a few hundred keys at a time.
+
+        The caller must hold self._lock.
+
+        Args:
+            query: SELECT statement with an "IN ({placeholders})" clause after its other parameters
+            keys: Values to match, duplicates are looked up once
+            params: Values of the parameters that come before the IN clause
+
+        Returns:
+            Rows returned for every key
+        """
+        unique_keys = list(dict.fromkeys(keys))
+        rows = []
+        for i in range(0, len(unique_keys), SQLITE_MAX_PARAMS):
+            chunk = unique_keys[i:i + SQLITE_MAX_PARAMS]
+            placeholders = ",".join("?" * len(chunk))
+            rows.extend(self._conn.execute(query.format(placeholders=placeholders), [*params, *chunk]).fetchall())
+        return rows
@@ -0,0 +1,81 @@
+"""
+Per-call timing of Supabase requests for the Crawl4AI MCP server.
+
+Every PostgREST request made through the shared async client is executed with
+timed_execute, which records its latency and outcome under an operation name so slow
+or failing queries show up in the logs after each crawl.
+"""
+import time
+from typing import Any, Dict
+
+class CallMetrics:
+    """Call counts, error counts and latencies per operation."""
+
+    def __init__(self):
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def record(self, operation: str, seconds: float, ok: bool = True) -> None:
+        """
+        Record one call.
+
+        Args:
+            operation: Name of the operation (e.g. "crawled_pages.upsert")
+            seconds: How long the call took
+            ok: Whether the call succeeded
+        """
+        stats = self._stats.setdefault(operation, {"calls": 0, "errors": 0, "total": 0.0, "max": 0.0})
+        stats["calls"] += 1
+        if not ok:
+            stats["errors"] += 1
+        stats["total"] += seconds
+        stats["max"] = max(stats["max"], seconds)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Get the metrics of every operation.
+
+        Returns:
+            Dictionary mapping each operation to its calls, errors, and average, maximum
+            and total latency in milliseconds
+        """
+        return {
+            operation: {
+                "calls": int(stats["calls"]),
+                "errors": int(stats["errors"]),
+                "avg_ms": round(stats["total"] / stats["calls"] * 1000, 1),
+                "max_ms": round(stats["max"] * 1000, 1),
+                "total_ms": round(stats["total"] * 1000, 1)
+            }
+            for operation, stats in sorted(self._stats.items())
+        }
+
+    def format(self) -> str:
+        """Format the metrics as one line per operation."""
+        return "\n".join(
+            f"  {operation}: {stats['calls']} calls, {stats['errors']} errors, "
+            f"avg {stats['avg_ms']} ms, max {stats['max_ms']} ms"
+            for operation, stats in self.snapshot().items()
+        )
+
+# Shared by every request made by the server
+call_metrics = CallMetrics()
+
+async def timed_execute(operation: str, request: Any) -> Any:
+    """
+    Execute a request built on the async Supabase client and record its timing.
+
+    Args:
+        operation: Name to record the call under
+        request: PostgREST request builder (table query or RPC)
+
+    Returns:
+        The API response
+    """
+    start = time.perf_counter()
+    try:
+        response = await request.execute()
+    except Exception:
+        call_metrics.record(operation, time.perf_counter() - start, ok=False)
+        raise
+    call_metrics.record(operation, time.perf_counter() - start)
+    return response
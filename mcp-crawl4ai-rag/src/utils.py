@@ -2,24 +2,62 @@
 Utility functions for the Crawl4AI MCP server.
 """
 import os
-import concurrent.futures
-from typing import List, Dict, Any, Optional, Tuple
+import asyncio
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Tuple, Callable, Awaitable, Set
 import json
-from supabase import create_client, Client
+import hashlib
+from functools import partial
+from supabase import acreate_client, AsyncClient, AsyncClientOptions
+from postgrest.types import ReturnMethod
 from urllib.parse import urlparse
 import openai
 import re
 import time
 
+from embedding_cache import get_embedding_cache
+from query_embedder import QueryEmbedder
+from contextualizer import Contextualizer, get_context_cache
+from code_summarizer import CodeSummarizer, get_summary_cache
+from markdown_chunker import iter_blocks
+from supabase_metrics import timed_execute
+
 # Load OpenAI API key for embeddings
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
-def get_supabase_client() -> Client:
+# Embedding model configuration
+EMBEDDING_MODEL = "text-embedding-3-small" # Hardcoding embedding model for now, will change this later to be more dynamic
+EMBEDDING_DIMENSIONS = 1536
+
+# OpenAI limits a single embeddings request to 2048 inputs and 300k tokens in total
+EMBEDDING_MAX_INPUTS_PER_REQUEST = 2048
+EMBEDDING_MAX_TOKENS_PER_REQUEST = 300000
+
+# Lazily created async OpenAI client shared by the ingestion pipeline
+_async_openai_client: Optional[openai.AsyncOpenAI] = None
+
+def get_async_openai_client() -> openai.AsyncOpenAI:
     """
-    Get a Supabase client with the URL and key from environment variables.
+    Get the shared async OpenAI client, creating it on first use.
     
     Returns:
-        Supabase client instance
+        AsyncOpenAI client instance
+    """
+    global _async_openai_client
+    if _async_openai_client is None:
+        _async_openai_client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _async_openai_client
+
+async def get_supabase_client() -> AsyncClient:
+    """
+    Get an async Supabase client with the URL and key from environment variables.
+    
+    The client's PostgREST session is created once and keeps its HTTP/2 connections
+    alive, so the server should create one client and share it for all requests.
+    Requests time out after SUPABASE_TIMEOUT_SECONDS.
+    
+    Returns:
+        Async Supabase client instance
     """
     url = os.getenv("SUPABASE_URL")
     key = os.getenv("SUPABASE_SERVICE_KEY")
@@ -27,7 +65,8 @@ def get_supabase_client() -> Client:
     if not url or not key:
         raise ValueError("SUPABASE_URL and SUPABASE_SERVICE_KEY must be set in environment variables")
     
-    return create_client(url, key)
+    options = AsyncClientOptions(postgrest_client_timeout=float(os.getenv("SUPABASE_TIMEOUT_SECONDS", "60")))
+    return await acreate_client(url, key, options=options)
 
 def create_embeddings_batch(texts: List[str]) -> List[List[float]]:
     """
@@ -48,7 +87,7 @@ def create_embeddings_batch(texts: List[str]) -> List[List[float]]:
     for retry in range(max_retries):
         try:
             response = openai.embeddings.create(
-                model="text-embedding-3-small", # Hardcoding embedding model for now, will change this later to be more dynamic
+                model=EMBEDDING_MODEL,
                 input=texts
             )
             return [item.embedding for item in response.data]
@@ -68,7 +107,7 @@ def create_embeddings_batch(texts: List[str]) -> List[List[float]]:
                 for i, text in enumerate(texts):
                     try:
                         individual_response = openai.embeddings.create(
-                            model="text-embedding-3-small",
+                            model=EMBEDDING_MODEL,
                             input=[text]
                         )
                         embeddings.append(individual_response.data[0].embedding)
@@ -76,7 +115,7 @@ def create_embeddings_batch(texts: List[str]) -> List[List[float]]:
                     except Exception as individual_error:
                         print(f"Failed to create embedding for text {i}: {individual_error}")
                         # Add zero embedding as fallback
-                        embeddings.append([0.0] * 1536)
+                        embeddings.append([0.0] * EMBEDDING_DIMENSIONS)
                 
                 print(f"Successfully created {successful_count}/{len(texts)} embeddings individually")
                 return embeddings
@@ -93,89 +132,844 @@ def create_embedding(text: str) -> List[float]:
     """
     try:
         embeddings = create_embeddings_batch([text])
-        return embeddings[0] if embeddings else [0.0] * 1536
+        return embeddings[0] if embeddings else [0.0] * EMBEDDING_DIMENSIONS
     except Exception as e:
         print(f"Error creating embedding: {e}")
         # Return empty embedding if there's an error
-        return [0.0] * 1536
+        return [0.0] * EMBEDDING_DIMENSIONS
 
-def generate_contextual_embedding(full_document: str, chunk: str) -> Tuple[str, bool]:
+async def create_embeddings_batch_async(texts: List[str]) -> List[List[float]]:
     """
-    Generate contextual information for a chunk within a document to improve retrieval.
+    Create embeddings for multiple texts in a single API call without blocking the event loop.
+    
+    Mirrors create_embeddings_batch, including the retry with exponential backoff
+    and the one-by-one fallback, but awaits the async OpenAI client instead.
     
     Args:
-        full_document: The complete document text
-        chunk: The specific chunk of text to generate context for
+        texts: List of texts to create embeddings for
         
     Returns:
-        Tuple containing:
-        - The contextual text that situates the chunk within the document
-        - Boolean indicating if contextual embedding was performed
+        List of embeddings (each embedding is a list of floats)
     """
-    model_choice = os.getenv("MODEL_CHOICE")
+    if not texts:
+        return []
     
-    try:
-        # Create the prompt for generating contextual information
-        prompt = f"""<document> 
-{full_document[:25000]} 
-</document>
-Here is the chunk we want to situate within the whole document 
-<chunk> 
-{chunk}
-</chunk> 
-Please give a short succinct context to situate this chunk within the overall document for the purposes of improving search retrieval of the chunk. Answer only with the succinct context and nothing else."""
-
-        # Call the OpenAI API to generate contextual information
-        response = openai.chat.completions.create(
-            model=model_choice,
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that provides concise contextual information."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.3,
-            max_tokens=200
+    client = get_async_openai_client()
+    max_retries = 3
+    retry_delay = 1.0  # Start with 1 second delay
+    
+    for retry in range(max_retries):
+        try:
+            response = await client.embeddings.create(
+                model=EMBEDDING_MODEL,
+                input=texts
+            )
+            return [item.embedding for item in response.data]
+        except Exception as e:
+            if retry < max_retries - 1:
+                print(f"Error creating batch embeddings (attempt {retry + 1}/{max_retries}): {e}")
+                print(f"Retrying in {retry_delay} seconds...")
+                await asyncio.sleep(retry_delay)
+                retry_delay *= 2  # Exponential backoff
+            else:
+                print(f"Failed to create batch embeddings after {max_retries} attempts: {e}")
+                # Try creating embeddings one by one as fallback
+                print("Attempting to create embeddings individually...")
+                embeddings = []
+                successful_count = 0
+                
+                for i, text in enumerate(texts):
+                    try:
+                        individual_response = await client.embeddings.create(
+                            model=EMBEDDING_MODEL,
+                            input=[text]
+                        )
+                        embeddings.append(individual_response.data[0].embedding)
+                        successful_count += 1
+                    except Exception as individual_error:
+                        print(f"Failed to create embedding for text {i}: {individual_error}")
+                        # Add zero embedding as fallback
+                        embeddings.append([0.0] * EMBEDDING_DIMENSIONS)
+                
+                print(f"Successfully created {successful_count}/{len(texts)} embeddings individually")
+                return embeddings
+
+async def create_embeddings_with_cache(texts: List[str]) -> List[List[float]]:
+    """
+    Create embeddings for multiple texts, reusing cached embeddings where possible.
+    
+    Only texts that aren't in the embedding cache are sent to OpenAI. Successful
+    new embeddings are written back to the cache.
+    
+    Args:
+        texts: List of texts to create embeddings for
+        
+    Returns:
+        List of embeddings in the same order as texts
+    """
+    cache = get_embedding_cache()
+    if cache is None or not texts:
+        return await create_embeddings_batch_async(texts)
+    
+    cached = await asyncio.to_thread(cache.get_many, EMBEDDING_MODEL, texts)
+    missing = [i for i in range(len(texts)) if i not in cached]
+    
+    embeddings = [cached.get(i) for i in range(len(texts))]
+    if missing:
+        new_embeddings = await create_embeddings_batch_async([texts[i] for i in missing])
+        for i, embedding in zip(missing, new_embeddings):
+            embeddings[i] = embedding
+        
+        # Don't cache the zero embeddings used as a fallback for failed requests
+        to_cache = [(texts[i], embedding) for i, embedding in zip(missing, new_embeddings)
+                    if embedding and any(v != 0.0 for v in embedding)]
+        if to_cache:
+            await asyncio.to_thread(
+                cache.put_many,
+                EMBEDDING_MODEL,
+                [text for text, _ in to_cache],
+                [embedding for _, embedding in to_cache]
+            )
+    
+    return embeddings
+
+_contextualizer: Optional[Contextualizer] = None
+
+def get_contextualizer() -> Contextualizer:
+    """
+    Get the shared contextualizer, creating it on first use.
+    
+    It uses MODEL_CHOICE, sends CONTEXTUAL_CHUNKS_PER_REQUEST chunks per request and
+    keeps at most CONTEXTUAL_MAX_CONCURRENCY requests in flight (less while rate limited).
+    
+    Returns:
+        The contextualizer
+    """
+    global _contextualizer
+    if _contextualizer is None:
+        _contextualizer = Contextualizer(
+            get_async_openai_client(),
+            os.getenv("MODEL_CHOICE"),
+            chunks_per_request=int(os.getenv("CONTEXTUAL_CHUNKS_PER_REQUEST", "8")),
+            max_concurrency=int(os.getenv("CONTEXTUAL_MAX_CONCURRENCY", "10")),
+            cache=get_context_cache()
+        )
+    return _contextualizer
+
+_query_embedder: Optional[QueryEmbedder] = None
+
+def get_query_embedder() -> QueryEmbedder:
+    """
+    Get the shared query embedder, creating it on first use.
+    
+    The cache lifetime and size are configured with QUERY_EMBEDDING_CACHE_TTL_SECONDS and
+    QUERY_EMBEDDING_CACHE_SIZE, and batching with QUERY_EMBEDDING_BATCH_SIZE and
+    QUERY_EMBEDDING_BATCH_WAIT_MS.
+    
+    Returns:
+        The query embedder
+    """
+    global _query_embedder
+    if _query_embedder is None:
+        _query_embedder = QueryEmbedder(
+            create_embeddings_batch_async,
+            ttl=float(os.getenv("QUERY_EMBEDDING_CACHE_TTL_SECONDS", "3600")),
+            max_entries=int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "2048")),
+            max_batch_size=int(os.getenv("QUERY_EMBEDDING_BATCH_SIZE", "32")),
+            max_wait=float(os.getenv("QUERY_EMBEDDING_BATCH_WAIT_MS", "10")) / 1000
         )
+    return _query_embedder
+
+async def create_query_embedding(text: str) -> List[float]:
+    """
+    Create an embedding for a search query without blocking the event loop.
+    
+    Repeated queries are served from an in-process cache, identical concurrent
+    queries share one request and distinct concurrent queries are batched.
+    
+    Args:
+        text: Query text
+        
+    Returns:
+        List of floats representing the embedding
+    """
+    try:
+        return await get_query_embedder().embed(text)
+    except Exception as e:
+        print(f"Error creating query embedding: {e}")
+        return [0.0] * EMBEDDING_DIMENSIONS
+
+def estimate_token_count(text: str) -> int:
+    """
+    Cheaply estimate the number of tokens in a text.
+    
+    Uses the common ~4 characters per token heuristic for English text, which
+    is close enough for packing embedding requests under the provider limit.
+    
+    Args:
+        text: Text to estimate
+        
+    Returns:
+        Estimated token count (always at least 1)
+    """
+    return len(text) // 4 + 1
+
+_token_counter: Optional[Callable[[str], int]] = None
+_token_counter_loaded = False
+
+def get_token_counter() -> Optional[Callable[[str], int]]:
+    """
+    Get a function counting tokens with the embedding model's tokenizer.
+
+    Chunks are sized in tokens only when CHUNK_SIZE_UNIT is set to "tokens"; tiktoken
+    is imported on first use.
+
+    Returns:
+        The token counter, or None if chunks are sized in characters or tiktoken isn't available
+    """
+    global _token_counter, _token_counter_loaded
+    if os.getenv("CHUNK_SIZE_UNIT", "characters") != "tokens":
+        return None
+
+    if not _token_counter_loaded:
+        _token_counter_loaded = True
+        try:
+            import tiktoken
+            try:
+                encoding = tiktoken.encoding_for_model(EMBEDDING_MODEL)
+            except KeyError:
+                encoding = tiktoken.get_encoding("cl100k_base")
+            _token_counter = lambda text: len(encoding.encode(text, disallowed_special=()))
+        except Exception as e:
+            print(f"Failed to load the tokenizer for {EMBEDDING_MODEL}: {e}. Sizing chunks in characters instead.")
+    return _token_counter
+
+async def write_batch_with_retry(write: Callable[[List[Dict[str, Any]]], Awaitable[Any]], batch_data: List[Dict[str, Any]]) -> int:
+    """
+    Write a batch of rows to Supabase with retry logic.
+    
+    Falls back to writing records one by one if the batch keeps failing.
+    
+    Args:
+        write: Async function that writes a list of rows
+        batch_data: Rows to write
         
-        # Extract the generated context
-        context = response.choices[0].message.content.strip()
+    Returns:
+        Number of rows that were written
+    """
+    max_retries = 3
+    retry_delay = 1.0  # Start with 1 second delay
+    
+    for retry in range(max_retries):
+        try:
+            await write(batch_data)
+            # Success - break out of retry loop
+            return len(batch_data)
+        except Exception as e:
+            if retry < max_retries - 1:
+                print(f"Error inserting batch into Supabase (attempt {retry + 1}/{max_retries}): {e}")
+                print(f"Retrying in {retry_delay} seconds...")
+                await asyncio.sleep(retry_delay)
+                retry_delay *= 2  # Exponential backoff
+            else:
+                # Final attempt failed
+                print(f"Failed to insert batch after {max_retries} attempts: {e}")
+                # Try inserting records one by one as a last resort
+                print("Attempting to insert records individually...")
+                successful_inserts = 0
+                for record in batch_data:
+                    try:
+                        await write([record])
+                        successful_inserts += 1
+                    except Exception as individual_error:
+                        print(f"Failed to insert individual record for URL {record['url']}: {individual_error}")
+                
+                if successful_inserts > 0:
+                    print(f"Successfully inserted {successful_inserts}/{len(batch_data)} records individually")
+                return successful_inserts
+    return 0
+
+async def insert_batch_with_retry(client: AsyncClient, table: str, batch_data: List[Dict[str, Any]]) -> int:
+    """
+    Insert a batch of rows into a Supabase table with retry logic.
+    
+    Rows are sent as one bulk insert that doesn't echo them back, so large batches
+    (embeddings included) only cost the upload.
+    
+    Args:
+        client: Supabase client
+        table: Name of the table to insert into
+        batch_data: Rows to insert
         
-        # Combine the context with the original chunk
-        contextual_text = f"{context}\n---\n{chunk}"
+    Returns:
+        Number of rows that were inserted
+    """
+    return await write_batch_with_retry(
+        lambda rows: timed_execute(f"{table}.insert", client.table(table).insert(rows, returning=ReturnMethod.minimal)),
+        batch_data
+    )
+
+async def upsert_crawled_pages_with_retry(client: AsyncClient, batch_data: List[Dict[str, Any]]) -> int:
+    """
+    Insert or update crawled_pages rows in place with retry logic.
+    
+    Rows are matched on (url, chunk_number) by the sync_crawled_pages RPC, so
+    existing chunks are overwritten instead of being deleted first.
+    
+    Args:
+        client: Supabase client
+        batch_data: Rows to upsert
         
-        return contextual_text, True
+    Returns:
+        Number of rows that were written
+    """
+    return await write_batch_with_retry(
+        lambda rows: timed_execute("crawled_pages.upsert", client.rpc('sync_crawled_pages', {'chunk_rows': rows})),
+        batch_data
+    )
+
+def compute_chunk_hash(content: str, use_contextual_embeddings: bool) -> str:
+    """
+    Hash a chunk together with the settings that determine its stored embedding.
     
-    except Exception as e:
-        print(f"Error generating contextual embedding: {e}. Using original chunk instead.")
-        return chunk, False
+    Changing the embedding model or toggling contextual embeddings changes the
+    hash, so those chunks are re-embedded on the next crawl.
+    
+    Args:
+        content: Original chunk content
+        use_contextual_embeddings: Whether contextual embeddings are enabled
+        
+    Returns:
+        Hex sha256 digest
+    """
+    key = f"{EMBEDDING_MODEL}:{'contextual' if use_contextual_embeddings else 'plain'}:{content}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
 
-def process_chunk_with_context(args):
+async def get_stored_chunk_hashes(client: AsyncClient, urls: List[str], page_size: int = 1000) -> Dict[Tuple[str, int], Optional[str]]:
     """
-    Process a single chunk with contextual embedding.
-    This function is designed to be used with concurrent.futures.
+    Get the content hash of every stored chunk for a list of URLs.
     
     Args:
-        args: Tuple containing (url, content, full_document)
+        client: Supabase client
+        urls: URLs to look up
+        page_size: Number of rows to fetch per request (PostgREST caps responses at 1000 rows by default)
         
     Returns:
-        Tuple containing:
-        - The contextual text that situates the chunk within the document
-        - Boolean indicating if contextual embedding was performed
+        Dictionary mapping (url, chunk_number) to the stored content hash
+    """
+    hashes = {}
+    # Keep the URL list short enough for the request query string
+    for i in range(0, len(urls), 50):
+        url_batch = urls[i:i + 50]
+        offset = 0
+        while True:
+            try:
+                result = await timed_execute(
+                    "crawled_pages.select_hashes",
+                    client.table("crawled_pages")
+                        .select("url, chunk_number, content_hash")
+                        .in_("url", url_batch)
+                        .order("id")
+                        .range(offset, offset + page_size - 1)
+                )
+            except Exception as e:
+                print(f"Error fetching stored chunk hashes: {e}")
+                break
+            for row in result.data:
+                hashes[(row["url"], row["chunk_number"])] = row.get("content_hash")
+            if len(result.data) < page_size:
+                break
+            offset += page_size
+    return hashes
+
+@dataclass
+class IngestionItem:
+    """A single row travelling through the ingestion pipeline."""
+    row: Dict[str, Any]
+    text: str  # The text that gets embedded
+    full_document: Optional[str] = None  # Only needed for contextual embeddings
+
+class IngestionPipeline:
+    """
+    Bounded asyncio pipeline that contextualizes, embeds and inserts rows.
+    
+    Items flow through three stages connected by bounded queues, so producers get
+    backpressure instead of buffering everything in memory:
+    
+    1. contextualize: optional LLM calls that situate each chunk in its document,
+       batching many chunks of the same document per request
+    2. embed: items are packed into requests up to the provider's token and input
+       limits, with a configurable number of requests in flight
+    3. insert: rows are written to Supabase by several concurrent inserters, using
+       plain inserts unless a different writer is given
+    
+    Rows that can't be embedded, or whose write raises, are counted in rows_failed
+    and passed to on_rows_failed when it is given; the workers carry on with the
+    next batch.
+    
+    Usage:
+        async with IngestionPipeline(client, "crawled_pages") as pipeline:
+            await pipeline.put(IngestionItem(row=row, text=content))
+            await pipeline.put_document(items_of_one_document)
+    """
+    
+    def __init__(
+        self,
+        client: AsyncClient,
+        table: str,
+        use_contextual_embeddings: bool = False,
+        contextual_concurrency: Optional[int] = None,
+        embedding_concurrency: Optional[int] = None,
+        insert_concurrency: Optional[int] = None,
+        insert_batch_size: Optional[int] = None,
+        max_batch_tokens: Optional[int] = None,
+        queue_size: Optional[int] = None,
+        writer: Optional[Callable[[List[Dict[str, Any]]], Awaitable[int]]] = None,
+        on_rows_failed: Optional[Callable[[List[Dict[str, Any]]], None]] = None
+    ):
+        self.client = client
+        self.table = table
+        self.writer = writer or partial(insert_batch_with_retry, client, table)
+        self.on_rows_failed = on_rows_failed
+        self.use_contextual_embeddings = use_contextual_embeddings
+        self.contextual_concurrency = contextual_concurrency or int(os.getenv("CONTEXTUAL_MAX_CONCURRENCY", "10"))
+        self.embedding_concurrency = embedding_concurrency or int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))
+        self.insert_concurrency = insert_concurrency or int(os.getenv("INSERT_MAX_CONCURRENCY", "4"))
+        self.insert_batch_size = insert_batch_size or int(os.getenv("INSERT_BATCH_SIZE", "100"))
+        self.max_batch_tokens = min(
+            max_batch_tokens or int(os.getenv("EMBEDDING_MAX_BATCH_TOKENS", "100000")),
+            EMBEDDING_MAX_TOKENS_PER_REQUEST
+        )
+        self.flush_interval = float(os.getenv("EMBEDDING_BATCH_FLUSH_SECONDS", "0.5"))
+        queue_size = queue_size or int(os.getenv("INGESTION_QUEUE_SIZE", "1000"))
+        
+        self._context_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._pack_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._embed_queue: asyncio.Queue = asyncio.Queue(maxsize=self.embedding_concurrency * 2)
+        self._insert_queue: asyncio.Queue = asyncio.Queue(maxsize=self.insert_concurrency * 2)
+        
+        # Shared by every pipeline so rate limits are tracked across the whole crawl
+        self.contextualizer = get_contextualizer() if use_contextual_embeddings else None
+        
+        self._context_workers: List[asyncio.Task] = []
+        self._packer: Optional[asyncio.Task] = None
+        self._embed_workers: List[asyncio.Task] = []
+        self._insert_workers: List[asyncio.Task] = []
+        
+        self.items_received = 0
+        self.rows_inserted = 0
+        self.rows_failed = 0
+        self.embedding_batches = 0
+    
+    async def __aenter__(self) -> "IngestionPipeline":
+        self.start()
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            await self.close()
+        else:
+            self.cancel()
+    
+    def start(self) -> None:
+        """Start the worker tasks for every stage."""
+        if self.use_contextual_embeddings:
+            self._context_workers = [
+                asyncio.create_task(self._context_worker()) for _ in range(self.contextual_concurrency)
+            ]
+        self._packer = asyncio.create_task(self._pack_worker())
+        self._embed_workers = [
+            asyncio.create_task(self._embed_worker()) for _ in range(self.embedding_concurrency)
+        ]
+        self._insert_workers = [
+            asyncio.create_task(self._insert_worker()) for _ in range(self.insert_concurrency)
+        ]
+    
+    async def put(self, item: IngestionItem) -> None:
+        """
+        Submit an item to the pipeline, waiting if the first stage is full.
+        
+        Args:
+            item: The row and the text to embed for it
+        """
+        await self.put_document([item])
+    
+    async def put_document(self, items: List[IngestionItem]) -> None:
+        """
+        Submit the items of one document together, so they are contextualized together.
+        
+        Args:
+            items: Items that share the same full_document
+        """
+        if not items:
+            return
+        self.items_received += len(items)
+        if self.use_contextual_embeddings and items[0].full_document:
+            await self._context_queue.put(items)
+        else:
+            for item in items:
+                await self._pack_queue.put(item)
+    
+    async def close(self) -> None:
+        """Flush all queued items through every stage and wait for the workers to finish."""
+        # Each stage is shut down once the previous one has fully drained
+        for _ in self._context_workers:
+            await self._context_queue.put(None)
+        await asyncio.gather(*self._context_workers)
+        
+        await self._pack_queue.put(None)
+        await self._packer
+        
+        for _ in self._embed_workers:
+            await self._embed_queue.put(None)
+        await asyncio.gather(*self._embed_workers)
+        
+        for _ in self._insert_workers:
+            await self._insert_queue.put(None)
+        await asyncio.gather(*self._insert_workers)
+    
+    def cancel(self) -> None:
+        """Cancel all worker tasks without flushing pending items."""
+        tasks = self._context_workers + self._embed_workers + self._insert_workers
+        if self._packer:
+            tasks.append(self._packer)
+        for task in tasks:
+            task.cancel()
+    
+    async def _context_worker(self) -> None:
+        while True:
+            items = await self._context_queue.get()
+            if items is None:
+                break
+            try:
+                contexts = await self.contextualizer.contextualize(items[0].full_document, [item.text for item in items])
+            except Exception as e:
+                # Use original content as fallback
+                print(f"Error processing chunks of {items[0].row.get('url')}: {e}")
+                contexts = [None] * len(items)
+            for item, context in zip(items, contexts):
+                if context:
+                    contextual_text = f"{context}\n---\n{item.text}"
+                    item.text = contextual_text
+                    item.row["content"] = contextual_text
+                    item.row["metadata"]["chunk_size"] = len(contextual_text)
+                    item.row["metadata"]["contextual_embedding"] = True
+                await self._pack_queue.put(item)
+    
+    async def _pack_worker(self) -> None:
+        """Pack items into embedding requests up to the token and input limits."""
+        batch: List[IngestionItem] = []
+        batch_tokens = 0
+        while True:
+            try:
+                item = await asyncio.wait_for(
+                    self._pack_queue.get(),
+                    timeout=self.flush_interval if batch else None
+                )
+            except asyncio.TimeoutError:
+                # Nothing new arrived for a while, so don't hold a partial batch back
+                await self._embed_queue.put(batch)
+                batch, batch_tokens = [], 0
+                continue
+            if item is None:
+                break
+            tokens = estimate_token_count(item.text)
+            if batch and (batch_tokens + tokens > self.max_batch_tokens
+                          or len(batch) >= EMBEDDING_MAX_INPUTS_PER_REQUEST):
+                await self._embed_queue.put(batch)
+                batch, batch_tokens = [], 0
+            batch.append(item)
+            batch_tokens += tokens
+        if batch:
+            await self._embed_queue.put(batch)
+    
+    async def _embed_worker(self) -> None:
+        while True:
+            batch = await self._embed_queue.get()
+            if batch is None:
+                break
+            self.embedding_batches += 1
+            try:
+                embeddings = await create_embeddings_with_cache([item.text for item in batch])
+                
+                # Give zero embeddings (failed requests) one more individual attempt
+                for i, embedding in enumerate(embeddings):
+                    if not embedding or all(v == 0.0 for v in embedding):
+                        print("Warning: Zero or invalid embedding detected, creating new one...")
+                        retried = await create_embeddings_batch_async([batch[i].text])
+                        if retried:
+                            embeddings[i] = retried[0]
+            except Exception as e:
+                # Keep the worker alive, or the queues feeding it would fill up and block
+                self._fail_rows([item.row for item in batch], f"error creating embeddings: {e}")
+                continue
+            
+            rows = []
+            failed_rows = []
+            for item, embedding in zip(batch, embeddings):
+                # A zero vector never matches a search, so don't store it as if it were indexed
+                if not embedding or all(v == 0.0 for v in embedding):
+                    failed_rows.append(item.row)
+                    continue
+                item.row["embedding"] = embedding
+                rows.append(item.row)
+            if failed_rows:
+                self._fail_rows(failed_rows, "no embedding could be created")
+            
+            for i in range(0, len(rows), self.insert_batch_size):
+                await self._insert_queue.put(rows[i:i + self.insert_batch_size])
+    
+    async def _insert_worker(self) -> None:
+        while True:
+            rows = await self._insert_queue.get()
+            if rows is None:
+                break
+            try:
+                inserted = await self.writer(rows)
+            except Exception as e:
+                self._fail_rows(rows, f"error writing rows: {e}")
+                continue
+            self.rows_inserted += inserted
+    
+    def _fail_rows(self, rows: List[Dict[str, Any]], reason: str) -> None:
+        """Count rows that won't be written and report them to on_rows_failed."""
+        print(f"Skipping {len(rows)} rows of {self.table}: {reason}")
+        self.rows_failed += len(rows)
+        if self.on_rows_failed:
+            self.on_rows_failed(rows)
+
+class DocumentIndexer:
     """
-    url, content, full_document = args
-    return generate_contextual_embedding(full_document, content)
+    Diffs crawled pages against their stored chunks and feeds the changed chunks
+    into a single ingestion pipeline shared by the whole crawl.
+    
+    Pages can be added one at a time as they are crawled. add_page waits when too
+    many pages are pending, so memory is bounded by the in-flight window instead of
+    the size of the site. Unchanged chunks are skipped, changed and new chunks are
+    upserted in place, and trailing chunks of pages that got shorter are deleted
+    when the indexer is closed, so pages never disappear from search while they
+    are being rewritten.
+    
+    When on_page_stored is given, it is called with the URL of each page once all of
+    its changed chunks have been written (immediately for pages with no changes).
+    When a chunk can't be embedded, or a write batch can't be stored completely,
+    every page with rows affected is reported to on_page_failed instead and is never
+    reported as stored. Its chunks keep their old content hash (or have none), so
+    the next crawl embeds them again.
+    
+    Usage:
+        async with DocumentIndexer(client) as indexer:
+            await indexer.add_page(url, chunk_numbers, contents, metadatas, markdown)
+    """
+    
+    # Pages whose stored hashes are fetched in one request
+    DIFF_BATCH_PAGES = 50
+    
+    def __init__(
+        self,
+        client: AsyncClient,
+        batch_size: Optional[int] = None,
+        max_pending_pages: Optional[int] = None,
+        diff_concurrency: int = 4,
+        on_page_stored: Optional[Callable[[str], None]] = None,
+        on_page_failed: Optional[Callable[[str], None]] = None
+    ):
+        self.client = client
+        self.on_page_stored = on_page_stored
+        self.on_page_failed = on_page_failed
+        self.use_contextual_embeddings = os.getenv("USE_CONTEXTUAL_EMBEDDINGS", "false") == "true"
+        self.pipeline = IngestionPipeline(
+            client,
+            "crawled_pages",
+            use_contextual_embeddings=self.use_contextual_embeddings,
+            insert_batch_size=batch_size,
+            writer=self._write_rows,
+            on_rows_failed=self._fail_rows
+        )
+        # Number of changed chunks of each page that haven't been written yet
+        self._unwritten: Dict[str, int] = {}
+        # Pages with rows that couldn't be written
+        self._failed_pages: Set[str] = set()
+        self._page_queue: asyncio.Queue = asyncio.Queue(
+            maxsize=max_pending_pages or int(os.getenv("INDEXING_MAX_PENDING_PAGES", "50"))
+        )
+        self._diff_concurrency = diff_concurrency
+        self._workers: List[asyncio.Task] = []
+        
+        self.pages_indexed = 0
+        self.pages_failed = 0
+        self.unchanged_count = 0
+        self._context_counts = (0, 0)
+        # Pages with stored chunks past their new end, mapped to their new chunk count
+        self._stale_pages: Dict[str, int] = {}
+        self.stale_count = 0
+    
+    async def __aenter__(self) -> "DocumentIndexer":
+        print(f"\n\nUse contextual embeddings: {self.use_contextual_embeddings}\n\n")
+        if self.pipeline.contextualizer:
+            # The contextualizer is shared, so only report what this indexer added to its counters
+            self._context_counts = (self.pipeline.contextualizer.requests, self.pipeline.contextualizer.cache_hits)
+        self.pipeline.start()
+        self._workers = [asyncio.create_task(self._diff_worker()) for _ in range(self._diff_concurrency)]
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            await self.close()
+        else:
+            for worker in self._workers:
+                worker.cancel()
+            self.pipeline.cancel()
+    
+    async def add_page(
+        self,
+        url: str,
+        chunk_numbers: List[int],
+        contents: List[str],
+        metadatas: List[Dict[str, Any]],
+        full_document: str
+    ) -> None:
+        """
+        Queue the chunks of a crawled page for indexing.
+        
+        Args:
+            url: URL of the page
+            chunk_numbers: Chunk number of each chunk
+            contents: Content of each chunk
+            metadatas: Metadata of each chunk
+            full_document: Full markdown of the page, used for contextual embeddings
+        """
+        await self._page_queue.put((url, chunk_numbers, contents, metadatas, full_document))
+    
+    async def close(self) -> None:
+        """Index all queued pages and delete trailing chunks of pages that got shorter."""
+        for _ in self._workers:
+            await self._page_queue.put(None)
+        await asyncio.gather(*self._workers)
+        await self.pipeline.close()
+        
+        if self._stale_pages:
+            await delete_trailing_chunks(self.client, self._stale_pages)
+        
+        print(f"Upserted {self.pipeline.rows_inserted}/{self.pipeline.items_received} changed chunks from {self.pages_indexed} pages "
+              f"in {self.pipeline.embedding_batches} embedding batches ({self.unchanged_count} unchanged, {self.stale_count} removed, "
+              f"{self.pages_failed} pages failed)")
+        if self.pipeline.contextualizer:
+            contextualizer = self.pipeline.contextualizer
+            requests, cache_hits = self._context_counts
+            print(f"Contextual embeddings: {contextualizer.requests - requests} LLM requests, "
+                  f"{contextualizer.cache_hits - cache_hits} contexts from cache, concurrency limit {contextualizer.limiter.limit}")
+        print_embedding_cache_stats()
+    
+    async def _write_rows(self, rows: List[Dict[str, Any]]) -> int:
+        written = await upsert_crawled_pages_with_retry(self.client, rows)
+        if written < len(rows):
+            # A short count doesn't say which rows were lost, so every page in the batch failed
+            self._fail_rows(rows)
+            return written
+        for row in rows:
+            url = row["url"]
+            if url in self._failed_pages:
+                continue
+            self._unwritten[url] -= 1
+            if not self._unwritten[url]:
+                del self._unwritten[url]
+                if self.on_page_stored:
+                    self.on_page_stored(url)
+        return written
+    
+    def _fail_rows(self, rows: List[Dict[str, Any]]) -> None:
+        """Mark the pages of rows that weren't written as failed."""
+        for row in rows:
+            url = row["url"]
+            if url in self._failed_pages:
+                continue
+            self._failed_pages.add(url)
+            self._unwritten.pop(url, None)
+            self.pages_failed += 1
+            if self.on_page_failed:
+                self.on_page_failed(url)
+    
+    async def _diff_worker(self) -> None:
+        done = False
+        while not done:
+            page = await self._page_queue.get()
+            if page is None:
+                break
+            
+            # Grab whatever else is already waiting so one request covers many pages
+            pages = [page]
+            while len(pages) < self.DIFF_BATCH_PAGES and not self._page_queue.empty():
+                page = self._page_queue.get_nowait()
+                if page is None:
+                    done = True
+                    break
+                pages.append(page)
+            
+            stored_hashes = await get_stored_chunk_hashes(self.client, [p[0] for p in pages])
+            for url, chunk_numbers, contents, metadatas, full_document in pages:
+                await self._diff_page(url, chunk_numbers, contents, metadatas, full_document, stored_hashes)
+    
+    async def _diff_page(
+        self,
+        url: str,
+        chunk_numbers: List[int],
+        contents: List[str],
+        metadatas: List[Dict[str, Any]],
+        full_document: str,
+        stored_hashes: Dict[Tuple[str, int], Optional[str]]
+    ) -> None:
+        # Extract source_id from URL
+        parsed_url = urlparse(url)
+        source_id = parsed_url.netloc or parsed_url.path
+        
+        items = []
+        for chunk_number, content, metadata in zip(chunk_numbers, contents, metadatas):
+            content_hash = compute_chunk_hash(content, self.use_contextual_embeddings)
+            if stored_hashes.get((url, chunk_number)) == content_hash:
+                self.unchanged_count += 1
+                continue
+            
+            row = {
+                "url": url,
+                "chunk_number": chunk_number,
+                "content": content,
+                "content_hash": content_hash,
+                "metadata": {
+                    "chunk_size": len(content),
+                    **metadata
+                },
+                "source_id": source_id
+            }
+            items.append(IngestionItem(row=row, text=content, full_document=full_document))
+        if items:
+            self._unwritten[url] = self._unwritten.get(url, 0) + len(items)
+            await self.pipeline.put_document(items)
+        elif self.on_page_stored:
+            self.on_page_stored(url)
+        
+        chunk_count = max(chunk_numbers, default=-1) + 1
+        stale = sum(1 for stored_url, chunk_number in stored_hashes
+                    if stored_url == url and chunk_number >= chunk_count)
+        if stale:
+            self._stale_pages[url] = chunk_count
+            self.stale_count += stale
+        self.pages_indexed += 1
 
-def add_documents_to_supabase(
-    client: Client, 
+async def add_documents_to_supabase(
+    client: AsyncClient, 
     urls: List[str], 
     chunk_numbers: List[int],
     contents: List[str], 
     metadatas: List[Dict[str, Any]],
     url_to_full_document: Dict[str, str],
-    batch_size: int = 20
+    batch_size: Optional[int] = None
 ) -> None:
     """
-    Add documents to the Supabase crawled_pages table in batches.
-    Deletes existing records with the same URLs before inserting to prevent duplicates.
+    Add documents to the Supabase crawled_pages table through a DocumentIndexer.
+    
+    Chunks are diffed against the stored (url, chunk_number, content_hash) rows, so only
+    changed and new chunks are embedded and written.
     
     Args:
         client: Supabase client
@@ -184,138 +978,64 @@ def add_documents_to_supabase(
         contents: List of document contents
         metadatas: List of document metadata
         url_to_full_document: Dictionary mapping URLs to their full document content
-        batch_size: Size of each batch for insertion
+        batch_size: Rows per insert request (default: INSERT_BATCH_SIZE)
     """
-    # Get unique URLs to delete existing records
-    unique_urls = list(set(urls))
+    # Group the chunks by page
+    pages: Dict[str, Tuple[List[int], List[str], List[Dict[str, Any]]]] = {}
+    for url, chunk_number, content, metadata in zip(urls, chunk_numbers, contents, metadatas):
+        page = pages.setdefault(url, ([], [], []))
+        page[0].append(chunk_number)
+        page[1].append(content)
+        page[2].append(metadata)
+    
+    async with DocumentIndexer(client, batch_size=batch_size) as indexer:
+        for url, (page_chunk_numbers, page_contents, page_metadatas) in pages.items():
+            await indexer.add_page(url, page_chunk_numbers, page_contents, page_metadatas, url_to_full_document.get(url, ""))
+
+async def delete_trailing_chunks(client: AsyncClient, page_chunk_counts: Dict[str, int]) -> None:
+    """
+    Delete stored chunks whose chunk_number is past the new end of their page.
     
-    # Delete existing records for these URLs in a single operation
+    Args:
+        client: Supabase client
+        page_chunk_counts: Mapping of URL to its new number of chunks
+    """
     try:
-        if unique_urls:
-            # Use the .in_() filter to delete all records with matching URLs
-            client.table("crawled_pages").delete().in_("url", unique_urls).execute()
+        await timed_execute("crawled_pages.delete_trailing", client.rpc('sync_crawled_pages', {'page_chunk_counts': page_chunk_counts}))
+    except Exception as e:
+        print(f"Error deleting trailing chunks: {e}")
+
+def print_embedding_cache_stats() -> None:
+    """Print the embedding cache hit/miss counters if the cache is enabled."""
+    cache = get_embedding_cache()
+    if cache is not None:
+        stats = cache.stats()
+        print(f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses, {stats['size_bytes'] / (1024 * 1024):.1f} MB")
+
+async def delete_existing_records(client: AsyncClient, table: str, urls: List[str]) -> None:
+    """
+    Delete all rows for the given URLs from a table.
+    
+    Args:
+        client: Supabase client
+        table: Name of the table to delete from
+        urls: URLs whose rows should be removed
+    """
+    try:
+        # Use the .in_() filter to delete all records with matching URLs
+        await timed_execute(f"{table}.delete", client.table(table).delete(returning=ReturnMethod.minimal).in_("url", urls))
     except Exception as e:
         print(f"Batch delete failed: {e}. Trying one-by-one deletion as fallback.")
         # Fallback: delete records one by one
-        for url in unique_urls:
+        for url in urls:
             try:
-                client.table("crawled_pages").delete().eq("url", url).execute()
+                await timed_execute(f"{table}.delete", client.table(table).delete(returning=ReturnMethod.minimal).eq("url", url))
             except Exception as inner_e:
                 print(f"Error deleting record for URL {url}: {inner_e}")
                 # Continue with the next URL even if one fails
-    
-    # Check if MODEL_CHOICE is set for contextual embeddings
-    use_contextual_embeddings = os.getenv("USE_CONTEXTUAL_EMBEDDINGS", "false") == "true"
-    print(f"\n\nUse contextual embeddings: {use_contextual_embeddings}\n\n")
-    
-    # Process in batches to avoid memory issues
-    for i in range(0, len(contents), batch_size):
-        batch_end = min(i + batch_size, len(contents))
-        
-        # Get batch slices
-        batch_urls = urls[i:batch_end]
-        batch_chunk_numbers = chunk_numbers[i:batch_end]
-        batch_contents = contents[i:batch_end]
-        batch_metadatas = metadatas[i:batch_end]
-        
-        # Apply contextual embedding to each chunk if MODEL_CHOICE is set
-        if use_contextual_embeddings:
-            # Prepare arguments for parallel processing
-            process_args = []
-            for j, content in enumerate(batch_contents):
-                url = batch_urls[j]
-                full_document = url_to_full_document.get(url, "")
-                process_args.append((url, content, full_document))
-            
-            # Process in parallel using ThreadPoolExecutor
-            contextual_contents = []
-            with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-                # Submit all tasks and collect results
-                future_to_idx = {executor.submit(process_chunk_with_context, arg): idx 
-                                for idx, arg in enumerate(process_args)}
-                
-                # Process results as they complete
-                for future in concurrent.futures.as_completed(future_to_idx):
-                    idx = future_to_idx[future]
-                    try:
-                        result, success = future.result()
-                        contextual_contents.append(result)
-                        if success:
-                            batch_metadatas[idx]["contextual_embedding"] = True
-                    except Exception as e:
-                        print(f"Error processing chunk {idx}: {e}")
-                        # Use original content as fallback
-                        contextual_contents.append(batch_contents[idx])
-            
-            # Sort results back into original order if needed
-            if len(contextual_contents) != len(batch_contents):
-                print(f"Warning: Expected {len(batch_contents)} results but got {len(contextual_contents)}")
-                # Use original contents as fallback
-                contextual_contents = batch_contents
-        else:
-            # If not using contextual embeddings, use original contents
-            contextual_contents = batch_contents
-        
-        # Create embeddings for the entire batch at once
-        batch_embeddings = create_embeddings_batch(contextual_contents)
-        
-        batch_data = []
-        for j in range(len(contextual_contents)):
-            # Extract metadata fields
-            chunk_size = len(contextual_contents[j])
-            
-            # Extract source_id from URL
-            parsed_url = urlparse(batch_urls[j])
-            source_id = parsed_url.netloc or parsed_url.path
-            
-            # Prepare data for insertion
-            data = {
-                "url": batch_urls[j],
-                "chunk_number": batch_chunk_numbers[j],
-                "content": contextual_contents[j],  # Store original content
-                "metadata": {
-                    "chunk_size": chunk_size,
-                    **batch_metadatas[j]
-                },
-                "source_id": source_id,  # Add source_id field
-                "embedding": batch_embeddings[j]  # Use embedding from contextual content
-            }
-            
-            batch_data.append(data)
-        
-        # Insert batch into Supabase with retry logic
-        max_retries = 3
-        retry_delay = 1.0  # Start with 1 second delay
-        
-        for retry in range(max_retries):
-            try:
-                client.table("crawled_pages").insert(batch_data).execute()
-                # Success - break out of retry loop
-                break
-            except Exception as e:
-                if retry < max_retries - 1:
-                    print(f"Error inserting batch into Supabase (attempt {retry + 1}/{max_retries}): {e}")
-                    print(f"Retrying in {retry_delay} seconds...")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # Exponential backoff
-                else:
-                    # Final attempt failed
-                    print(f"Failed to insert batch after {max_retries} attempts: {e}")
-                    # Optionally, try inserting records one by one as a last resort
-                    print("Attempting to insert records individually...")
-                    successful_inserts = 0
-                    for record in batch_data:
-                        try:
-                            client.table("crawled_pages").insert(record).execute()
-                            successful_inserts += 1
-                        except Exception as individual_error:
-                            print(f"Failed to insert individual record for URL {record['url']}: {individual_error}")
-                    
-                    if successful_inserts > 0:
-                        print(f"Successfully inserted {successful_inserts}/{len(batch_data)} records individually")
-
-def search_documents(
-    client: Client, 
+
+async def search_documents(
+    client: AsyncClient, 
     query: str, 
     match_count: int = 10, 
     filter_metadata: Optional[Dict[str, Any]] = None
@@ -333,7 +1053,7 @@ def search_documents(
         List of matching documents
     """
     # Create embedding for the query
-    query_embedding = create_embedding(query)
+    query_embedding = await create_query_embedding(query)
     
     # Execute the search using the match_crawled_pages function
     try:
@@ -347,155 +1067,154 @@ def search_documents(
         if filter_metadata:
             params['filter'] = filter_metadata  # Pass the dictionary directly, not JSON-encoded
         
-        result = client.rpc('match_crawled_pages', params).execute()
+        result = await timed_execute("crawled_pages.match", client.rpc('match_crawled_pages', params))
         
         return result.data
     except Exception as e:
         print(f"Error searching documents: {e}")
         return []
 
+def get_hybrid_search_weights() -> Dict[str, Any]:
+    """
+    Get the reciprocal rank fusion parameters for hybrid search from the environment.
+    
+    Returns:
+        Dictionary with the full_text_weight, semantic_weight and rrf_k RPC parameters
+    """
+    return {
+        'full_text_weight': float(os.getenv("HYBRID_FULL_TEXT_WEIGHT", "1.0")),
+        'semantic_weight': float(os.getenv("HYBRID_SEMANTIC_WEIGHT", "1.0")),
+        'rrf_k': int(os.getenv("HYBRID_RRF_K", "50"))
+    }
+
+async def hybrid_search_documents(
+    client: AsyncClient, 
+    query: str, 
+    match_count: int = 10, 
+    filter_metadata: Optional[Dict[str, Any]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Search for documents in Supabase combining full-text and vector similarity search.
+    
+    Both searches run in a single RPC and are merged server-side with reciprocal
+    rank fusion, so results come back already ranked.
+    
+    Args:
+        client: Supabase client
+        query: Query text
+        match_count: Maximum number of results to return
+        filter_metadata: Optional metadata filter
+        
+    Returns:
+        List of matching documents
+    """
+    # Create embedding for the query
+    query_embedding = await create_query_embedding(query)
+    
+    try:
+        params = {
+            'query_text': query,
+            'query_embedding': query_embedding,
+            'match_count': match_count,
+            **get_hybrid_search_weights()
+        }
+        if filter_metadata:
+            params['filter'] = filter_metadata
+        
+        result = await timed_execute("crawled_pages.hybrid_search", client.rpc('hybrid_search_crawled_pages', params))
+        
+        return result.data
+    except Exception as e:
+        print(f"Error in hybrid document search: {e}")
+        return []
+
 
-def extract_code_blocks(markdown_content: str, min_length: int = 1000) -> List[Dict[str, Any]]:
+def extract_code_blocks(markdown_content: str, min_length: int = 1000, context_chars: int = 500) -> List[Dict[str, Any]]:
     """
-    Extract code blocks from markdown content along with context.
+    Extract fenced code blocks from markdown content along with context.
+    
+    The markdown is scanned once with the same block parser the chunker uses, so only
+    real fences (``` or ~~~ at the start of a line, closed by a matching fence) count
+    and backticks inside code or prose can't throw the pairing off.
     
     Args:
         markdown_content: The markdown content to extract code blocks from
         min_length: Minimum length of code blocks to extract (default: 1000 characters)
+        context_chars: Characters of text kept before and after each block (default: 500)
         
     Returns:
         List of dictionaries containing code blocks and their context
     """
     code_blocks = []
-    
-    # Skip if content starts with triple backticks (edge case for files wrapped in backticks)
-    content = markdown_content.strip()
-    start_offset = 0
-    if content.startswith('```'):
-        # Skip the first triple backticks
-        start_offset = 3
-        print("Skipping initial triple backticks")
-    
-    # Find all occurrences of triple backticks
-    backtick_positions = []
-    pos = start_offset
-    while True:
-        pos = markdown_content.find('```', pos)
-        if pos == -1:
-            break
-        backtick_positions.append(pos)
-        pos += 3
-    
-    # Process pairs of backticks
-    i = 0
-    while i < len(backtick_positions) - 1:
-        start_pos = backtick_positions[i]
-        end_pos = backtick_positions[i + 1]
-        
-        # Extract the content between backticks
-        code_section = markdown_content[start_pos+3:end_pos]
-        
-        # Check if there's a language specifier on the first line
-        lines = code_section.split('\n', 1)
-        if len(lines) > 1:
-            # Check if first line is a language specifier (no spaces, common language names)
-            first_line = lines[0].strip()
-            if first_line and not ' ' in first_line and len(first_line) < 20:
-                language = first_line
-                code_content = lines[1].strip() if len(lines) > 1 else ""
-            else:
-                language = ""
-                code_content = code_section.strip()
-        else:
-            language = ""
-            code_content = code_section.strip()
+    position = 0
+    for block in iter_blocks(markdown_content):
+        start = position + len(block.gap)
+        position = start + len(block.text)
+        if block.kind != "fence":
+            continue
+        
+        opener, _, body = block.text.partition("\n")
+        fence = opener.strip()
+        fence = fence[:len(fence) - len(fence.lstrip(fence[0]))]
+        info = opener.strip()[len(fence):].split()
+        language = info[0] if info else ""
+        
+        # Drop the closing fence, if the block has one
+        body_lines = body.rstrip("\n").split("\n")
+        if len(body_lines) > 1 or body_lines[0].strip():
+            last = body_lines[-1].strip()
+            if last.startswith(fence) and not last.lstrip(fence[0]):
+                body_lines.pop()
+        code_content = "\n".join(body_lines).strip()
         
         # Skip if code block is too short
         if len(code_content) < min_length:
-            i += 2  # Move to next pair
             continue
         
-        # Extract context before (1000 chars)
-        context_start = max(0, start_pos - 1000)
-        context_before = markdown_content[context_start:start_pos].strip()
-        
-        # Extract context after (1000 chars)
-        context_end = min(len(markdown_content), end_pos + 3 + 1000)
-        context_after = markdown_content[end_pos + 3:context_end].strip()
-        
         code_blocks.append({
             'code': code_content,
             'language': language,
-            'context_before': context_before,
-            'context_after': context_after,
-            'full_context': f"{context_before}\n\n{code_content}\n\n{context_after}"
+            'context_before': markdown_content[max(0, start - context_chars):start].strip(),
+            'context_after': markdown_content[position:position + context_chars].strip()
         })
-        
-        # Move to next pair (skip the closing backtick we just processed)
-        i += 2
     
     return code_blocks
 
 
-def generate_code_example_summary(code: str, context_before: str, context_after: str) -> str:
+_code_summarizer: Optional[CodeSummarizer] = None
+
+def get_code_summarizer() -> CodeSummarizer:
     """
-    Generate a summary for a code example using its surrounding context.
+    Get the shared code example summarizer, creating it on first use.
+    
+    It uses MODEL_CHOICE and keeps at most CODE_SUMMARY_MAX_CONCURRENCY requests in
+    flight across the whole crawl (less while rate limited).
     
-    Args:
-        code: The code example
-        context_before: Context before the code
-        context_after: Context after the code
-        
     Returns:
-        A summary of what the code example demonstrates
+        The code summarizer
     """
-    model_choice = os.getenv("MODEL_CHOICE")
-    
-    # Create the prompt
-    prompt = f"""<context_before>
-{context_before[-500:] if len(context_before) > 500 else context_before}
-</context_before>
-
-<code_example>
-{code[:1500] if len(code) > 1500 else code}
-</code_example>
-
-<context_after>
-{context_after[:500] if len(context_after) > 500 else context_after}
-</context_after>
-
-Based on the code example and its surrounding context, provide a concise summary (2-3 sentences) that describes what this code example demonstrates and its purpose. Focus on the practical application and key concepts illustrated.
-"""
-    
-    try:
-        response = openai.chat.completions.create(
-            model=model_choice,
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that provides concise code example summaries."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.3,
-            max_tokens=100
+    global _code_summarizer
+    if _code_summarizer is None:
+        _code_summarizer = CodeSummarizer(
+            get_async_openai_client(),
+            os.getenv("MODEL_CHOICE"),
+            max_concurrency=int(os.getenv("CODE_SUMMARY_MAX_CONCURRENCY", "10")),
+            cache=get_summary_cache()
         )
-        
-        return response.choices[0].message.content.strip()
-    
-    except Exception as e:
-        print(f"Error generating code example summary: {e}")
-        return "Code example for demonstration purposes."
+    return _code_summarizer
 
 
-def add_code_examples_to_supabase(
-    client: Client,
+async def add_code_examples_to_supabase(
+    client: AsyncClient,
     urls: List[str],
     chunk_numbers: List[int],
     code_examples: List[str],
     summaries: List[str],
     metadatas: List[Dict[str, Any]],
-    batch_size: int = 20
+    batch_size: Optional[int] = None
 ):
     """
-    Add code examples to the Supabase code_examples table in batches.
+    Add code examples to the Supabase code_examples table through the ingestion pipeline.
     
     Args:
         client: Supabase client
@@ -504,128 +1223,128 @@ def add_code_examples_to_supabase(
         code_examples: List of code example contents
         summaries: List of code example summaries
         metadatas: List of metadata dictionaries
-        batch_size: Size of each batch for insertion
+        batch_size: Rows per insert request (default: INSERT_BATCH_SIZE)
     """
     if not urls:
         return
         
     # Delete existing records for these URLs
     unique_urls = list(set(urls))
-    for url in unique_urls:
-        try:
-            client.table('code_examples').delete().eq('url', url).execute()
-        except Exception as e:
-            print(f"Error deleting existing code examples for {url}: {e}")
-    
-    # Process in batches
-    total_items = len(urls)
-    for i in range(0, total_items, batch_size):
-        batch_end = min(i + batch_size, total_items)
-        batch_texts = []
-        
-        # Create combined texts for embedding (code + summary)
-        for j in range(i, batch_end):
-            combined_text = f"{code_examples[j]}\n\nSummary: {summaries[j]}"
-            batch_texts.append(combined_text)
-        
-        # Create embeddings for the batch
-        embeddings = create_embeddings_batch(batch_texts)
-        
-        # Check if embeddings are valid (not all zeros)
-        valid_embeddings = []
-        for embedding in embeddings:
-            if embedding and not all(v == 0.0 for v in embedding):
-                valid_embeddings.append(embedding)
-            else:
-                print(f"Warning: Zero or invalid embedding detected, creating new one...")
-                # Try to create a single embedding as fallback
-                single_embedding = create_embedding(batch_texts[len(valid_embeddings)])
-                valid_embeddings.append(single_embedding)
-        
-        # Prepare batch data
-        batch_data = []
-        for j, embedding in enumerate(valid_embeddings):
-            idx = i + j
-            
+    await delete_existing_records(client, "code_examples", unique_urls)
+    
+    async with IngestionPipeline(client, "code_examples", insert_batch_size=batch_size) as pipeline:
+        for url, chunk_number, code, summary, metadata in zip(urls, chunk_numbers, code_examples, summaries, metadatas):
             # Extract source_id from URL
-            parsed_url = urlparse(urls[idx])
+            parsed_url = urlparse(url)
             source_id = parsed_url.netloc or parsed_url.path
             
-            batch_data.append({
-                'url': urls[idx],
-                'chunk_number': chunk_numbers[idx],
-                'content': code_examples[idx],
-                'summary': summaries[idx],
-                'metadata': metadatas[idx],  # Store as JSON object, not string
-                'source_id': source_id,
-                'embedding': embedding
-            })
-        
-        # Insert batch into Supabase with retry logic
-        max_retries = 3
-        retry_delay = 1.0  # Start with 1 second delay
-        
-        for retry in range(max_retries):
-            try:
-                client.table('code_examples').insert(batch_data).execute()
-                # Success - break out of retry loop
-                break
-            except Exception as e:
-                if retry < max_retries - 1:
-                    print(f"Error inserting batch into Supabase (attempt {retry + 1}/{max_retries}): {e}")
-                    print(f"Retrying in {retry_delay} seconds...")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # Exponential backoff
-                else:
-                    # Final attempt failed
-                    print(f"Failed to insert batch after {max_retries} attempts: {e}")
-                    # Optionally, try inserting records one by one as a last resort
-                    print("Attempting to insert records individually...")
-                    successful_inserts = 0
-                    for record in batch_data:
-                        try:
-                            client.table('code_examples').insert(record).execute()
-                            successful_inserts += 1
-                        except Exception as individual_error:
-                            print(f"Failed to insert individual record for URL {record['url']}: {individual_error}")
-                    
-                    if successful_inserts > 0:
-                        print(f"Successfully inserted {successful_inserts}/{len(batch_data)} records individually")
-        print(f"Inserted batch {i//batch_size + 1} of {(total_items + batch_size - 1)//batch_size} code examples")
-
-
-def update_source_info(client: Client, source_id: str, summary: str, word_count: int):
-    """
-    Update or insert source information in the sources table.
+            row = {
+                'url': url,
+                'chunk_number': chunk_number,
+                'content': code,
+                'summary': summary,
+                'metadata': metadata,  # Store as JSON object, not string
+                'source_id': source_id
+            }
+            # Create combined text for embedding (code + summary)
+            await pipeline.put(IngestionItem(row=row, text=f"{code}\n\nSummary: {summary}"))
+    
+    print(f"Inserted {pipeline.rows_inserted}/{pipeline.items_received} code examples in {pipeline.embedding_batches} embedding batches")
+    print_embedding_cache_stats()
+
+
+async def ensure_source(client: AsyncClient, source_id: str) -> None:
+    """
+    Create a source if it doesn't exist yet, so its chunks can reference it.
+    
+    Args:
+        client: Supabase client
+        source_id: The source ID (domain)
+    """
+    await timed_execute("sources.upsert", client.table('sources').upsert(
+        {'source_id': source_id},
+        on_conflict='source_id',
+        ignore_duplicates=True,
+        returning=ReturnMethod.minimal
+    ))
+
+async def update_source_info(client: AsyncClient, source_id: str, pages_changed_since_summary: int, summary: Optional[str] = None):
+    """
+    Record a crawl of a source in the sources table.
+    
+    The page, chunk, word and code example counts are kept up to date by triggers
+    on the chunk tables, so only the crawl time, the summary and its staleness are set here.
     
     Args:
         client: Supabase client
         source_id: The source ID (domain)
-        summary: Summary of the source
-        word_count: Total word count for the source
+        pages_changed_since_summary: Pages whose content changed since the summary was generated
+        summary: New summary of the source (None keeps the current one)
     """
+    fields = {
+        'pages_changed_since_summary': pages_changed_since_summary,
+        'last_crawled_at': 'now()',
+        'updated_at': 'now()'
+    }
+    if summary is not None:
+        fields['summary'] = summary
     try:
-        # Try to update existing source
-        result = client.table('sources').update({
-            'summary': summary,
-            'total_word_count': word_count,
-            'updated_at': 'now()'
-        }).eq('source_id', source_id).execute()
-        
-        # If no rows were updated, insert new source
-        if not result.data:
-            client.table('sources').insert({
-                'source_id': source_id,
-                'summary': summary,
-                'total_word_count': word_count
-            }).execute()
-            print(f"Created new source: {source_id}")
-        else:
-            print(f"Updated source: {source_id}")
-            
+        await timed_execute("sources.update", client.table('sources').update(
+            fields,
+            returning=ReturnMethod.minimal
+        ).eq('source_id', source_id))
     except Exception as e:
         print(f"Error updating source {source_id}: {e}")
 
+async def refresh_source_info(
+    client: AsyncClient,
+    pages_changed: Dict[str, int],
+    summary_inputs: Dict[str, str]
+) -> int:
+    """
+    Record a crawl of each source and regenerate summaries that have gone stale.
+    
+    A source's summary is only regenerated (one LLM call) when it has none yet or when
+    the pages whose content changed since it was generated reach SOURCE_SUMMARY_REFRESH_RATIO
+    of the source's pages (default 0.25), so recrawling a mostly unchanged site is free.
+    
+    Args:
+        client: Supabase client
+        pages_changed: Number of pages whose content changed in this crawl, per crawled source
+        summary_inputs: Content to summarize for each source with changed pages
+        
+    Returns:
+        Number of summaries regenerated
+    """
+    if not pages_changed:
+        return 0
+    refresh_ratio = float(os.getenv("SOURCE_SUMMARY_REFRESH_RATIO", "0.25"))
+    
+    result = await timed_execute("sources.select", client.table('sources').select(
+        'source_id, summary, page_count, pages_changed_since_summary'
+    ).in_('source_id', list(pages_changed)))
+    sources = {row['source_id']: row for row in result.data or []}
+    
+    regenerated = 0
+    for source_id, changed in pages_changed.items():
+        source = sources.get(source_id, {})
+        changed += source.get('pages_changed_since_summary') or 0
+        summary = None
+        stale = not source.get('summary') or changed >= refresh_ratio * max(source.get('page_count') or 0, 1)
+        if stale and source_id in summary_inputs:
+            summary = await asyncio.to_thread(extract_source_summary, source_id, summary_inputs[source_id])
+            if summary != default_source_summary(source_id):
+                changed = 0
+                regenerated += 1
+            elif source.get('summary'):
+                # Keep the previous summary rather than replacing it with the fallback
+                summary = None
+        await update_source_info(client, source_id, changed, summary)
+    return regenerated
+
+def default_source_summary(source_id: str) -> str:
+    """Summary used for a source when none can be generated."""
+    return f"Content from {source_id}"
 
 def extract_source_summary(source_id: str, content: str, max_length: int = 500) -> str:
     """
@@ -642,7 +1361,7 @@ def extract_source_summary(source_id: str, content: str, max_length: int = 500)
         A summary string
     """
     # Default summary if we can't extract anything meaningful
-    default_summary = f"Content from {source_id}"
+    default_summary = default_source_summary(source_id)
     
     if not content or len(content.strip()) == 0:
         return default_summary
@@ -687,8 +1406,8 @@ The above content is from the documentation for '{source_id}'. Please provide a
         return default_summary
 
 
-def search_code_examples(
-    client: Client, 
+async def search_code_examples(
+    client: AsyncClient, 
     query: str, 
     match_count: int = 10, 
     filter_metadata: Optional[Dict[str, Any]] = None,
@@ -712,7 +1431,7 @@ def search_code_examples(
     enhanced_query = f"Code example for {query}\n\nSummary: Example code showing {query}"
     
     # Create embedding for the enhanced query
-    query_embedding = create_embedding(enhanced_query)
+    query_embedding = await create_query_embedding(enhanced_query)
     
     # Execute the search using the match_code_examples function
     try:
@@ -730,9 +1449,54 @@ def search_code_examples(
         if source_id:
             params['source_filter'] = source_id
         
-        result = client.rpc('match_code_examples', params).execute()
+        result = await timed_execute("code_examples.match", client.rpc('match_code_examples', params))
         
         return result.data
     except Exception as e:
         print(f"Error searching code examples: {e}")
+        return []
+
+
+async def hybrid_search_code_examples(
+    client: AsyncClient, 
+    query: str, 
+    match_count: int = 10, 
+    filter_metadata: Optional[Dict[str, Any]] = None,
+    source_id: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Search for code examples in Supabase combining full-text and vector similarity search.
+    
+    Args:
+        client: Supabase client
+        query: Query text
+        match_count: Maximum number of results to return
+        filter_metadata: Optional metadata filter
+        source_id: Optional source ID to filter results
+        
+    Returns:
+        List of matching code examples, ranked with reciprocal rank fusion
+    """
+    # The vector search uses the same descriptive query as search_code_examples,
+    # the full-text search uses the query as typed
+    enhanced_query = f"Code example for {query}\n\nSummary: Example code showing {query}"
+    query_embedding = await create_query_embedding(enhanced_query)
+    
+    try:
+        params = {
+            'query_text': query,
+            'query_embedding': query_embedding,
+            'match_count': match_count,
+            **get_hybrid_search_weights()
+        }
+        if filter_metadata:
+            params['filter'] = filter_metadata
+        if source_id:
+            params['source_filter'] = source_id
+        
+        result = await timed_execute("code_examples.hybrid_search", client.rpc('hybrid_search_code_examples', params))
+        
+        return result.data
+    except Exception as e:
+        print(f"Error in hybrid code example search: {e}")
         return []
\ No newline at end of file